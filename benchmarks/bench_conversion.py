@@ -0,0 +1,217 @@
+"""Mesure chaque phase de la conversion XSLT et le pic mémoire, et les compare à une référence
+
+Usage:
+    python benchmarks/bench_conversion.py [--facteurs 10 100] [--lignes N ...] [--baseline FICHIER]
+                                          [--enregistrer] [--seuil 0.25] [FICHIER_TOTEM ...]
+
+Sans fichier, le benchmark porte sur les fichiers totem de tests/exemples, et sur des versions
+agrandies de l'exemple _EXEMPLE_AGRANDI, dont les LigneBudget sont dupliquées --facteurs fois.
+--lignes ajoute des fichiers synthétiques de N LigneBudget (voir generer_totem.py).
+
+Phases mesurées (meilleur temps sur --repetitions exécutions):
+    parse: lecture du fichier totem
+    pdc:   recherche du plan de compte et construction de son index, cache vide
+    xslt:  transformation vers le XML intermédiaire, XSLT déjà compilée
+    csv:   écriture du CSV depuis le XML intermédiaire
+Le pic mémoire (Mo) est celui d'un processus neuf qui réalise une conversion complète (VmHWM sous Linux).
+
+Avec --enregistrer, les mesures sont écrites dans le fichier --baseline. Sinon, ce fichier est obligatoire
+(les mesures dépendant de la machine, la référence n'est pas versionnée) et le script échoue lorsqu'une phase dépasse sa référence de plus de --seuil (en proportion) et de plus
+de --tolerance-ms, ou lorsque le pic mémoire la dépasse de plus de --seuil et de --tolerance-mo.
+"""
+
+import argparse
+import io
+import json
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from lxml import etree
+
+from yatotem2scdl import ConvertisseurTotemBudget, Options
+from yatotem2scdl.conversion import _extraire_plan_de_compte, _xml_to_csv
+from yatotem2scdl.plan_de_compte import CachePlansDeComptes
+
+from generer_totem import ecrire_totem
+
+_RACINE = Path(__file__).parent.parent
+_EXEMPLES_PATH = _RACINE / "tests" / "exemples"
+_PLANS_DE_COMPTES = _RACINE / "tests" / "plans_de_comptes"
+_BASELINE = Path(__file__).parent / "baseline_conversion.json"
+_EXEMPLE_AGRANDI = "DOCBUDG-21560046100010-056025-CA-2021-01032022000000"
+
+_PHASES = ["parse", "pdc", "xslt", "csv"]
+
+
+def _document(convertisseur: ConvertisseurTotemBudget, totem_fpath: Path):
+    return convertisseur._ConvertisseurTotemBudget__document_budgetaire_tree(totem_fpath)  # type: ignore[attr-defined]
+
+
+def _pdc(document):
+    cache_pdc = CachePlansDeComptes()
+    pdc_fpath = _extraire_plan_de_compte(document, _PLANS_DE_COMPTES)
+    cache_pdc.index(pdc_fpath)
+    return pdc_fpath
+
+
+def _meilleur_temps(fonction, repetitions: int):
+    """Résultat de fonction et meilleur temps d'exécution, en millisecondes"""
+    meilleur = float("inf")
+    resultat = None
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        resultat = fonction()
+        meilleur = min(meilleur, time.perf_counter() - debut)
+    return resultat, meilleur * 1000
+
+
+def _mesurer_phases(totem_fpath: Path, repetitions: int) -> dict[str, float]:
+    convertisseur = ConvertisseurTotemBudget()
+    convertisseur._xslt_compilee()
+
+    document, parse_ms = _meilleur_temps(lambda: _document(convertisseur, totem_fpath), repetitions)
+    pdc_fpath, pdc_ms = _meilleur_temps(lambda: _pdc(document), repetitions)
+    intermediaire, xslt_ms = _meilleur_temps(
+        lambda: convertisseur._transform(document, pdc_fpath, Options()), repetitions
+    )
+    _, csv_ms = _meilleur_temps(
+        lambda: _xml_to_csv(intermediaire, io.StringIO(newline=""), Options()), repetitions
+    )
+    return {"parse": parse_ms, "pdc": pdc_ms, "xslt": xslt_ms, "csv": csv_ms}
+
+
+def _pic_memoire_conversion(totem_fpath: Path) -> float:
+    """Exécuté dans un processus neuf: pic de mémoire résidente (Mo) d'une conversion complète
+
+    ru_maxrss est hérité du processus parent à travers fork et exec: un processus neuf lancé par un
+    parent volumineux rapporterait le pic du parent. Sous Linux, on lit donc VmHWM, le pic propre à
+    l'espace mémoire du processus, remis à la mémoire résidente courante avant la conversion.
+    """
+    status_fpath = Path("/proc/self/status")
+    if status_fpath.exists():
+        Path("/proc/self/clear_refs").write_text("5")
+    with tempfile.TemporaryFile("w", encoding="utf-8", newline="") as output:
+        ConvertisseurTotemBudget().totem_budget_vers_scdl(totem_fpath, _PLANS_DE_COMPTES, output)
+
+    if status_fpath.exists():
+        for ligne in status_fpath.read_text().splitlines():
+            if ligne.startswith("VmHWM:"):
+                return int(ligne.split()[1]) / 1024
+
+    import resource
+
+    # Hors Linux, à défaut de VmHWM: ru_maxrss, en octets sous macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _pic_memoire(totem_fpath: Path) -> float:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+        return executor.submit(_pic_memoire_conversion, totem_fpath).result()
+
+
+def _agrandir(totem_fpath: Path, facteur: int, tmp_dpath: Path) -> Path:
+    """Copie du fichier totem dont chaque LigneBudget est dupliquée facteur fois"""
+    tree = etree.parse(str(totem_fpath))
+    for ligne in tree.iterfind(".//{*}LigneBudget"):
+        for _ in range(facteur - 1):
+            ligne.addnext(_copie(ligne))
+    agrandi_fpath = tmp_dpath / f"{totem_fpath.parent.name}-x{facteur}.xml"
+    tree.write(str(agrandi_fpath), xml_declaration=True, encoding="utf-8")
+    return agrandi_fpath
+
+
+def _copie(element):
+    copie = etree.fromstring(etree.tostring(element))
+    copie.tail = element.tail
+    return copie
+
+
+def _regressions(
+    mesures: dict[str, float], reference: dict[str, float], args: argparse.Namespace
+) -> list[str]:
+    regressions = []
+    for phase in _PHASES:
+        if phase in reference and _depasse(mesures[phase], reference[phase], args.seuil, args.tolerance_ms):
+            regressions.append(f"{phase} {mesures[phase]:.2f} ms (référence {reference[phase]:.2f} ms)")
+    if "memoire" in reference and _depasse(
+        mesures["memoire"], reference["memoire"], args.seuil, args.tolerance_mo
+    ):
+        regressions.append(f"mémoire {mesures['memoire']:.1f} Mo (référence {reference['memoire']:.1f} Mo)")
+    return regressions
+
+
+def _depasse(valeur: float, reference: float, seuil: float, tolerance: float) -> bool:
+    return valeur > reference * (1 + seuil) and valeur - reference > tolerance
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("totem_fpaths", nargs="*", type=Path)
+    parser.add_argument("--facteurs", type=int, nargs="*", default=[10, 100])
+    parser.add_argument("--lignes", type=int, nargs="*", default=[])
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--baseline", type=Path, default=_BASELINE)
+    parser.add_argument("--enregistrer", action="store_true")
+    parser.add_argument("--seuil", type=float, default=0.25)
+    parser.add_argument("--tolerance-ms", type=float, default=2.0, dest="tolerance_ms")
+    parser.add_argument("--tolerance-mo", type=float, default=5.0, dest="tolerance_mo")
+    args = parser.parse_args()
+
+    references = {}
+    if not args.enregistrer:
+        if not args.baseline.exists():
+            sys.exit(
+                f"Référence {args.baseline} absente: l'enregistrer sur la machine de mesure avec --enregistrer"
+            )
+        references = json.loads(args.baseline.read_text(encoding="utf-8"))
+
+    print(f"{'cas':<60} {'Ko':>8}" + "".join(f" {p + ' (ms)':>11}" for p in _PHASES) + f" {'pic (Mo)':>9}")
+    resultats = {}
+    regressions = {}
+    with tempfile.TemporaryDirectory() as tmp_dpath:
+        cas = {p.parent.name: p for p in args.totem_fpaths}
+        if not args.totem_fpaths:
+            cas = {p.parent.name: p for p in sorted(_EXEMPLES_PATH.glob("*/totem.xml"))}
+            for facteur in args.facteurs:
+                agrandi_fpath = _agrandir(_EXEMPLES_PATH / _EXEMPLE_AGRANDI / "totem.xml", facteur, Path(tmp_dpath))
+                cas[f"{_EXEMPLE_AGRANDI} x{facteur}"] = agrandi_fpath
+        for nb_lignes in args.lignes:
+            synthetique_fpath = Path(tmp_dpath) / f"synthetique-{nb_lignes}.xml"
+            ecrire_totem(synthetique_fpath, nb_lignes)
+            cas[f"synthétique {nb_lignes} lignes"] = synthetique_fpath
+
+        for nom, totem_fpath in cas.items():
+            mesures = _mesurer_phases(totem_fpath, args.repetitions)
+            mesures["memoire"] = _pic_memoire(totem_fpath)
+            resultats[nom] = mesures
+
+            taille_ko = totem_fpath.stat().st_size // 1024
+            print(
+                f"{nom[-60:]:<60} {taille_ko:>8}"
+                + "".join(f" {mesures[p]:>11.2f}" for p in _PHASES)
+                + f" {mesures['memoire']:>9.1f}"
+            )
+            if nom in references:
+                regressions[nom] = _regressions(mesures, references[nom], args)
+
+    if args.enregistrer:
+        args.baseline.write_text(json.dumps(resultats, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+        print(f"\nRéférence enregistrée dans {args.baseline}")
+        return
+
+    regressions = {nom: r for nom, r in regressions.items() if r}
+    if regressions:
+        print("\nRégressions:")
+        for nom, details in regressions.items():
+            for detail in details:
+                print(f"  {nom}: {detail}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
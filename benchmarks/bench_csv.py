@@ -0,0 +1,85 @@
+"""Compare l'écriture du CSV depuis le XML intermédiaire: ligne par ligne (implémentation précédente) et par paquets
+
+Usage:
+    python benchmarks/bench_csv.py [--facteur N] [FICHIER_TOTEM ...]
+
+Sans fichier, le benchmark porte sur les comptes administratifs (CA, CFU) de tests/exemples.
+La XSLT n'est exécutée qu'une fois par fichier: seule l'écriture du CSV est mesurée, vers un fichier
+et vers un fichier écrit ligne à ligne comme un terminal. --facteur duplique les lignes du XML intermédiaire.
+"""
+
+import argparse
+import copy
+import csv
+import tempfile
+import time
+from pathlib import Path
+
+from yatotem2scdl import ConvertisseurTotemBudget, Options
+from yatotem2scdl.conversion import _extraire_plan_de_compte, _xml_to_csv
+
+_RACINE = Path(__file__).parent.parent
+_EXEMPLES_PATH = _RACINE / "tests" / "exemples"
+_PLANS_DE_COMPTES = _RACINE / "tests" / "plans_de_comptes"
+_REPETITIONS = 10
+
+
+def _ligne_par_ligne(tree, text_io, options: Options):
+    header_names = [elt.attrib["name"] for elt in tree.iterfind("./header/column")]
+    writer = csv.writer(text_io)
+    writer.writerow(header_names)
+    for row_tag in tree.iterfind("./data/row"):
+        writer.writerow([cell.attrib["value"] for cell in row_tag.iter("cell")])
+
+
+def _xml_intermediaire(convertisseur: ConvertisseurTotemBudget, totem_fpath: Path, facteur: int):
+    document = convertisseur._ConvertisseurTotemBudget__document_budgetaire_tree(totem_fpath)  # type: ignore[attr-defined]
+    pdc_fpath = _extraire_plan_de_compte(document, _PLANS_DE_COMPTES)
+    tree = convertisseur._transform(document, pdc_fpath, Options())
+
+    data = tree.getroot().find("data")
+    rows = list(data)
+    for _ in range(facteur - 1):
+        for row in rows:
+            data.append(copy.deepcopy(row))
+    return tree, len(data)
+
+
+def _mesurer(ecriture, tree, csv_fpath: Path, buffering: int) -> float:
+    """Meilleur temps, en millisecondes, sur _REPETITIONS exécutions"""
+    meilleur = float("inf")
+    for _ in range(_REPETITIONS):
+        debut = time.perf_counter()
+        with open(csv_fpath, "w", encoding="utf-8", newline="", buffering=buffering) as output:
+            ecriture(tree, output, Options())
+        meilleur = min(meilleur, time.perf_counter() - debut)
+    return meilleur * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("totem_fpaths", nargs="*", type=Path)
+    parser.add_argument("--facteur", type=int, default=1)
+    args = parser.parse_args()
+
+    totem_fpaths = args.totem_fpaths or sorted(
+        p for p in _EXEMPLES_PATH.glob("*/totem.xml") if "-CA-" in p.parent.name or "-CFU-" in p.parent.name
+    )
+    convertisseur = ConvertisseurTotemBudget()
+
+    print(f"{'fichier':<50} {'lignes':>7} {'sortie':>8} {'ligne (ms)':>11} {'paquets (ms)':>13} {'gain':>6}")
+    with tempfile.TemporaryDirectory() as tmp_dpath:
+        csv_fpath = Path(tmp_dpath) / "scdl.csv"
+        for totem_fpath in totem_fpaths:
+            tree, nb_lignes = _xml_intermediaire(convertisseur, totem_fpath, args.facteur)
+            for sortie, buffering in [("fichier", -1), ("terminal", 1)]:
+                avant_ms = _mesurer(_ligne_par_ligne, tree, csv_fpath, buffering)
+                apres_ms = _mesurer(_xml_to_csv, tree, csv_fpath, buffering)
+                print(
+                    f"{totem_fpath.parent.name[-50:]:<50} {nb_lignes:>7} {sortie:>8}"
+                    f" {avant_ms:>11.2f} {apres_ms:>13.2f} {avant_ms / apres_ms:>5.1f}x"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Mesure le temps de démarrage du package et de la commande yatotem2scdl
+
+Usage:
+    python benchmarks/bench_import.py [--seuil-ms SEUIL]
+
+Chaque cas est exécuté dans un interpréteur neuf. Avec --seuil-ms, le script échoue
+si le démarrage de la commande metadata dépasse le seuil, ou si elle charge lxml.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+_RACINE = Path(__file__).parent.parent
+_TOTEM = _RACINE / "tests" / "exemples" / "BP2022_TRANSPORT" / "totem.xml"
+_PLANS_DE_COMPTES = _RACINE / "tests" / "plans_de_comptes"
+_REPETITIONS = 10
+
+_COMMANDE_METADATA = (
+    "import sys\n"
+    "from yatotem2scdl.main import main\n"
+    f"sys.argv = ['yatotem2scdl', 'metadata', {str(_TOTEM)!r}, '--plans-de-comptes', {str(_PLANS_DE_COMPTES)!r}]\n"
+    "try:\n"
+    "    main()\n"
+    "except SystemExit:\n"
+    "    pass\n"
+    "sys.exit(1 if 'lxml' in sys.modules else 0)\n"
+)
+
+_CAS = {
+    "python seul": "pass",
+    "import yatotem2scdl": "import yatotem2scdl",
+    "import des exceptions": "from yatotem2scdl import ConversionErreur",
+    "commande metadata": _COMMANDE_METADATA,
+    "import du convertisseur": "from yatotem2scdl import ConvertisseurTotemBudget",
+}
+
+
+def _mesurer(code: str) -> float:
+    """Meilleur temps, en millisecondes, sur _REPETITIONS interpréteurs"""
+    meilleur = float("inf")
+    for _ in range(_REPETITIONS):
+        debut = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
+        meilleur = min(meilleur, time.perf_counter() - debut)
+    return meilleur * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seuil-ms", type=float, default=None, dest="seuil_ms")
+    args = parser.parse_args()
+
+    print(f"{'cas':<30} {'ms':>8}")
+    temps = {}
+    for nom, code in _CAS.items():
+        try:
+            temps[nom] = _mesurer(code)
+        except subprocess.CalledProcessError:
+            print(f"{nom:<30} {'ECHEC':>8}")
+            sys.exit(1)
+        print(f"{nom:<30} {temps[nom]:>8.1f}")
+
+    if args.seuil_ms is not None and temps["commande metadata"] > args.seuil_ms:
+        print(f"Démarrage de la commande metadata au-delà de {args.seuil_ms} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compare l'extraction des metadata par XMLPullParser (implémentation actuelle) et par le handler SAX
+
+Usage:
+    python benchmarks/bench_metadata.py [FICHIER_TOTEM ...]
+
+Sans argument, le benchmark porte sur les fichiers totem de tests/exemples.
+Chaque fichier est aussi mesuré sans sa balise Scellement: le handler SAX
+parcourt alors tout le fichier.
+"""
+
+import re
+import sys
+import tempfile
+import time
+import xml.sax
+from pathlib import Path
+
+from yatotem2scdl.conversion import _lire_metadata
+from yatotem2scdl.TotemMetadataHandler import FinishedParsing, TotemMetadataHandler
+
+_EXEMPLES_PATH = Path(__file__).parent.parent / "tests" / "exemples"
+_REPETITIONS = 20
+
+
+def _sax(totem_fpath: Path):
+    handler = TotemMetadataHandler()
+    try:
+        xml.sax.parse(str(totem_fpath), handler)
+    except FinishedParsing:
+        pass
+
+
+def _pull(totem_fpath: Path):
+    _lire_metadata(totem_fpath)
+
+
+def _mesurer(fonction, totem_fpath: Path) -> float:
+    """Meilleur temps, en millisecondes, sur _REPETITIONS exécutions"""
+    meilleur = float("inf")
+    for _ in range(_REPETITIONS):
+        debut = time.perf_counter()
+        fonction(totem_fpath)
+        meilleur = min(meilleur, time.perf_counter() - debut)
+    return meilleur * 1000
+
+
+def _sans_scellement(totem_fpath: Path, tmp_dpath: Path) -> Path:
+    copie = tmp_dpath / f"{totem_fpath.parent.name}-sans-scellement.xml"
+    copie.write_bytes(re.sub(rb"<([\w:]*)Scellement[^>]*/>", b"", totem_fpath.read_bytes()))
+    return copie
+
+
+def _afficher(nom: str, totem_fpath: Path):
+    sax_ms = _mesurer(_sax, totem_fpath)
+    pull_ms = _mesurer(_pull, totem_fpath)
+    taille_ko = totem_fpath.stat().st_size // 1024
+    print(f"{nom[-60:]:<60} {taille_ko:>8} {sax_ms:>10.2f} {pull_ms:>10.2f} {sax_ms / pull_ms:>6.1f}x")
+
+
+def main():
+    totem_fpaths = [Path(p) for p in sys.argv[1:]] or sorted(
+        p for p in _EXEMPLES_PATH.glob("*/totem.xml")
+    )
+
+    print(f"{'fichier':<60} {'Ko':>8} {'sax (ms)':>10} {'pull (ms)':>10} {'gain':>7}")
+    with tempfile.TemporaryDirectory() as tmp_dpath:
+        for totem_fpath in totem_fpaths:
+            _afficher(str(totem_fpath.parent.name), totem_fpath)
+            _afficher(
+                f"{totem_fpath.parent.name} (sans Scellement)",
+                _sans_scellement(totem_fpath, Path(tmp_dpath)),
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Génère des fichiers totem budget synthétiques, de taille arbitraire, pour les tests de charge
+
+Usage:
+    python benchmarks/generer_totem.py --lignes N [--calculees 0.1] [--etapes primitif ca]
+                                       [--plan-de-compte FICHIER] [--graine 0] [--sortie DOSSIER]
+
+Les codes Nature, ContNat et Fonction sont tirés du plan de compte donné, dont la nomenclature et
+l'exercice sont repris dans l'entête: le fichier produit est donc converti avec ce plan de compte.
+Avec --calculees, des LigneBudget calculated="true" (ignorées par la conversion) sont ajoutées
+en proportion des N lignes. Un fichier est produit par étape budgétaire: les lignes, tirées avec
+la même graine, sont identiques d'une étape à l'autre, seuls les montants changent.
+Le fichier est écrit au fil de l'eau, la mémoire consommée ne dépend pas de N.
+"""
+
+import argparse
+import io
+import random
+from dataclasses import dataclass
+from decimal import Decimal
+from pathlib import Path
+from typing import BinaryIO, Union
+from xml.sax.saxutils import quoteattr
+
+from lxml import etree
+
+from yatotem2scdl import EtapeBudgetaire
+
+_RACINE = Path(__file__).parent.parent
+_PLAN_DE_COMPTE = _RACINE / "tests" / "plans_de_comptes" / "2022" / "M14" / "M14_COM_SUP3500" / "planDeCompte.xml"
+_NAMESPACE = "http://www.minefi.gouv.fr/cp/demat/docbudgetaire"
+_SIRET = "21560046100010"
+
+_ETAPES_AVEC_REALISE = (EtapeBudgetaire.COMPTE_ADMIN, EtapeBudgetaire.CFU)
+
+
+@dataclass(frozen=True)
+class _Compte:
+    code: str
+    chapitres: tuple[tuple[str, str, str], ...]  # (CodRD, OpBudg, ContNat) possibles pour ce compte
+
+
+@dataclass(frozen=True)
+class _PlanDeCompte:
+    nomenclature: str
+    exercice: str
+    comptes: list[_Compte]
+    fonctions: list[str]
+
+
+def _lire_plan_de_compte(pdc_fpath: Path) -> _PlanDeCompte:
+    racine = etree.parse(str(pdc_fpath)).getroot()
+
+    comptes = []
+    for compte in racine.iterfind("./Nature/Comptes//Compte"):
+        if compte.find("Compte") is not None:
+            continue
+        # Chapitre du compte en dépense ou recette, réelle ou d'ordre
+        chapitres = tuple(
+            (codrd, opbudg, compte.get(attribut))
+            for codrd, opbudg, attribut in [("D", "0", "DR"), ("R", "0", "RR"), ("D", "1", "DOES"), ("R", "1", "ROES")]
+            if compte.get(attribut)
+        )
+        if chapitres:
+            comptes.append(_Compte(compte.get("Code"), chapitres))
+    if not comptes:
+        raise ValueError(f"Aucun compte rattaché à un chapitre dans {pdc_fpath}")
+
+    fonctions = [
+        ref.get("Code")
+        for ref in racine.iterfind("./Fonction/RefFonctionnelles//RefFonc")
+        if ref.find("RefFonc") is None
+    ]
+    return _PlanDeCompte(
+        nomenclature=f"{racine.get('Norme')}-{racine.get('Declinaison')}",
+        exercice=racine.get("Exer"),
+        comptes=comptes,
+        fonctions=fonctions,
+    )
+
+
+def ecrire_totem(
+    output: Union[Path, BinaryIO],
+    nb_lignes: int,
+    etape: EtapeBudgetaire = EtapeBudgetaire.PRIMITIF,
+    pdc_fpath: Path = _PLAN_DE_COMPTE,
+    proportion_calculees: float = 0.0,
+    graine: int = 0,
+):
+    """Ecrit un fichier totem synthétique de nb_lignes LigneBudget converties en SCDL
+
+    Args:
+        output (Path | BinaryIO): Fichier produit.
+        nb_lignes (int): Nombre de LigneBudget non calculées, donc de lignes du SCDL.
+        etape (EtapeBudgetaire, optional): Etape budgétaire du document. Defaults to EtapeBudgetaire.PRIMITIF.
+        pdc_fpath (Path, optional): Plan de compte dont sont tirés les codes.
+        proportion_calculees (float, optional): Nombre de lignes calculées ajoutées, rapporté à nb_lignes.
+          Defaults to 0.0.
+        graine (int, optional): Graine du tirage des lignes. Defaults to 0.
+    """
+    if isinstance(output, Path):
+        with open(output, "wb") as f:
+            ecrire_totem(f, nb_lignes, etape, pdc_fpath, proportion_calculees, graine)
+        return
+
+    pdc = _lire_plan_de_compte(pdc_fpath)
+    tirage_lignes = random.Random(graine)
+    tirage_montants = random.Random(f"{graine}-{etape.value}")
+
+    texte = io.TextIOWrapper(output, encoding="utf-8", newline="\n")
+    try:
+        texte.write(_entete(pdc, etape))
+        for _ in range(nb_lignes):
+            texte.write(_ligne(pdc, etape, tirage_lignes, tirage_montants))
+            if tirage_lignes.random() < proportion_calculees:
+                texte.write(_ligne(pdc, etape, tirage_lignes, tirage_montants, calculee=True))
+        texte.write("   </Budget>\n</DocumentBudgetaire>\n")
+        texte.flush()
+    finally:
+        texte.detach()
+
+
+def _entete(pdc: _PlanDeCompte, etape: EtapeBudgetaire) -> str:
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<DocumentBudgetaire xmlns="{_NAMESPACE}">
+   <VersionSchema V="100"/>
+   <Scellement date="{pdc.exercice}-04-07T10:16:21.216+02:00"/>
+   <EnTeteDocBudgetaire>
+      <LibelleColl V="COLLECTIVITE SYNTHETIQUE {etape.name}"/>
+      <IdColl V="{_SIRET}"/>
+   </EnTeteDocBudgetaire>
+   <Budget>
+      <EnTeteBudget>
+         <LibelleEtab V="BUDGET PRINCIPAL"/>
+         <IdEtab V="{_SIRET}"/>
+         <Nomenclature V={quoteattr(pdc.nomenclature)}/>
+      </EnTeteBudget>
+      <BlocBudget>
+         <NatDec V="{etape.value:02d}"/>
+         <Exer V={quoteattr(pdc.exercice)}/>
+      </BlocBudget>
+"""
+
+
+def _ligne(
+    pdc: _PlanDeCompte,
+    etape: EtapeBudgetaire,
+    tirage_lignes: random.Random,
+    tirage_montants: random.Random,
+    calculee: bool = False,
+) -> str:
+    compte = tirage_lignes.choice(pdc.comptes)
+    codrd, opbudg, contnat = tirage_lignes.choice(compte.chapitres)
+    valeurs = [("Nature", compte.code)]
+    if pdc.fonctions and tirage_lignes.random() < 0.5:
+        valeurs.append(("Fonction", tirage_lignes.choice(pdc.fonctions)))
+    valeurs += [("ContNat", contnat), ("ArtSpe", "false"), ("CodRD", codrd)]
+
+    prevu = _montant(tirage_montants)
+    valeurs += [
+        ("MtBudgPrec", _montant(tirage_montants)),
+        ("MtPropNouv", prevu),
+        ("MtPrev", prevu),
+        ("CredOuv", prevu),
+    ]
+    if etape in _ETAPES_AVEC_REALISE:
+        valeurs += [("MtReal", _montant(tirage_montants)), ("MtRAR3112", _montant(tirage_montants))]
+    valeurs.append(("OpBudg", opbudg))
+
+    balise = '<LigneBudget calculated="true">' if calculee else "<LigneBudget>"
+    elements = "".join(f"         <{nom} V={quoteattr(valeur)}/>\n" for nom, valeur in valeurs)
+    return f"      {balise}\n{elements}      </LigneBudget>\n"
+
+
+def _montant(tirage: random.Random) -> str:
+    return str(Decimal(tirage.randrange(0, 100_000_000)) / 100)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lignes", type=int, required=True)
+    parser.add_argument("--calculees", type=float, default=0.0)
+    parser.add_argument("--etapes", nargs="+", type=EtapeBudgetaire.from_str, default=[EtapeBudgetaire.PRIMITIF])
+    parser.add_argument("--plan-de-compte", type=Path, default=_PLAN_DE_COMPTE, dest="pdc_fpath")
+    parser.add_argument("--graine", type=int, default=0)
+    parser.add_argument("--sortie", type=Path, default=Path("."))
+    args = parser.parse_args()
+
+    args.sortie.mkdir(parents=True, exist_ok=True)
+    for etape in args.etapes:
+        totem_fpath = args.sortie / f"totem-{etape.name.lower()}-{args.lignes}.xml"
+        ecrire_totem(totem_fpath, args.lignes, etape, args.pdc_fpath, args.calculees, args.graine)
+        print(totem_fpath)
+
+
+if __name__ == "__main__":
+    main()
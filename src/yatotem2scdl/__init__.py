@@ -1,23 +1,142 @@
 import logging
 logger = logging.getLogger(__name__)
 
-from .exceptions import (
-    ConversionErreur,
-    ExtractionMetadataErreur,
-    CaractereAppostropheErreur,
-    TotemInvalideErreur,
-    SiretInvalideErreur,
-    NomenclatureInvalideErreur,
-    AnneeExerciceInvalideErreur,
-    EtapeBudgetaireInconnueErreur,
-)
-
-from .data_structures import (
-    EtapeBudgetaire, EtapeBudgetaireStrInvalideError,
-    TotemBudgetMetadata,
-    Options
-)
-
-from .conversion import (
-    ConvertisseurTotemBudget
-)
+from typing import TYPE_CHECKING
+
+#
+# Les symboles publics sont importés à la demande (PEP 562): importer le package,
+# ou seulement les exceptions, ne charge ni lxml ni la XSLT.
+#
+_IMPORTS_PARESSEUX = {
+    "ConversionErreur": ".exceptions",
+    "ExtractionMetadataErreur": ".exceptions",
+    "CaractereAppostropheErreur": ".exceptions",
+    "TotemInvalideErreur": ".exceptions",
+    "SiretInvalideErreur": ".exceptions",
+    "NomenclatureInvalideErreur": ".exceptions",
+    "AnneeExerciceInvalideErreur": ".exceptions",
+    "EtapeBudgetaireInconnueErreur": ".exceptions",
+    "EtapeBudgetaire": ".data_structures",
+    "EtapeBudgetaireStrInvalideError": ".data_structures",
+    "TotemBudgetMetadata": ".data_structures",
+    "MoteurConversion": ".data_structures",
+    "FormatSortie": ".data_structures",
+    "Options": ".data_structures",
+    "ResultatConversion": ".data_structures",
+    "ResultatMetadata": ".data_structures",
+    "ResultatIncremental": ".data_structures",
+    "DocumentIncremental": ".data_structures",
+    "DocumentEnveloppe": ".data_structures",
+    "SourceTotem": ".sources",
+    "lire_totem_budget_metadata": ".metadata",
+    "CachePlansDeComptes": ".plan_de_compte",
+    "PlansDeComptesCompiles": ".plans_de_comptes_compiles",
+    "compiler_plans_de_comptes": ".plans_de_comptes_compiles",
+    "ConvertisseurTotemBudget": ".conversion",
+    "CacheMetadata": ".cache_metadata",
+    "CacheScdl": ".cache_scdl",
+    "MetriquesConversion": ".metriques",
+    "MesureConversion": ".metriques",
+    "convertir_lot": ".lot",
+    "metadata_lot": ".lot",
+    "ConvertisseurAsync": ".asynchrone",
+    "OperationDelta": ".incremental",
+    "SortiePartitionnee": ".partitions",
+    "ManifestePartitions": ".partitions",
+}
+
+__all__ = ["logger", *_IMPORTS_PARESSEUX]
+
+
+def __getattr__(name: str):
+    module_name = _IMPORTS_PARESSEUX.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    import importlib
+
+    valeur = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = valeur
+    return valeur
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_IMPORTS_PARESSEUX))
+
+
+if TYPE_CHECKING:
+    from .exceptions import (
+        ConversionErreur,
+        ExtractionMetadataErreur,
+        CaractereAppostropheErreur,
+        TotemInvalideErreur,
+        SiretInvalideErreur,
+        NomenclatureInvalideErreur,
+        AnneeExerciceInvalideErreur,
+        EtapeBudgetaireInconnueErreur,
+    )
+
+    from .data_structures import (
+        EtapeBudgetaire, EtapeBudgetaireStrInvalideError,
+        TotemBudgetMetadata,
+        MoteurConversion,
+        FormatSortie,
+        Options,
+        ResultatConversion,
+        ResultatMetadata,
+        ResultatIncremental,
+        DocumentIncremental,
+        DocumentEnveloppe,
+    )
+
+    from .sources import (
+        SourceTotem
+    )
+
+    from .metadata import (
+        lire_totem_budget_metadata
+    )
+
+    from .plan_de_compte import (
+        CachePlansDeComptes
+    )
+
+    from .plans_de_comptes_compiles import (
+        PlansDeComptesCompiles,
+        compiler_plans_de_comptes,
+    )
+
+    from .conversion import (
+        ConvertisseurTotemBudget
+    )
+
+    from .cache_metadata import (
+        CacheMetadata
+    )
+
+    from .cache_scdl import (
+        CacheScdl
+    )
+
+    from .metriques import (
+        MetriquesConversion,
+        MesureConversion,
+    )
+
+    from .lot import (
+        convertir_lot,
+        metadata_lot,
+    )
+
+    from .asynchrone import (
+        ConvertisseurAsync
+    )
+
+    from .incremental import (
+        OperationDelta
+    )
+
+    from .partitions import (
+        SortiePartitionnee,
+        ManifestePartitions,
+    )
@@ -0,0 +1,237 @@
+"""API asyncio de conversion: les conversions tournent sur un pool de threads, le SCDL est renvoyé par morceaux
+
+Les threads partagent un même ConvertisseurTotemBudget, donc sa XSLT compilée et ses caches.
+lxml relâche le GIL pendant le parsing et la transformation XSLT, l'essentiel de la conversion
+s'exécute donc en parallèle de la boucle d'évènements.
+"""
+
+import asyncio
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional, TypeVar, Union
+
+from yatotem2scdl import logger
+
+from .conversion import ConvertisseurTotemBudget
+from .data_structures import Options, TotemBudgetMetadata
+from .sources import SourceTotem, description
+
+T = TypeVar("T")
+
+_FIN = object()
+
+
+class ConvertisseurAsync:
+    def __init__(
+        self,
+        convertisseur: Optional[ConvertisseurTotemBudget] = None,
+        concurrence: Optional[int] = None,
+        taille_morceau: int = 64 * 1024,
+        morceaux_en_attente: int = 8,
+    ):
+        """Conversions totem vers SCDL depuis une boucle asyncio
+
+        Une instance est utilisée depuis une seule boucle d'évènements, et fermée par fermer()
+        ou en l'utilisant comme gestionnaire de contexte asynchrone.
+
+        Args:
+            convertisseur (ConvertisseurTotemBudget, optional): Convertisseur partagé par toutes les conversions.
+              Defaults to None (un convertisseur par défaut).
+            concurrence (int, optional): Nombre maximum de conversions et d'extractions de metadata simultanées.
+              Les suivantes attendent qu'une place se libère. Defaults to None (nombre de CPU).
+            taille_morceau (int, optional): Taille des morceaux de SCDL renvoyés, en caractères
+              (ou en octets pour les formats binaires). Le dernier peut être plus court. Defaults to 64 Kio.
+            morceaux_en_attente (int, optional): Nombre de morceaux produits d'avance. Au-delà, la conversion
+              attend que les morceaux soient consommés. Defaults to 8.
+        """
+        if concurrence is None:
+            concurrence = os.cpu_count() or 1
+        if concurrence < 1 or taille_morceau < 1 or morceaux_en_attente < 1:
+            raise ValueError("La concurrence, la taille des morceaux et leur nombre en attente doivent être d'au moins 1")
+
+        if convertisseur is None:
+            convertisseur = ConvertisseurTotemBudget()
+        self.convertisseur = convertisseur
+        self.concurrence = concurrence
+        self.taille_morceau = taille_morceau
+        self.morceaux_en_attente = morceaux_en_attente
+
+        self.__executor = ThreadPoolExecutor(max_workers=concurrence, thread_name_prefix="yatotem2scdl")
+        # Créé à la première utilisation, dans la boucle d'évènements
+        self.__places: Optional[asyncio.Semaphore] = None
+
+    async def convertir(
+        self,
+        totem_fpath: SourceTotem,
+        pdcs_dpath: Path,
+        options: Options = Options(),
+    ) -> AsyncIterator[Union[str, bytes]]:
+        """Convertit un fichier totem et renvoie le SCDL par morceaux, au fil de la conversion
+
+        Interrompre l'itération (break, annulation de la tâche, aclose) arrête la conversion.
+
+        Args:
+            totem_fpath (SourceTotem): Voir ConvertisseurTotemBudget.totem_budget_vers_scdl.
+            pdcs_dpath (Path): Chemin contenant les plans de comptes.
+            options (Options, optional): Diverses options. Defaults to Options().
+
+        Raises:
+            ConversionErreur: ou une classe fille suivant la nature de l'erreur.
+
+        Yields:
+            str | bytes: Morceaux du SCDL, en bytes pour les formats de sortie binaires.
+        """
+        async with self.__place():
+            loop = asyncio.get_running_loop()
+            flux = _FluxMorceaux(
+                loop, options.format_sortie.binaire, self.taille_morceau, self.morceaux_en_attente
+            )
+            travail = loop.run_in_executor(
+                self.__executor, self.__convertir_vers, flux, totem_fpath, pdcs_dpath, options
+            )
+            termine = False
+            try:
+                while True:
+                    morceau = await flux.morceaux.get()
+                    if morceau is _FIN:
+                        break
+                    flux.places.release()
+                    yield morceau
+                await travail
+                termine = True
+            finally:
+                if not termine:
+                    flux.annuler()
+                    # La place n'est rendue qu'une fois le thread de conversion arrêté
+                    await asyncio.wait([travail])
+                    logger.debug(f"Conversion de {description(totem_fpath)} interrompue")
+
+    async def metadata(self, totem_fpath: SourceTotem, pdcs_dpath: Path) -> TotemBudgetMetadata:
+        """Extrait les metadata d'un fichier totem. Voir ConvertisseurTotemBudget.totem_budget_metadata
+
+        Raises:
+            ExtractionMetadataErreur: si les metadata ne peuvent être extraites.
+        """
+        return await self.__executer(self.convertisseur.totem_budget_metadata, totem_fpath, pdcs_dpath)
+
+    async def fermer(self):
+        """Attend la fin des conversions en cours et arrête le pool de threads"""
+        await asyncio.get_running_loop().run_in_executor(None, self.__executor.shutdown)
+
+    async def __aenter__(self) -> "ConvertisseurAsync":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.fermer()
+
+    @asynccontextmanager
+    async def __place(self):
+        if self.__places is None:
+            self.__places = asyncio.Semaphore(self.concurrence)
+        async with self.__places:
+            yield
+
+    async def __executer(self, fonction: Callable[..., T], *args) -> T:
+        async with self.__place():
+            futur = asyncio.get_running_loop().run_in_executor(self.__executor, fonction, *args)
+            try:
+                return await asyncio.shield(futur)
+            except asyncio.CancelledError:
+                await asyncio.wait([futur])
+                raise
+
+    def __convertir_vers(
+        self, flux: "_FluxMorceaux", totem_fpath: SourceTotem, pdcs_dpath: Path, options: Options
+    ):
+        try:
+            self.convertisseur.totem_budget_vers_scdl(totem_fpath, pdcs_dpath, flux, options)  # type: ignore[arg-type]
+            flux.vider()
+        finally:
+            flux.terminer()
+
+
+class _ConversionAnnulee(Exception):
+    pass
+
+
+class _FluxMorceaux(io.RawIOBase):
+    """Sortie de la conversion, écrite par le thread de conversion et lue par la boucle d'évènements
+
+    Les écritures sont regroupées puis découpées en morceaux de taille_morceau. Le thread de conversion
+    attend lorsque morceaux_en_attente morceaux n'ont pas encore été lus.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        binaire: bool,
+        taille_morceau: int,
+        morceaux_en_attente: int,
+    ):
+        super().__init__()
+        self.morceaux: asyncio.Queue = asyncio.Queue()
+        self.places = threading.Semaphore(morceaux_en_attente)
+
+        self.__loop = loop
+        self.__binaire = binaire
+        self.__taille_morceau = taille_morceau
+        self.__annule = threading.Event()
+        self.__tampon: list = []
+        self.__taille_tampon = 0
+        self.__position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.__position
+
+    def write(self, donnees) -> int:
+        if self.__annule.is_set():
+            raise _ConversionAnnulee()
+        if self.__binaire:
+            donnees = bytes(donnees)
+        taille = len(donnees)
+        self.__tampon.append(donnees)
+        self.__taille_tampon += taille
+        self.__position += taille
+        if self.__taille_tampon >= self.__taille_morceau:
+            contenu = (b"" if self.__binaire else "").join(self.__tampon)
+            debut = 0
+            while len(contenu) - debut >= self.__taille_morceau:
+                self.__envoyer(contenu[debut:debut + self.__taille_morceau])
+                debut += self.__taille_morceau
+            reste = contenu[debut:]
+            self.__tampon = [reste]
+            self.__taille_tampon = len(reste)
+        return taille
+
+    def vider(self):
+        """Envoie le reste du tampon comme dernier morceau"""
+        if self.__taille_tampon > 0:
+            self.__envoyer((b"" if self.__binaire else "").join(self.__tampon))
+        self.__tampon = []
+        self.__taille_tampon = 0
+
+    def __envoyer(self, morceau):
+        # Attend qu'une place se libère
+        self.places.acquire()
+        if self.__annule.is_set():
+            raise _ConversionAnnulee()
+        self.__loop.call_soon_threadsafe(self.morceaux.put_nowait, morceau)
+
+    def terminer(self):
+        try:
+            self.__loop.call_soon_threadsafe(self.morceaux.put_nowait, _FIN)
+        except RuntimeError:
+            # Boucle d'évènements déjà fermée: plus personne n'attend la fin
+            pass
+
+    def annuler(self):
+        self.__annule.set()
+        # Débloque le thread de conversion s'il attend une place
+        self.places.release()
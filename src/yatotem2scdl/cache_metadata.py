@@ -0,0 +1,186 @@
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+from yatotem2scdl import logger
+
+from .data_structures import (
+    EtapeBudgetaire,
+    ResultatMetadata,
+    TotemBudgetMetadata,
+    TotemBudgetScellement,
+)
+from .exceptions import ExtractionMetadataErreur
+
+# (mtime en ns, taille en octets) d'un fichier totem
+Signature = tuple[int, int]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    chemin TEXT NOT NULL,
+    pdcs TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    taille INTEGER NOT NULL,
+    annee INTEGER,
+    siret INTEGER,
+    etape INTEGER,
+    scellement TEXT,
+    plan_de_compte TEXT,
+    erreur TEXT,
+    PRIMARY KEY (chemin, pdcs)
+)
+"""
+
+
+def signature(totem_fpath: Path) -> Optional[Signature]:
+    """Signature d'un fichier totem, None s'il est illisible"""
+    try:
+        stat = Path(totem_fpath).stat()
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class CacheMetadata:
+    def __init__(self, fpath: Path):
+        """Cache persistant des metadata de fichiers totem, stocké dans une base sqlite locale.
+
+        Une entrée est identifiée par le chemin du fichier totem et le dossier des plans de comptes.
+        Elle n'est valide que tant que la date de modification et la taille du fichier sont inchangées.
+        Les erreurs d'extraction sont aussi mises en cache, sans leur cause.
+
+        Args:
+            fpath (Path): Chemin du fichier de cache. Créé s'il n'existe pas.
+        """
+        self.fpath = Path(fpath)
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = threading.Lock()
+        self.__connexion = sqlite3.connect(str(self.fpath), check_same_thread=False)
+        with self.__connexion:
+            self.__connexion.execute(_SCHEMA)
+
+    def lire(
+        self,
+        totem_fpath: Path,
+        pdcs_dpath: Path,
+        signature_totem: Optional[Signature] = None,
+    ) -> Optional[ResultatMetadata]:
+        """Renvoie le résultat en cache pour ce fichier, ou None s'il est absent ou périmé"""
+        if signature_totem is None:
+            signature_totem = signature(totem_fpath)
+        if signature_totem is None:
+            return None
+
+        with self.__lock:
+            ligne = self.__connexion.execute(
+                "SELECT mtime_ns, taille, annee, siret, etape, scellement, plan_de_compte, erreur"
+                " FROM metadata WHERE chemin = ? AND pdcs = ?",
+                (_cle(totem_fpath), _cle(pdcs_dpath)),
+            ).fetchone()
+
+            if ligne is None or (ligne[0], ligne[1]) != signature_totem:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        annee, siret, etape, scellement, plan_de_compte, erreur = ligne[2:]
+        if erreur is not None:
+            return ResultatMetadata(
+                totem_fpath=totem_fpath,
+                metadata=None,
+                erreur=ExtractionMetadataErreur(erreur),
+            )
+
+        return ResultatMetadata(
+            totem_fpath=totem_fpath,
+            metadata=TotemBudgetMetadata(
+                annee_exercice=annee,
+                id_etablissement=siret,
+                etape_budgetaire=EtapeBudgetaire(etape),
+                scellement=(
+                    TotemBudgetScellement(datetime.fromisoformat(scellement))
+                    if scellement is not None
+                    else None
+                ),
+                plan_de_compte=Path(plan_de_compte) if plan_de_compte is not None else None,
+            ),
+        )
+
+    def ecrire(
+        self,
+        resultat: ResultatMetadata,
+        pdcs_dpath: Path,
+        signature_totem: Optional[Signature] = None,
+    ):
+        """Met en cache un résultat d'extraction
+
+        Args:
+            resultat (ResultatMetadata): Résultat à mettre en cache.
+            pdcs_dpath (Path): Dossier des plans de comptes utilisé pour l'extraction.
+            signature_totem (Signature, optional): Signature du fichier, relevée avant l'extraction.
+              Defaults to None (relevée maintenant).
+        """
+        if signature_totem is None:
+            signature_totem = signature(resultat.totem_fpath)
+        if signature_totem is None:
+            return
+
+        metadata = resultat.metadata
+        valeurs = (
+            _cle(resultat.totem_fpath),
+            _cle(pdcs_dpath),
+            *signature_totem,
+            metadata.annee_exercice if metadata is not None else None,
+            metadata.id_etablissement if metadata is not None else None,
+            metadata.etape_budgetaire.value if metadata is not None else None,
+            (
+                metadata.scellement.date.isoformat()
+                if metadata is not None and metadata.scellement is not None
+                else None
+            ),
+            (
+                str(metadata.plan_de_compte)
+                if metadata is not None and metadata.plan_de_compte is not None
+                else None
+            ),
+            str(resultat.erreur) if resultat.erreur is not None else None,
+        )
+
+        with self.__lock:
+            self.__connexion.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                valeurs,
+            )
+
+    def enregistrer(self):
+        """Ecrit sur disque les entrées ajoutées depuis le dernier enregistrement"""
+        with self.__lock:
+            self.__connexion.commit()
+
+    def vider(self):
+        with self.__lock:
+            with self.__connexion:
+                self.__connexion.execute("DELETE FROM metadata")
+
+    def fermer(self):
+        self.enregistrer()
+        logger.debug(f"Cache des metadata '{self.fpath}': {self.hits} hits, {self.misses} misses")
+        self.__connexion.close()
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__connexion.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+    def __enter__(self) -> "CacheMetadata":
+        return self
+
+    def __exit__(self, *_):
+        self.fermer()
+
+
+def _cle(fpath: Path) -> str:
+    return str(Path(fpath).resolve())
@@ -0,0 +1,151 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from io import TextIOBase
+from pathlib import Path
+from typing import Iterator
+
+from yatotem2scdl import logger
+
+from .metriques import _compter_cache
+
+_TAILLE_BLOC = 1024 * 1024
+_SUFFIXE = ".csv"
+
+
+class CacheScdl:
+    def __init__(self, dpath: Path, taille_max: int = 1024 * 1024 * 1024):
+        """Cache sur disque des SCDL produits, adressé par le contenu de ce qui les produit.
+
+        La clé d'une entrée est calculée par ConvertisseurTotemBudget à partir du contenu du fichier
+        totem, de la XSLT, du plan de compte et des options. Les entrées les moins récemment utilisées
+        sont supprimées lorsque la taille totale dépasse taille_max.
+
+        Args:
+            dpath (Path): Dossier du cache. Créé s'il n'existe pas.
+            taille_max (int, optional): Taille maximale du cache, en octets. Defaults to 1 Go.
+        """
+        if taille_max < 1:
+            raise ValueError("La taille du cache doit être d'au moins 1 octet")
+
+        self.dpath = Path(dpath)
+        self.dpath.mkdir(parents=True, exist_ok=True)
+        self.taille_max = taille_max
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = threading.Lock()
+        self.__entrees: OrderedDict[str, int] = OrderedDict()
+        self.__taille = 0
+        self.__empreintes: dict[str, tuple[tuple[int, int], str]] = {}
+
+        fichiers = sorted(
+            (f for f in self.dpath.glob(f"*{_SUFFIXE}") if f.is_file()),
+            key=lambda f: f.stat().st_mtime_ns,
+        )
+        for fichier in fichiers:
+            self.__ajouter(fichier.stem, fichier.stat().st_size)
+        self.__evincer()
+
+    def copier_vers(self, cle: str, output: TextIOBase) -> bool:
+        """Ecrit le SCDL en cache dans output. Renvoie False si la clé est absente du cache."""
+        fpath = self.__fpath(cle)
+        try:
+            with open(fpath, "r", encoding="utf-8", newline="") as scdl:
+                with self.__lock:
+                    self.hits += 1
+                    _compter_cache("scdl", hit=True)
+                    if cle in self.__entrees:
+                        self.__entrees.move_to_end(cle)
+                os.utime(fpath)
+                shutil.copyfileobj(scdl, output, _TAILLE_BLOC)
+                return True
+        except FileNotFoundError:
+            with self.__lock:
+                self.misses += 1
+                _compter_cache("scdl", hit=False)
+                self.__retirer(cle)
+            return False
+
+    @contextmanager
+    def ecriture(self, cle: str, output: TextIOBase) -> Iterator[TextIOBase]:
+        """Contexte dans lequel le SCDL est écrit dans le cache, puis recopié dans output.
+
+        L'entrée n'est ajoutée, et output écrit, que si le contexte se termine sans erreur.
+        """
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.dpath)
+        try:
+            with open(fd, "w+", encoding="utf-8", newline="") as scdl:
+                yield scdl  # type: ignore[misc]
+                scdl.seek(0)
+                shutil.copyfileobj(scdl, output, _TAILLE_BLOC)
+            os.replace(tmp, self.__fpath(cle))
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+        with self.__lock:
+            self.__retirer(cle)
+            self.__ajouter(cle, self.__fpath(cle).stat().st_size)
+            self.__evincer()
+
+    def empreinte(self, fpath: Path) -> str:
+        """Empreinte sha256 du contenu d'un fichier, recalculée uniquement s'il a changé sur disque"""
+        cle = str(Path(fpath).resolve())
+        stat = os.stat(cle)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self.__lock:
+            connue = self.__empreintes.get(cle)
+        if connue is not None and connue[0] == signature:
+            return connue[1]
+
+        empreinte = empreinte_fichier(Path(cle))
+        with self.__lock:
+            self.__empreintes[cle] = (signature, empreinte)
+        return empreinte
+
+    def vider(self):
+        with self.__lock:
+            for cle in list(self.__entrees):
+                self.__fpath(cle).unlink(missing_ok=True)
+                self.__retirer(cle)
+
+    def taille(self) -> int:
+        """Taille totale des entrées du cache, en octets"""
+        return self.__taille
+
+    def __len__(self) -> int:
+        return len(self.__entrees)
+
+    def __fpath(self, cle: str) -> Path:
+        return self.dpath / f"{cle}{_SUFFIXE}"
+
+    def __ajouter(self, cle: str, taille: int):
+        self.__entrees[cle] = taille
+        self.__taille += taille
+
+    def __retirer(self, cle: str):
+        taille = self.__entrees.pop(cle, None)
+        if taille is not None:
+            self.__taille -= taille
+
+    def __evincer(self):
+        while self.__taille > self.taille_max and len(self.__entrees) > 0:
+            cle, taille = self.__entrees.popitem(last=False)
+            self.__taille -= taille
+            self.__fpath(cle).unlink(missing_ok=True)
+            logger.debug(f"Eviction du SCDL '{cle}' du cache")
+
+
+def empreinte_fichier(fpath: Path) -> str:
+    """Empreinte sha256 du contenu d'un fichier"""
+    h = hashlib.sha256()
+    with open(fpath, "rb") as f:
+        for bloc in iter(lambda: f.read(_TAILLE_BLOC), b""):
+            h.update(bloc)
+    return h.hexdigest()
@@ -1,70 +1,141 @@
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from contextvars import copy_context
+from copy import deepcopy
+from functools import partial
 from io import TextIOBase
-from typing import Optional
+from itertools import chain, islice
+from typing import Callable, Iterable, Iterator, Optional, TypeVar, Union
 from xml.etree.ElementTree import ElementTree
 from pathlib import Path
 
 from yatotem2scdl import logger
 
 import os
-import csv
-import xml.sax
-from datetime import datetime
-
-from .TotemMetadataHandler import TotemMetadataHandler, FinishedParsing
+import hashlib
+import threading
+
+from .cache_scdl import CacheScdl, empreinte_fichier
+from .incremental import COLONNE_DELTA, OperationDelta, difference_lignes
+from .plan_de_compte import CachePlansDeComptes
+from .plans_de_comptes_compiles import PlansDeComptesCompiles
+from .metriques import MetriquesConversion, _ajouter_lignes, _mesurer, _phase
+from .moteur_natif import (
+    entete_document,
+    ligne_scdl_valeurs,
+    lignes_budget,
+    lignes_scdl,
+    lignes_scdl_flux,
+    racine_document,
+    valeurs_ligne,
+)
+from .scdl import COLONNES_SCDL_BUDGET
+from .sorties import SortieLignes, _ouvrir_sortie, ecrire_fichier, ecrire_lignes
+from .sources import SourceTotem, description, est_chemin, ouvrir_totem, taille
+from .metadata import (
+    _TAGS_LECTURE_METADATA,
+    _calculer_pdc_from_totem_values,
+    _lire_valeurs_metadata,
+    _metadata_depuis_valeurs,
+)
 
 from yatotem2scdl.exceptions import (
-    AnneeExerciceInvalideErreur,
     ConversionErreur,
     CaractereAppostropheErreur,
-    EtapeBudgetaireInconnueErreur,
     ExtractionMetadataErreur,
-    NomenclatureInvalideErreur,
-    SiretInvalideErreur,
     TotemInvalideErreur,
 )
 
 from yatotem2scdl.data_structures import (
-    EtapeBudgetaire,
+    DocumentEnveloppe,
+    FormatSortie,
+    MoteurConversion,
     Options,
+    ResultatIncremental,
+    DocumentIncremental,
     TotemBudgetMetadata,
-    TotemBudgetScellement,
 )
 
 from lxml import etree
 
+T = TypeVar("T")
+
 _BUDGET_XSLT = Path(os.path.dirname(__file__)) / "xsl" / "totem2xmlcsv.xsl"
 _PDC_VIDE = Path(os.path.dirname(__file__)) / "planDeCompte-vide.xml"
+# A incrémenter lorsque le SCDL produit change à entrées identiques
+_VERSION_CLE_CACHE_SCDL = "1"
 
 
 class ConvertisseurTotemBudget:
-    def __init__(self, xslt_budget: Optional[Path] = None):
+    def __init__(
+        self,
+        xslt_budget: Optional[Path] = None,
+        cache_pdc: Optional[CachePlansDeComptes] = None,
+        moteur: MoteurConversion = MoteurConversion.XSLT,
+        cache_scdl: Optional[CacheScdl] = None,
+        metriques: Optional[MetriquesConversion] = None,
+    ):
         """Convertisseur de fichier totem budget vers SCDL
 
         Args:
             xslt_budget (Path, optional): Surcharge le fichier de transformation XSLT en
               charge de la construction du modèle intermédiaire. Defaults to None.
+            cache_pdc (CachePlansDeComptes, optional): Cache des plans de comptes parsés,
+              éventuellement partagé entre plusieurs convertisseurs. Defaults to None.
+            moteur (MoteurConversion, optional): Moteur de conversion. Le moteur natif
+              reproduit la XSLT par défaut et n'accepte donc pas de xslt_budget.
+              Defaults to MoteurConversion.XSLT.
+            cache_scdl (CacheScdl, optional): Cache sur disque des SCDL produits. Un fichier totem
+              déjà converti avec la même XSLT, le même plan de compte et les mêmes options n'est
+              pas reconverti. Ignoré lorsque xml_intermediaire_path est demandé. Defaults to None.
+            metriques (MetriquesConversion, optional): Reçoit la mesure de chaque appel: durée de chaque
+              phase, taille de l'entrée, lignes écrites, accès aux caches. Defaults to None.
         """
+        if moteur is MoteurConversion.NATIF and xslt_budget is not None:
+            raise ValueError(
+                "Le moteur natif ne supporte pas de fichier de transformation XSLT personnalisé"
+            )
+        self.moteur = moteur
+
         if xslt_budget is None:
             xslt_budget = _BUDGET_XSLT
         self.__xslt_budget = xslt_budget
 
-    def __document_budgetaire_tree(self, totem_fpath: Path) -> ElementTree:
-        tree = etree.parse(totem_fpath)
+        if cache_pdc is None:
+            cache_pdc = CachePlansDeComptes()
+        self.cache_pdc = cache_pdc
+        self.cache_scdl = cache_scdl
+        self.metriques = metriques
 
-        documents_budgetaires = tree.findall('{*}DocumentBudgetaire')
-        document_budgetaire_tree = None
+        # XSLT compilée, réutilisée d'une conversion à l'autre
+        # tant que le fichier de transformation n'est pas modifié sur disque.
+        self.__xslt_lock = threading.Lock()
+        self.__xslt_transform: Optional[etree.XSLT] = None
+        self.__xslt_signature: Optional[tuple[int, int]] = None
+
+    def __document_budgetaire_tree(self, totem_fpath: SourceTotem) -> ElementTree:
+        documents_budgetaires = self.__documents_budgetaires(totem_fpath)
         if len(documents_budgetaires) > 1:
-            raise TotemInvalideErreur("Plusieurs noeuds DocumentBudgetaire présent dans le XML")
-        if len(documents_budgetaires) == 1:
-            document_budgetaire_tree = documents_budgetaires[0]
-        if len(documents_budgetaires) == 0:
-            document_budgetaire_tree = tree
+            raise TotemInvalideErreur(
+                "Plusieurs noeuds DocumentBudgetaire présent dans le XML,"
+                " voir ConvertisseurTotemBudget.totem_enveloppe_vers_scdl"
+            )
+        return documents_budgetaires[0]
 
-        return document_budgetaire_tree
+    def __documents_budgetaires(self, totem_fpath: SourceTotem) -> list:
+        """Noeuds DocumentBudgetaire d'une enveloppe, ou l'arbre du fichier totem s'il n'en contient pas"""
+        with _phase("parse"), ouvrir_totem(totem_fpath) as source:
+            tree = etree.parse(source)
+
+        documents_budgetaires = tree.findall('{*}DocumentBudgetaire')
+        if len(documents_budgetaires) == 0:
+            return [tree]
+        return documents_budgetaires
 
     def totem_budget_vers_scdl(
         self,
-        totem_fpath: Path,
+        totem_fpath: SourceTotem,
         pdcs_dpath: Path,
         output: TextIOBase,
         options: Options = Options(),
@@ -72,98 +143,530 @@ class ConvertisseurTotemBudget:
         """Convertit un fichier totem vers un SCDL budget
 
         Args:
-            totem_fpath (Path): Chemin vers le fichier totem.
+            totem_fpath (SourceTotem): Chemin vers le fichier totem, son contenu ou un fichier binaire
+              ouvert en lecture. Les documents compressés en gzip ou en zip sont décompressés à la volée.
+              Le cache de SCDL n'est utilisé que pour un chemin, et au format FormatSortie.CSV.
             pdcs_dpath (Path): Chemin contenant les plans de comptes.
-            output (TextIOBase): TextIO vers lequel le CSV est écrit.
+            output (TextIOBase): TextIO vers lequel le CSV est écrit. Fichier binaire
+              pour les formats de sortie autres que FormatSortie.CSV. Une SortiePartitionnee
+              répartit le SCDL entre plusieurs fichiers.
             options (Options, optional): Diverses options. Defaults to Options().
 
         Raises:
             ConversionErreur: ou une classe fille suivant la nature de l'erreur.
         """
 
-        def _extraire_pdc_for_conversion(tree, pdcs_dpath):
+        if options is None:
+            options = Options()
+
+        logger.info(f"Conversion du fichier budget totem: {description(totem_fpath)}")
+        with self.__mesurer("conversion", totem_fpath):
             try:
-                pdc_path = _extraire_plan_de_compte(tree, pdcs_dpath)
-                return pdc_path
-            except TotemInvalideErreur:
-                logger.warning(
-                    "Impossible de trouver un plan de compte pour le fichier totem."
-                    " Le SCDL sera probablement incomplet"
-                )
-                return None
+                if (
+                    self.cache_scdl is not None
+                    and options.xml_intermediaire_path is None
+                    and options.format_sortie is FormatSortie.CSV
+                    and est_chemin(totem_fpath)
+                    and not isinstance(output, SortieLignes)
+                ):
+                    self.__convertir_avec_cache(totem_fpath, pdcs_dpath, output, options)
+                else:
+                    self.__convertir(totem_fpath, pdcs_dpath, output, options)
+
+            except ConversionErreur as err:
+                raise err
+            except Exception as err:
+                raise ConversionErreur() from err
+
+    def __mesurer(self, operation: str, totem_fpath: SourceTotem):
+        return _mesurer(operation, description(totem_fpath), taille(totem_fpath), self.metriques)
+
+    def __convertir(
+        self,
+        totem_fpath: SourceTotem,
+        pdcs_dpath: Path,
+        output: TextIOBase,
+        options: Options,
+    ):
+        if options.streaming:
+            with _phase("flux"):
+                self._convertir_flux(totem_fpath, pdcs_dpath, output, options)
+            return
+
+        docBudgetaireTree: ElementTree = self.__document_budgetaire_tree(totem_fpath)
+        with _phase("plan_de_compte"):
+            pdc_path = self.__plan_de_compte_pour_conversion(docBudgetaireTree, pdcs_dpath)
+        self.__convertir_document(docBudgetaireTree, pdc_path, output, options)
+
+    def __plan_de_compte_pour_conversion(self, tree: ElementTree, pdcs_dpath: Path) -> Optional[Path]:
+        try:
+            return _extraire_plan_de_compte(tree, pdcs_dpath, self.cache_pdc.compiles)
+        except TotemInvalideErreur:
+            logger.warning(
+                "Impossible de trouver un plan de compte pour le fichier totem."
+                " Le SCDL sera probablement incomplet"
+            )
+            return None
+
+    def __convertir_avec_cache(
+        self,
+        totem_fpath: Path,
+        pdcs_dpath: Path,
+        output: TextIOBase,
+        options: Options,
+    ):
+        assert self.cache_scdl is not None
+
+        if not output.writable():
+            raise ConversionErreur(f"{str(output)} est en lecture seule.")
+
+        with _phase("cle_cache_scdl"):
+            cle = self.__cle_cache_scdl(totem_fpath, pdcs_dpath, options)
+        with _phase("cache_scdl"):
+            trouve = self.cache_scdl.copier_vers(cle, output)
+        if trouve:
+            logger.debug(f"SCDL trouvé dans le cache: {cle}")
+            return
+
+        with self.cache_scdl.ecriture(cle, output) as scdl:
+            self.__convertir(totem_fpath, pdcs_dpath, scdl, options)
+
+    def __cle_cache_scdl(self, totem_fpath: Path, pdcs_dpath: Path, options: Options) -> str:
+        """Clé du SCDL dans le cache: empreinte de tout ce qui détermine son contenu"""
+        assert self.cache_scdl is not None
+
+        nomenclature, _, _, annee, _ = _lire_metadata(totem_fpath)
+        try:
+            pdc_path: Optional[Path] = _calculer_pdc_from_totem_values(
+                nomenclature, annee, pdcs_dpath, self.cache_pdc.compiles
+            )
+        except TotemInvalideErreur:
+            pdc_path = None
+
+        # Les libellés peuvent venir de l'index compilé, qui peut être déployé sans les fichiers XML:
+        # la clé porte sur le contenu de chacune des deux sources, lorsqu'elle existe.
+        empreinte_pdc = ""
+        empreinte_pdc_compile = ""
+        if pdc_path is not None:
+            if pdc_path.is_file():
+                empreinte_pdc = self.cache_scdl.empreinte(pdc_path)
+            if self.cache_pdc.compiles is not None:
+                empreinte_pdc_compile = self.cache_pdc.compiles.empreinte_pour_chemin(pdc_path) or ""
+
+        composantes = [
+            _VERSION_CLE_CACHE_SCDL,
+            empreinte_fichier(totem_fpath),
+            self.moteur.value,
+            self.cache_scdl.empreinte(self.__xslt_budget),
+            empreinte_pdc,
+            empreinte_pdc_compile,
+            repr(options.lineterminator),
+            repr(options.inclure_header_csv),
+        ]
+        return hashlib.sha256("\n".join(composantes).encode("utf-8")).hexdigest()
+
+    def totem_budget_vers_scdl_et_metadata(
+        self,
+        totem_fpath: SourceTotem,
+        pdcs_dpath: Path,
+        output: TextIOBase,
+        options: Options = Options(),
+    ) -> TotemBudgetMetadata:
+        """Convertit un fichier totem vers un SCDL budget et en extrait les metadata, en un seul parsing
+
+        Le plan de compte trouvé pour les metadata est celui utilisé pour la conversion.
+
+        Args:
+            totem_fpath (SourceTotem): Voir totem_budget_vers_scdl.
+            pdcs_dpath (Path): Chemin contenant les plans de comptes.
+            output (TextIOBase): Voir totem_budget_vers_scdl.
+            options (Options, optional): Diverses options. Le mode streaming n'est pas supporté. Defaults to Options().
 
+        Raises:
+            ExtractionMetadataErreur: si les metadata sont invalides. Rien n'est alors écrit dans output.
+            ConversionErreur: ou une classe fille suivant la nature de l'erreur.
+
+        Returns:
+            TotemBudgetMetadata: Les metadata du fichier totem.
+        """
         if options is None:
             options = Options()
+        if options.streaming:
+            raise ConversionErreur(
+                "Le mode streaming n'est pas supporté lors de l'extraction des metadata"
+            )
+
+        logger.info(
+            f"Conversion et extraction des metadata du fichier budget totem: {description(totem_fpath)}"
+        )
+        with self.__mesurer("conversion", totem_fpath):
+            return self.__convertir_et_extraire_metadata(totem_fpath, pdcs_dpath, output, options)
 
-        logger.info(f"Conversion du fichier budget totem: {totem_fpath}")
+    def __convertir_et_extraire_metadata(
+        self,
+        totem_fpath: SourceTotem,
+        pdcs_dpath: Path,
+        output: TextIOBase,
+        options: Options,
+    ) -> TotemBudgetMetadata:
         try:
             docBudgetaireTree: ElementTree = self.__document_budgetaire_tree(totem_fpath)
-            pdc_path = _extraire_pdc_for_conversion(docBudgetaireTree, pdcs_dpath)
-            transformed_tree = self._transform(
-                totem_tree=docBudgetaireTree, pdc_fpath=pdc_path, options=options
+        except ConversionErreur as err:
+            raise err
+        except Exception as err:
+            raise ConversionErreur() from err
+
+        try:
+            with _phase("plan_de_compte"):
+                valeurs = _xpath_metadata(docBudgetaireTree)
+                metadata = _metadata_depuis_valeurs(
+                    *valeurs, pdcs_dpath=pdcs_dpath, compiles=self.cache_pdc.compiles
+                )
+        except Exception as err:
+            raise ExtractionMetadataErreur(str(err)) from err
+
+        if metadata.plan_de_compte is None:
+            logger.warning(
+                "Impossible de trouver un plan de compte pour le fichier totem."
+                " Le SCDL sera probablement incomplet"
             )
-            _xml_to_csv(transformed_tree, output, options)
 
+        try:
+            self.__convertir_document(docBudgetaireTree, metadata.plan_de_compte, output, options)
         except ConversionErreur as err:
             raise err
         except Exception as err:
             raise ConversionErreur() from err
 
-    def totem_budget_metadata(
+        return metadata
+
+    def totem_enveloppe_vers_scdl(
         self,
-        totem_fpath: Path,
+        totem_fpath: SourceTotem,
         pdcs_dpath: Path,
-    ) -> TotemBudgetMetadata:
-        def _pdc_path(nomenclature, annee, pdcs_dpath):
-            try:
-                pdc_path = _calculer_pdc_from_totem_values(
-                    nomenclature, annee, pdcs_dpath
-                )
-                return pdc_path
-            except TotemInvalideErreur as err:
-                logger.warning(str(err))
-                return None
+        output: Optional[Union[TextIOBase, SortieLignes]] = None,
+        output_dpath: Optional[Path] = None,
+        options: Options = Options(),
+        workers: Optional[int] = None,
+    ) -> list[DocumentEnveloppe]:
+        """Convertit chaque DocumentBudgetaire d'une enveloppe (budget principal et budgets annexes)
 
-        try:
-            handler = TotemMetadataHandler()
+        Le fichier n'est parsé qu'une fois. Chaque document est converti avec son propre plan de compte,
+        les transformations XSLT s'exécutant en parallèle sur un pool de threads. Les SCDL sont écrits
+        dans l'ordre des documents, soit à la suite dans output, avec un seul entête, soit un fichier
+        par document dans output_dpath. Un fichier totem sans enveloppe est un document unique.
+
+        Args:
+            totem_fpath (SourceTotem): Voir totem_budget_vers_scdl.
+            pdcs_dpath (Path): Chemin contenant les plans de comptes.
+            output (TextIOBase | SortieLignes, optional): Sortie du SCDL combiné des documents.
+              Voir totem_budget_vers_scdl. Defaults to None.
+            output_dpath (Path, optional): Dossier dans lequel écrire le SCDL de chaque document,
+              nommé par nom_scdl_document. Defaults to None.
+            options (Options, optional): Diverses options. Le mode streaming et le XML intermédiaire
+              ne sont pas supportés. Defaults to Options().
+            workers (int, optional): Nombre de documents convertis simultanément.
+              Defaults to None (nombre de CPU).
+
+        Raises:
+            ValueError: si ni output ni output_dpath n'est donné, ou si les deux le sont.
+            ExtractionMetadataErreur: si les metadata d'un document ne peuvent être extraites.
+            ConversionErreur: ou une classe fille suivant la nature de l'erreur.
+
+        Returns:
+            list[DocumentEnveloppe]: Les documents convertis, dans l'ordre de l'enveloppe.
+        """
+        if (output is None) == (output_dpath is None):
+            raise ValueError("Le SCDL d'une enveloppe est écrit soit dans output, soit dans output_dpath")
+        if options is None:
+            options = Options()
+
+        logger.info(f"Conversion de l'enveloppe totem: {description(totem_fpath)}")
+        with self.__mesurer("conversion_enveloppe", totem_fpath):
             try:
-                xml.sax.parse(str(totem_fpath), handler)
-            except FinishedParsing:
-                pass
+                return self.__convertir_enveloppe(totem_fpath, pdcs_dpath, output, output_dpath, options, workers)
+            except (ConversionErreur, ExtractionMetadataErreur) as err:
+                raise err
+            except Exception as err:
+                raise ConversionErreur() from err
 
-            nomenclature = handler.nomenclature
-            code_etape = handler.code_etape
-            id_etab = handler.id_etab
-            annee = handler.annee
+    def __convertir_enveloppe(
+        self,
+        totem_fpath: SourceTotem,
+        pdcs_dpath: Path,
+        output: Optional[Union[TextIOBase, SortieLignes]],
+        output_dpath: Optional[Path],
+        options: Options,
+        workers: Optional[int],
+    ) -> list[DocumentEnveloppe]:
+        if options.streaming:
+            raise ConversionErreur("Le mode streaming n'est pas supporté pour une enveloppe")
+        if options.xml_intermediaire_path is not None:
+            raise ConversionErreur("Le XML intermédiaire n'est pas supporté pour une enveloppe")
+
+        documents = self.__documents_budgetaires(totem_fpath)
+        metadatas = []
+        with _phase("plan_de_compte"):
+            for document in documents:
+                try:
+                    metadata = _metadata_depuis_valeurs(
+                        *_xpath_metadata(document), pdcs_dpath=pdcs_dpath, compiles=self.cache_pdc.compiles
+                    )
+                except Exception as err:
+                    raise ExtractionMetadataErreur(str(err)) from err
+                metadatas.append(metadata)
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if output is not None:
+            scdl_fpaths: list[Optional[Path]] = [None] * len(documents)
+        else:
+            assert output_dpath is not None
+            output_dpath.mkdir(parents=True, exist_ok=True)
+            scdl_fpaths = [
+                output_dpath / nom_scdl_document(position, metadata, options.format_sortie)
+                for position, metadata in enumerate(metadatas)
+            ]
+        nb_lignes = [0] * len(documents)
+
+        # En cas d'erreur, closing annule les documents pas encore convertis avant l'arrêt du pool
+        with _phase("documents"), ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="yatotem2scdl-document"
+        ) as executor, closing(
+            _en_parallele(
+                executor,
+                workers,
+                (
+                    partial(self.__preparer_document, document, metadata.plan_de_compte, options, scdl_fpath)
+                    for document, metadata, scdl_fpath in zip(documents, metadatas, scdl_fpaths)
+                ),
+            )
+        ) as preparations:
+            if output is not None:
+                colonnes, lignes = next(preparations)
+
+                def _lignes_enveloppe() -> Iterator[list[str]]:
+                    nb_lignes[0] = len(lignes)
+                    yield from lignes
+                    for position, (colonnes_document, lignes_document) in enumerate(preparations, start=1):
+                        if colonnes_document != colonnes:
+                            raise ConversionErreur(
+                                f"Le document {position} de l'enveloppe n'a pas les mêmes colonnes que le premier"
+                            )
+                        nb_lignes[position] = len(lignes_document)
+                        yield from lignes_document
+
+                ecrire_lignes(colonnes, _lignes_enveloppe(), output, options)
+            else:
+                for position, (_, lignes) in enumerate(preparations):
+                    nb_lignes[position] = len(lignes)
+
+        return [
+            DocumentEnveloppe(position, metadata, nb_lignes[position], scdl_fpaths[position])
+            for position, metadata in enumerate(metadatas)
+        ]
+
+    def __preparer_document(
+        self, document, pdc_fpath: Optional[Path], options: Options, scdl_fpath: Optional[Path]
+    ) -> tuple[list[str], list[list[str]]]:
+        """Colonnes et lignes SCDL d'un document, extraites sur le thread du pool.
+        Si scdl_fpath est donné, le SCDL du document y est aussi écrit par ce thread."""
+        if pdc_fpath is None:
+            logger.warning(
+                "Impossible de trouver un plan de compte pour un document de l'enveloppe."
+                " Son SCDL sera probablement incomplet"
+            )
+        if self.moteur is MoteurConversion.NATIF:
+            with _phase("plan_de_compte"):
+                index = self.cache_pdc.index(pdc_fpath if pdc_fpath is not None else _PDC_VIDE)
+            colonnes: list[str] = COLONNES_SCDL_BUDGET
+            with _phase("lignes"):
+                lignes = list(lignes_scdl(document, index))
+        else:
+            with _phase("xslt"):
+                transformed_tree = self._transform(document, pdc_fpath, options)
+            with _phase("lignes"):
+                colonnes, lignes_xml = _lignes_xml_intermediaire(transformed_tree)
+                lignes = list(lignes_xml)
+        if scdl_fpath is not None:
+            with _phase("ecriture"), _ouvrir_sortie(scdl_fpath, options) as sortie:
+                ecrire_fichier(colonnes, lignes, sortie, options)
+            _ajouter_lignes(len(lignes))
+        return colonnes, lignes
+
+    def totem_budget_vers_scdl_incremental(
+        self,
+        totem_fpath: SourceTotem,
+        precedent_fpath: Union[SourceTotem, DocumentIncremental],
+        pdcs_dpath: Path,
+        delta_output: TextIOBase,
+        output: Optional[TextIOBase] = None,
+        options: Options = Options(),
+    ) -> ResultatIncremental:
+        """Convertit un fichier totem en SCDL delta depuis le document précédent
+
+        Le document précédent est une étape budgétaire antérieure du même établissement et du même
+        exercice (id_etablissement et annee_exercice de TotemBudgetMetadata), par exemple le budget
+        primitif pour une décision modificative. Le SCDL delta contient, après la colonne COLONNE_DELTA,
+        les lignes ajoutées, modifiées puis supprimées (voir incremental.difference_lignes).
+        La conversion utilise le moteur natif, sans XSLT, qui produit le même SCDL.
 
-            pdc_path = _pdc_path(nomenclature, annee, pdcs_dpath)
+        Le document converti est lu en entier: seul le formatage SCDL est limité aux lignes du delta
+        lorsque output est None. Le document précédent est lu de même, sauf s'il est donné sous forme
+        de DocumentIncremental, tel que renvoyé par la conversion de l'étape précédente.
 
-            etape = _parse_code_etape(code_etape)
-            annee_i = _parse_annee_exercice(annee)
-            id_etab_siret = _parse_siret(id_etab)
+        Args:
+            totem_fpath (SourceTotem): Voir totem_budget_vers_scdl.
+            precedent_fpath (Union[SourceTotem, DocumentIncremental]): Document précédent, même forme
+              que totem_fpath, ou ResultatIncremental.document d'une conversion précédente.
+            pdcs_dpath (Path): Chemin contenant les plans de comptes.
+            delta_output (TextIOBase): Sortie du SCDL delta. Voir l'argument output de totem_budget_vers_scdl.
+            output (TextIOBase, optional): Sortie du SCDL complet de totem_fpath, reconstruit à partir
+              des lignes déjà lues. Defaults to None.
+            options (Options, optional): Diverses options, communes aux deux sorties. Le mode streaming
+              n'est pas supporté. Defaults to Options().
 
-            scellement_date = _parse_scellement_annee(handler.scellement_date)
+        Raises:
+            ConversionErreur: si un document n'indique pas son établissement ou son exercice, si les
+              deux documents ne concernent pas le même établissement et le même exercice, ou une
+              classe fille suivant la nature de l'erreur.
 
-            metadata_scellement = (
-                TotemBudgetScellement(scellement_date)
-                if scellement_date is not None
-                else None
+        Returns:
+            ResultatIncremental: Nombre de lignes ajoutées, modifiées, supprimées et inchangées,
+              et lignes du document converti (ResultatIncremental.document).
+        """
+        if options is None:
+            options = Options()
+
+        logger.info(
+            f"Conversion incrémentale du fichier budget totem: {description(totem_fpath)}"
+            f" depuis {_description_precedent(precedent_fpath)}"
+        )
+        with self.__mesurer("conversion_incrementale", totem_fpath):
+            try:
+                return self.__convertir_incremental(
+                    totem_fpath, precedent_fpath, pdcs_dpath, delta_output, output, options
+                )
+            except ConversionErreur as err:
+                raise err
+            except Exception as err:
+                raise ConversionErreur() from err
+
+    def __convertir_incremental(
+        self,
+        totem_fpath: SourceTotem,
+        precedent_fpath: Union[SourceTotem, DocumentIncremental],
+        pdcs_dpath: Path,
+        delta_output: TextIOBase,
+        output: Optional[TextIOBase],
+        options: Options,
+    ) -> ResultatIncremental:
+        if options.streaming:
+            raise ConversionErreur("Le mode streaming n'est pas supporté par la conversion incrémentale")
+        if self.__xslt_budget != _BUDGET_XSLT:
+            raise ConversionErreur(
+                "La conversion incrémentale utilise le moteur natif,"
+                " incompatible avec un fichier de transformation XSLT personnalisé"
             )
 
-            return TotemBudgetMetadata(
-                annee_exercice=annee_i,
-                etape_budgetaire=etape,
-                id_etablissement=id_etab_siret,
-                scellement=metadata_scellement,
-                plan_de_compte=pdc_path,
+        nouveau = self.__lignes_document(totem_fpath, pdcs_dpath)
+        if isinstance(precedent_fpath, DocumentIncremental):
+            precedent = precedent_fpath
+        else:
+            precedent = self.__lignes_document(precedent_fpath, pdcs_dpath)
+        etablissement_exercice = (nouveau.id_etablissement, nouveau.annee_exercice)
+        etablissement_exercice_precedent = (precedent.id_etablissement, precedent.annee_exercice)
+        if etablissement_exercice != etablissement_exercice_precedent:
+            raise ConversionErreur(
+                f"Le document précédent (établissement, exercice) {etablissement_exercice_precedent}"
+                f" ne correspond pas au document converti {etablissement_exercice}"
             )
 
-        except Exception as err:
-            raise ExtractionMetadataErreur(str(err)) from err
+        with _phase("plan_de_compte"):
+            index = self.cache_pdc.index(nouveau.plan_de_compte or _PDC_VIDE)
+            index_precedent = self.cache_pdc.index(precedent.plan_de_compte or _PDC_VIDE)
+
+        with _phase("difference"):
+            operations, supprimees = difference_lignes(precedent.lignes, nouveau.lignes)
+
+        with _phase("ecriture"):
+            lignes_delta = chain(
+                (
+                    [operation.value, *ligne_scdl_valeurs(valeurs, nouveau.entete, index)]
+                    for operation, valeurs in zip(operations, nouveau.lignes)
+                    if operation is not None
+                ),
+                (
+                    [
+                        OperationDelta.SUPPRESSION.value,
+                        *ligne_scdl_valeurs(precedent.lignes[i], precedent.entete, index_precedent),
+                    ]
+                    for i in supprimees
+                ),
+            )
+            ecrire_lignes([COLONNE_DELTA, *COLONNES_SCDL_BUDGET], lignes_delta, delta_output, options)
+
+            if output is not None:
+                lignes = (
+                    ligne_scdl_valeurs(valeurs, nouveau.entete, index) for valeurs in nouveau.lignes
+                )
+                ecrire_lignes(COLONNES_SCDL_BUDGET, lignes, output, options)
+
+        return ResultatIncremental(
+            ajouts=operations.count(OperationDelta.AJOUT),
+            modifications=operations.count(OperationDelta.MODIFICATION),
+            suppressions=len(supprimees),
+            inchangees=operations.count(None),
+            document=nouveau,
+        )
+
+    def __lignes_document(self, totem_fpath: SourceTotem, pdcs_dpath: Path) -> DocumentIncremental:
+        tree = self.__document_budgetaire_tree(totem_fpath)
+        _, _, id_etab, annee, _ = _xpath_metadata(tree)
+        if id_etab is None or annee is None:
+            raise ConversionErreur(
+                f"Le document {description(totem_fpath)} n'indique pas son établissement ou son exercice"
+            )
+        with _phase("plan_de_compte"):
+            pdc_path = self.__plan_de_compte_pour_conversion(tree, pdcs_dpath)
+        with _phase("lecture_lignes"):
+            racine = racine_document(tree)
+            lignes = [valeurs_ligne(ligne) for ligne in lignes_budget(racine)]
+        return DocumentIncremental(id_etab, annee, entete_document(racine), pdc_path, lignes)
+
+    def totem_budget_metadata(
+        self,
+        totem_fpath: SourceTotem,
+        pdcs_dpath: Path,
+    ) -> TotemBudgetMetadata:
+        """Extrait les metadata d'un fichier totem, en ne lisant que son entête
+
+        Args:
+            totem_fpath (SourceTotem): Voir totem_budget_vers_scdl. Un fichier binaire n'est lu
+              que jusqu'à la fin de l'entête.
+            pdcs_dpath (Path): Chemin contenant les plans de comptes.
+
+        Raises:
+            ExtractionMetadataErreur: si les metadata ne peuvent être extraites.
+        """
+        with self.__mesurer("metadata", totem_fpath):
+            try:
+                with _phase("lecture"):
+                    valeurs = _lire_metadata(totem_fpath)
+                with _phase("plan_de_compte"):
+                    return _metadata_depuis_valeurs(
+                        *valeurs, pdcs_dpath=pdcs_dpath, compiles=self.cache_pdc.compiles
+                    )
+
+            except Exception as err:
+                raise ExtractionMetadataErreur(str(err)) from err
 
     def budget_scdl_entetes(self) -> str:
         """Récupère la ligne d'entete du SCDL correspondant aux budgets"""
 
+        if self.moteur is MoteurConversion.NATIF or self.__xslt_budget == _BUDGET_XSLT:
+            return ",".join(COLONNES_SCDL_BUDGET)
+
         xslt_tree: ElementTree = etree.parse(self.__xslt_budget)
         entetes = xslt_tree.xpath(  # type:ignore
             "/xsl:stylesheet/xsl:template/csv/header/column/@name",
@@ -171,6 +674,96 @@ class ConvertisseurTotemBudget:
         )
         return ",".join(entetes)
 
+    def _xslt_compilee(self) -> etree.XSLT:
+        """Renvoie la XSLT compilée, en la recompilant uniquement si le fichier a changé sur disque"""
+
+        xslt_fpath = self.__xslt_budget.resolve()
+        stat = xslt_fpath.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self.__xslt_lock:
+            if self.__xslt_transform is None or self.__xslt_signature != signature:
+                logger.debug(f"Compilation du fichier XSL: {xslt_fpath}")
+                xslt_tree = etree.parse(str(xslt_fpath))
+                self.__xslt_transform = etree.XSLT(
+                    xslt_input=xslt_tree,
+                    extensions=self.cache_pdc.extensions_xslt(),
+                )
+                self.__xslt_signature = signature
+            return self.__xslt_transform
+
+    def __convertir_document(
+        self,
+        totem_tree: ElementTree,
+        pdc_fpath: Optional[Path],
+        output: TextIOBase,
+        options: Options,
+    ):
+        if self.moteur is MoteurConversion.NATIF:
+            self._convertir_natif(totem_tree, pdc_fpath, output, options)
+        else:
+            with _phase("xslt"):
+                transformed_tree = self._transform(
+                    totem_tree=totem_tree, pdc_fpath=pdc_fpath, options=options
+                )
+            with _ecriture_xml_intermediaire(transformed_tree, options), _phase("ecriture"):
+                _xml_to_csv(transformed_tree, output, options)
+
+    def _convertir_natif(
+        self,
+        totem_tree: ElementTree,
+        pdc_fpath: Optional[Path],
+        output: TextIOBase,
+        options: Options,
+    ):
+        if options.xml_intermediaire_path is not None:
+            logger.warning(
+                "Le moteur natif ne produit pas de XML intermédiaire,"
+                " l'option xml_intermediaire_path est ignorée"
+            )
+
+        with _phase("plan_de_compte"):
+            index = self.cache_pdc.index(pdc_fpath if pdc_fpath is not None else _PDC_VIDE)
+        # Les lignes sont produites au fil de l'écriture
+        with _phase("ecriture"):
+            lignes = lignes_scdl(totem_tree, index)
+            ecrire_lignes(COLONNES_SCDL_BUDGET, lignes, output, options)
+
+    def _convertir_flux(
+        self,
+        totem_fpath: SourceTotem,
+        pdcs_dpath: Path,
+        output: TextIOBase,
+        options: Options,
+    ):
+        if self.__xslt_budget != _BUDGET_XSLT:
+            raise ConversionErreur(
+                "Le mode streaming utilise le moteur natif,"
+                " incompatible avec un fichier de transformation XSLT personnalisé"
+            )
+        if options.xml_intermediaire_path is not None:
+            logger.warning(
+                "Le mode streaming ne produit pas de XML intermédiaire,"
+                " l'option xml_intermediaire_path est ignorée"
+            )
+
+        def _index_pour(nomenclature: Optional[str], annee: Optional[str]):
+            try:
+                pdc_path = _calculer_pdc_from_totem_values(
+                    nomenclature, annee, pdcs_dpath, self.cache_pdc.compiles
+                )
+            except TotemInvalideErreur:
+                logger.warning(
+                    "Impossible de trouver un plan de compte pour le fichier totem."
+                    " Le SCDL sera probablement incomplet"
+                )
+                pdc_path = _PDC_VIDE
+            return self.cache_pdc.index(pdc_path)
+
+        with ouvrir_totem(totem_fpath) as source:
+            lignes = lignes_scdl_flux(source, _index_pour)
+            ecrire_lignes(COLONNES_SCDL_BUDGET, lignes, output, options)
+
     def _transform(
         self, totem_tree: ElementTree, pdc_fpath: Optional[Path], options: Options
     ) -> ElementTree:
@@ -182,8 +775,7 @@ class ConvertisseurTotemBudget:
             )
         )
 
-        xslt_tree = etree.parse(self.__xslt_budget.resolve())
-        transform = etree.XSLT(xslt_input=xslt_tree)
+        transform = self._xslt_compilee()
 
         pdc_fpath_str = (
             str(pdc_fpath.resolve())
@@ -192,53 +784,44 @@ class ConvertisseurTotemBudget:
         )
         pdc_param = _as_xpath_str(pdc_fpath_str)
 
-        transformed_tree = transform(totem_tree, plandecompte=pdc_param)
+        return transform(totem_tree, plandecompte=pdc_param)
 
-        intermediaire_fpath = options.xml_intermediaire_path
-        if intermediaire_fpath is not None:
-            _write_in_tmp(transformed_tree, intermediaire_fpath)
 
-        return transformed_tree
+def _description_precedent(precedent: Union[SourceTotem, DocumentIncremental]) -> str:
+    """Description du document précédent d'une conversion incrémentale, pour les logs"""
+    if isinstance(precedent, DocumentIncremental):
+        return f"<document {precedent.id_etablissement} de {precedent.annee_exercice} déjà lu>"
+    return description(precedent)
 
 
-def _calculer_pdc_from_totem_values(
-    nomenclature: Optional[str],
-    annee: Optional[str],
-    pdcs_dpath: Path,
-) -> Path:
-    """Calcule le chemin du plan de compte depuis une nomenclature et une annee
+def nom_scdl_document(position: int, metadata: TotemBudgetMetadata, format_sortie: FormatSortie) -> str:
+    """Nom du SCDL d'un document d'enveloppe: sa position, puis le SIRET de l'établissement"""
+    return f"{position:03d}-{metadata.id_etablissement}.{format_sortie.value}"
 
-    Args:
-        nomenclature (str): Valeur du tag Nomenclature dans un fichier totem
-        pdcs_dpath (Path): Chemin vers les plans de comptes
 
-    Raises:
-        AnneeExerciceInvalideErreur: Si l'année d'exercice est irrécupérable
-        NomenclatureInvalideErreur: Si la nomenclature est invalide (aussi si aucun plan de compte ne correspond)
+def _en_parallele(executor: Executor, en_avance: int, taches: Iterable[Callable[[], T]]) -> Iterator[T]:
+    """Résultats des tâches dans l'ordre, en exécutant au plus en_avance tâches avant le résultat attendu
 
-    Returns:
-        Path: Chemin vers le plan de compte correspondant
-    """
-    if nomenclature is None:
-        raise NomenclatureInvalideErreur(None, pdcs_dpath)  # type: ignore
-    if annee is None:
-        raise AnneeExerciceInvalideErreur(annee)
-
-    logger.debug(f"Version de plan de compte trouvée: ({annee}, {nomenclature})")
-
-    (n1, n2) = nomenclature.split("-", 1)
-    pdc_path = pdcs_dpath / annee / n1 / n2 / "planDeCompte.xml"
-
-    if not pdc_path.is_file():
-        raise NomenclatureInvalideErreur(
-            nomenclature=nomenclature, pdcs_dpath=pdcs_dpath
-        )
-
-    logger.debug(f"Utilisation du plan de compte situé ici: '{pdc_path}'")
-    return pdc_path
-
-
-def _extraire_plan_de_compte(totem_tree: ElementTree, pdcs_dpath: Path) -> Path:
+    Chaque tâche s'exécute dans une copie du contexte courant: ses phases et accès aux caches
+    sont attribués à la mesure de la conversion en cours."""
+    en_cours: deque[Future] = deque()
+    try:
+        for tache in taches:
+            en_cours.append(executor.submit(copy_context().run, tache))
+            if len(en_cours) > en_avance:
+                yield en_cours.popleft().result()
+        while en_cours:
+            yield en_cours.popleft().result()
+    finally:
+        for future in en_cours:
+            future.cancel()
+
+
+def _extraire_plan_de_compte(
+    totem_tree: ElementTree,
+    pdcs_dpath: Path,
+    compiles: Optional[PlansDeComptesCompiles] = None,
+) -> Path:
 
     namespaces = _namespaces()
 
@@ -247,7 +830,7 @@ def _extraire_plan_de_compte(totem_tree: ElementTree, pdcs_dpath: Path) -> Path:
     )[0].attrib.get("V")
     year: Optional[str] = _xpath_totem_budget_annee_exercice(totem_tree)
 
-    return _calculer_pdc_from_totem_values(nomenclature, year, pdcs_dpath)
+    return _calculer_pdc_from_totem_values(nomenclature, year, pdcs_dpath, compiles)
 
 
 def _xpath_totem_budget_annee_exercice(totem_tree: ElementTree) -> Optional[str]:
@@ -266,6 +849,36 @@ def _namespaces() -> dict[str, str]:
     return namespaces
 
 
+_XPATH_METADATA = [
+    etree.XPath(f"(descendant-or-self::db:{tag}/@{attribut})[1]", namespaces=_namespaces())
+    for tag, attribut in [
+        ("Nomenclature", "V"),
+        ("NatDec", "V"),
+        ("IdEtab", "V"),
+        ("Exer", "V"),
+        ("Scellement", "date"),
+    ]
+]
+
+
+def _xpath_metadata(totem_tree: ElementTree) -> list[Optional[str]]:
+    """Valeurs (nomenclature, code_etape, id_etab, annee, scellement_date), comme lues par TotemMetadataHandler"""
+    valeurs = []
+    for xpath in _XPATH_METADATA:
+        resultat = xpath(totem_tree)
+        valeurs.append(str(resultat[0]) if len(resultat) > 0 else None)
+    return valeurs
+
+
+def _lire_metadata(totem_fpath: SourceTotem) -> list[Optional[str]]:
+    """Valeurs (nomenclature, code_etape, id_etab, annee, scellement_date) du premier DocumentBudgetaire
+
+    Le XMLPullParser de lxml est filtré sur les balises recherchées, le reste du filtrage est donc fait par lxml.
+    """
+    parser = etree.XMLPullParser(events=("start", "end"), tag=_TAGS_LECTURE_METADATA)
+    return _lire_valeurs_metadata(totem_fpath, parser)
+
+
 def _as_xpath_str(s: str):
     #
     # Puisque les chaînes de caractère en XPath
@@ -277,76 +890,80 @@ def _as_xpath_str(s: str):
 
 
 def _xml_to_csv(tree: ElementTree, text_io: TextIOBase, options: Options):
-
-    if not text_io.writable():
-        raise ConversionErreur(f"{str(text_io)} est en lecture seule.")
-
-    writer = _make_writer(text_io, options)
-
-    if options.inclure_header_csv:
-        header_names = [elt.attrib["name"] for elt in tree.iterfind("./header/column")]
-        writer.writerow(header_names)
-
-    for row_tag in tree.iterfind("./data/row"):
-        row_data = [cell.attrib["value"] for cell in row_tag.iter("cell")]
-        writer.writerow(row_data)
-
-
-def _make_writer(text_io, options: Options):
-    if options.lineterminator is None:
-        return csv.writer(text_io)
-    else:
-        return csv.writer(text_io, lineterminator=options.lineterminator)
-
-
-def _write_in_tmp(tree: ElementTree, intermediaire_fpath: str):
-    tmp = Path(intermediaire_fpath)
-    tree.write(tmp, pretty_print=True)  # type: ignore[call-arg]
-    logger.debug(f"Ecriture du totem transformé dans {tmp}")
+    header_names, lignes = _lignes_xml_intermediaire(tree)
+    ecrire_lignes(header_names, lignes, text_io, options)
 
 
-def _parse_annee_exercice(annee: Optional[str]) -> int:
+def _lignes_xml_intermediaire(tree: ElementTree) -> tuple[list[str], Iterator[list[str]]]:
+    header_names = [elt.attrib["name"] for elt in tree.iterfind("./header/column")]
+    lignes = (_valeurs_row(row_tag) for row_tag in tree.iterfind("./data/row"))
+    return header_names, lignes
 
-    try:
-        if annee is None:
-            raise Exception("L'annee ne peut pas etre None")
-        if len(annee) != 4:
-            raise Exception("L'annee doit etre une chaine de 4 digit.")
-        return int(annee)
-    except Exception as err:
-        raise AnneeExerciceInvalideErreur(annee) from err
 
+def _valeurs_row(row_tag) -> list[str]:
+    # get évite de créer un proxy attrib par cellule
+    valeurs = [cell.get("value") for cell in row_tag.iter("cell")]
+    if None in valeurs:
+        raise ConversionErreur(f"Cellule sans valeur dans la ligne {row_tag.get('lineno')} du XML intermédiaire")
+    return valeurs
 
-def _parse_siret(siret: Optional[str]) -> int:
 
-    try:
-        if siret is None:
-            raise Exception("le siret ne peut pas etre None")
+@contextmanager
+def _ecriture_xml_intermediaire(tree: ElementTree, options: Options) -> Iterator[None]:
+    """Ecrit le XML intermédiaire demandé par les options, avant le bloc ou pendant celui-ci
 
-        if len(siret) != 14:
-            raise Exception("Nombre de digit incorrect")
+    En mode asynchrone, l'écriture a lieu sur un thread pendant le bloc, qui lit le même arbre,
+    et se termine à la sortie du bloc. Une erreur d'écriture est alors levée à la sortie du bloc.
+    """
+    intermediaire_fpath = options.xml_intermediaire_path
+    if intermediaire_fpath is None:
+        yield
+        return
 
-        siret_int = int(siret)
+    if options.xml_intermediaire_lignes_max is not None:
+        tree = _echantillon_xml_intermediaire(tree, options.xml_intermediaire_lignes_max)
 
-        return siret_int
-    except Exception as err:
-        raise SiretInvalideErreur(siret) from err
+    if not options.xml_intermediaire_asynchrone:
+        with _phase("xml_intermediaire"):
+            _write_in_tmp(tree, intermediaire_fpath, pretty_print=True)
+        yield
+        return
 
+    erreurs: list[BaseException] = []
 
-def _parse_code_etape(code_etape: Optional[str]) -> EtapeBudgetaire:
+    def _ecrire():
+        try:
+            _write_in_tmp(tree, intermediaire_fpath, pretty_print=False)
+        except BaseException as err:
+            erreurs.append(err)
 
+    thread = threading.Thread(target=_ecrire, name="yatotem2scdl-xml-intermediaire", daemon=True)
+    thread.start()
     try:
-        if code_etape is None:
-            raise Exception("le siret ne peut pas etre None")
-
-        code_etape_i = int(code_etape)
-
-        return EtapeBudgetaire(code_etape_i)
-    except Exception as err:
-        raise EtapeBudgetaireInconnueErreur(code_etape) from err
-
-
-def _parse_scellement_annee(date: Optional[str]) -> Optional[datetime]:
-    if date is None:
-        return None
-    return datetime.fromisoformat(date)
+        yield
+    finally:
+        with _phase("xml_intermediaire"):
+            thread.join()
+    if erreurs:
+        raise erreurs[0]
+
+
+def _echantillon_xml_intermediaire(tree: ElementTree, lignes_max: int) -> ElementTree:
+    """Copie du XML intermédiaire réduite aux lignes_max premières lignes (row)"""
+    racine = tree.getroot()
+    echantillon = etree.Element(racine.tag, racine.attrib, nsmap=racine.nsmap)
+    for enfant in racine:
+        if enfant.tag == "data":
+            data = etree.SubElement(echantillon, "data", enfant.attrib)
+            data.extend(deepcopy(row) for row in islice(enfant.iterfind("row"), lignes_max))
+        else:
+            echantillon.append(deepcopy(enfant))
+    return etree.ElementTree(echantillon)
+
+
+def _write_in_tmp(tree: ElementTree, intermediaire_fpath: str, pretty_print: bool):
+    tmp = Path(intermediaire_fpath)
+    # Niveau de compression faible: le XML intermédiaire est très redondant
+    compression = 1 if tmp.name.endswith(".gz") else 0
+    tree.write(str(tmp), pretty_print=pretty_print, compression=compression)  # type: ignore[call-arg]
+    logger.debug(f"Ecriture du totem transformé dans {tmp}")
@@ -1,10 +1,12 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
 from pathlib import Path
 from typing import Optional
 
 from datetime import datetime
 
+from .metriques import MesureConversion
+
 class EtapeBudgetaireStrInvalideError(Exception):
     """Levée lorsqu'une chaine ne correspond pas à une étape budgetaire valide"""
 
@@ -100,6 +102,28 @@ class EtapeBudgetaire(Enum):
             return EtapeBudgetaire.__cfu_aliases__[0]
         return self.to_scdl_compatible_str()
 
+class MoteurConversion(Enum):
+    """Moteur utilisé pour produire les lignes SCDL"""
+
+    XSLT = "xslt"  # Transformation XSLT, moteur de référence
+    NATIF = "natif"  # Lecture directe des LigneBudget en python, sans modèle intermédiaire
+
+
+class FormatSortie(Enum):
+    """Format du SCDL produit. La valeur est l'extension du fichier."""
+
+    CSV = "csv"
+    CSV_GZIP = "csv.gz"  # CSV compressé en gzip
+    CSV_ZSTD = "csv.zst"  # CSV compressé en zstd, nécessite le paquet zstandard
+    PARQUET = "parquet"  # Colonnes typées, nécessite le paquet pyarrow
+    ARROW = "arrow"  # Flux Arrow IPC aux colonnes typées, nécessite le paquet pyarrow
+
+    @property
+    def binaire(self) -> bool:
+        """La sortie est un fichier binaire, et non un TextIO"""
+        return self is not FormatSortie.CSV
+
+
 @dataclass(eq=True, frozen= True)
 class TotemBudgetScellement:
     date: datetime
@@ -123,4 +147,77 @@ class Options:
     inclure_header_csv: bool = True  # Inclure le nom des colonnes dans le CSV generé.
     xml_intermediaire_path: Optional[
         str
-    ] = None  # Chemin du fichier pour écrire le XML intermédiaire
+    ] = None  # Chemin du fichier pour écrire le XML intermédiaire, compressé en gzip si le chemin finit par .gz
+    # Ecrit le XML intermédiaire sur un thread, sans indentation, pendant l'écriture du SCDL
+    xml_intermediaire_asynchrone: bool = False
+    xml_intermediaire_lignes_max: Optional[int] = None  # N'écrit que les N premières lignes du XML intermédiaire
+    streaming: bool = False  # Conversion en flux (iterparse), à mémoire constante. Utilise le moteur natif.
+    format_sortie: FormatSortie = FormatSortie.CSV  # Hors CSV, la sortie doit être un fichier binaire.
+
+
+@dataclass(frozen=True)
+class ResultatConversion:
+    """Résultat de la conversion d'un fichier totem au sein d'un lot"""
+
+    totem_fpath: Path
+    csv_fpath: Optional[Path]  # Chemin du SCDL produit. None en cas d'erreur.
+    erreur: Optional[Exception] = None  # Erreur survenue lors de la conversion
+    mesure: Optional[MesureConversion] = None  # Durées des phases, lignes écrites et accès aux caches
+
+    @property
+    def succes(self) -> bool:
+        return self.erreur is None
+
+
+@dataclass(frozen=True)
+class ResultatMetadata:
+    """Résultat de l'extraction des metadata d'un fichier totem au sein d'un lot"""
+
+    totem_fpath: Path
+    metadata: Optional[TotemBudgetMetadata]  # None en cas d'erreur
+    erreur: Optional[Exception] = None  # ExtractionMetadataErreur survenue lors de l'extraction
+
+    @property
+    def succes(self) -> bool:
+        return self.erreur is None
+
+
+@dataclass(frozen=True)
+class DocumentIncremental:
+    """Lignes d'un document budgetaire lues par la conversion incrémentale
+
+    Renvoyé dans ResultatIncremental.document, il peut être passé comme document précédent
+    de l'étape budgétaire suivante, dont la conversion ne relit alors pas son fichier totem.
+    """
+
+    id_etablissement: str
+    annee_exercice: str
+    entete: list[str]  # Valeurs d'entête du document (voir moteur_natif.entete_document)
+    plan_de_compte: Optional[Path]  # None lorsqu'aucun plan de compte ne correspond
+    lignes: list[dict[str, str]]  # Valeurs de chaque LigneBudget (voir moteur_natif.valeurs_ligne)
+
+
+@dataclass(frozen=True)
+class ResultatIncremental:
+    """Nombre de lignes de chaque nature dans la conversion incrémentale d'un fichier totem"""
+
+    ajouts: int
+    modifications: int
+    suppressions: int
+    inchangees: int
+    # Lignes du document converti, à réutiliser comme document précédent. Non comparé.
+    document: Optional[DocumentIncremental] = field(default=None, compare=False, repr=False)
+
+    @property
+    def lignes_delta(self) -> int:
+        return self.ajouts + self.modifications + self.suppressions
+
+
+@dataclass(frozen=True)
+class DocumentEnveloppe:
+    """DocumentBudgetaire d'une enveloppe converti par totem_enveloppe_vers_scdl"""
+
+    position: int  # Rang du document dans l'enveloppe, à partir de 0
+    metadata: TotemBudgetMetadata  # Metadata du document, dont son plan de compte
+    lignes: int  # Lignes SCDL écrites pour ce document
+    scdl_fpath: Optional[Path] = None  # SCDL du document, None lorsque le SCDL est combiné
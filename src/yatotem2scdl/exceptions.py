@@ -31,6 +31,9 @@ class CaractereAppostropheErreur(ConversionErreur):
         message = "La chaîne suivante contient une apostrophe: " f"\n\t{self.chaine}"
         super().__init__(message)
 
+    def __reduce__(self):
+        return (self.__class__, (self.chaine,))
+
 
 class TotemInvalideErreur(Exception):
     def __init__(self, message: str) -> None:
@@ -46,6 +49,9 @@ class SiretInvalideErreur(TotemInvalideErreur):
         message = f"'{self.siret}' n'est pas un siret valide"
         super().__init__(message)
 
+    def __reduce__(self):
+        return (self.__class__, (self.siret,))
+
 
 class NomenclatureInvalideErreur(TotemInvalideErreur):
     """Levée lorsque la nomenclature d'un fichier totem est introuvable vis-à-vis des plans de compte"""
@@ -56,18 +62,29 @@ class NomenclatureInvalideErreur(TotemInvalideErreur):
         message = f"La nomenclature '{self.nomenclature}' est introuvable auprès des plans de comptes situés dans '{self.pdc_path}'"
         super().__init__(message)
 
+    def __reduce__(self):
+        return (self.__class__, (self.nomenclature, self.pdc_path))
+
 
 class AnneeExerciceInvalideErreur(TotemInvalideErreur):
     """Levée lorsque l'année d'exercice d'un fichier totem est invalide"""
 
     def __init__(self, annee: Optional[str]) -> None:
+        self.annee = annee
         message = f"L'année {annee} est invalide"
         super().__init__(message)
 
+    def __reduce__(self):
+        return (self.__class__, (self.annee,))
+
 
 class EtapeBudgetaireInconnueErreur(TotemInvalideErreur):
     """Levée lorsque l'étape budgetaire d'un fichier totem est invalide"""
 
     def __init__(self, etape_str: Optional[str]) -> None:
+        self.etape_str = etape_str
         message = f"L'étape budgetaire {etape_str} est invalide"
         super().__init__(message)
+
+    def __reduce__(self):
+        return (self.__class__, (self.etape_str,))
@@ -0,0 +1,87 @@
+"""Différence entre deux étapes budgétaires (primitif, décisions modificatives, compte administratif)
+
+Les LigneBudget de deux documents d'un même établissement et d'un même exercice sont comparées
+sur les valeurs lues par la conversion. Une ligne est identifiée par ses codes (CodRD, OpBudg,
+ContNat, Nature, Fonction, Operation, ArtSpe). Elle est inchangée si ses montants sont identiques,
+modifiée sinon. Plusieurs lignes pouvant porter les mêmes codes, les lignes identiques sont
+appariées en premier, puis les lignes restantes de même identité dans l'ordre du document.
+"""
+
+from enum import Enum
+from typing import Optional, Sequence
+
+from .moteur_natif import (
+    _ARTSPE,
+    _CODRD,
+    _CONTNAT,
+    _FONCTION,
+    _MONTANTS,
+    _NATURE,
+    _OPBUDG,
+    _OPERATION,
+)
+
+COLONNE_DELTA = "DELTA"  # Première colonne du SCDL delta, valeur de OperationDelta
+
+_CODES = [_CODRD, _OPBUDG, _CONTNAT, _NATURE, _FONCTION, _OPERATION, _ARTSPE]
+
+
+class OperationDelta(Enum):
+    """Nature du changement d'une ligne du SCDL delta"""
+
+    AJOUT = "ajout"
+    MODIFICATION = "modification"
+    SUPPRESSION = "suppression"  # La ligne porte l'entête et les valeurs du document précédent
+
+
+def difference_lignes(
+    precedentes: Sequence[dict[str, str]], nouvelles: Sequence[dict[str, str]]
+) -> tuple[list[Optional[OperationDelta]], list[int]]:
+    """Compare les lignes de deux documents, telles que lues par moteur_natif.valeurs_ligne
+
+    Returns:
+        tuple[list[Optional[OperationDelta]], list[int]]: Pour chaque nouvelle ligne, AJOUT, MODIFICATION
+          ou None si elle est inchangée. Puis les positions des lignes précédentes supprimées, dans l'ordre.
+    """
+    # Positions des lignes précédentes par (identité, montants), de la dernière à la première
+    identiques: dict[tuple, list[int]] = {}
+    for i in range(len(precedentes) - 1, -1, -1):
+        valeurs = precedentes[i]
+        identiques.setdefault((_identite(valeurs), _montants(valeurs)), []).append(i)
+
+    operations: list[Optional[OperationDelta]] = [None] * len(nouvelles)
+    non_appariees = []
+    for j, valeurs in enumerate(nouvelles):
+        identite = _identite(valeurs)
+        positions = identiques.get((identite, _montants(valeurs)))
+        if positions:
+            positions.pop()
+        else:
+            non_appariees.append((j, identite))
+
+    # Lignes précédentes sans équivalent identique, par identité et dans l'ordre du document
+    restantes: dict[tuple, list[int]] = {}
+    for (identite, _), positions in identiques.items():
+        if positions:
+            restantes.setdefault(identite, []).extend(positions)
+    for positions in restantes.values():
+        positions.sort(reverse=True)
+
+    for j, identite in non_appariees:
+        positions = restantes.get(identite)
+        if positions:
+            positions.pop()
+            operations[j] = OperationDelta.MODIFICATION
+        else:
+            operations[j] = OperationDelta.AJOUT
+
+    supprimees = sorted(i for positions in restantes.values() for i in positions)
+    return operations, supprimees
+
+
+def _identite(valeurs: dict[str, str]) -> tuple:
+    return tuple(map(valeurs.get, _CODES))
+
+
+def _montants(valeurs: dict[str, str]) -> tuple:
+    return tuple(map(valeurs.get, _MONTANTS))
@@ -0,0 +1,372 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional
+
+import math
+import os
+
+from yatotem2scdl import logger
+
+from .cache_metadata import CacheMetadata, signature
+from .conversion import ConvertisseurTotemBudget
+from .data_structures import (
+    FormatSortie,
+    MoteurConversion,
+    Options,
+    ResultatConversion,
+    ResultatMetadata,
+)
+from .exceptions import ConversionErreur, ExtractionMetadataErreur, TotemInvalideErreur
+from .metriques import MesureConversion, MetriquesConversion, _collecter_mesures
+from .plan_de_compte import CachePlansDeComptes
+from .plans_de_comptes_compiles import PlansDeComptesCompiles
+from .sorties import _ouvrir_sortie
+
+# Convertisseur propre à chaque processus du pool, initialisé une seule fois
+_convertisseur_worker: Optional[ConvertisseurTotemBudget] = None
+
+# Nombre maximal de fichiers envoyés à la fois à un processus lors de l'extraction des metadata,
+# bien plus rapide que l'aller-retour entre processus
+_TAILLE_PAQUET_METADATA = 64
+
+
+def nom_csv_par_defaut(totem_fpath: Path, format_sortie: FormatSortie = FormatSortie.CSV) -> str:
+    return f"{totem_fpath.stem}.{format_sortie.value}"
+
+
+def convertir_lot(
+    totem_fpaths: Iterable[Path],
+    pdcs_dpath: Path,
+    output_dpath: Path,
+    workers: Optional[int] = None,
+    options: Options = Options(),
+    xslt_budget: Optional[Path] = None,
+    moteur: MoteurConversion = MoteurConversion.XSLT,
+    taille_cache_pdc: int = 16,
+    nom_csv: Optional[Callable[[Path], str]] = None,
+    progression: Optional[Callable[[ResultatConversion], None]] = None,
+    pdcs_compiles: Optional[Path] = None,
+    metriques: Optional[MetriquesConversion] = None,
+) -> list[ResultatConversion]:
+    """Convertit un lot de fichiers totem en SCDL, en parallèle sur plusieurs processus
+
+    Chaque processus dispose de son propre ConvertisseurTotemBudget (XSLT compilée et
+    cache des plans de comptes), réutilisé pour tous les fichiers qu'il traite.
+    Une erreur sur un fichier n'interrompt pas le lot.
+
+    Args:
+        totem_fpaths (Iterable[Path]): Fichiers totem à convertir.
+        pdcs_dpath (Path): Chemin contenant les plans de comptes.
+        output_dpath (Path): Dossier dans lequel les SCDL sont écrits.
+        workers (int, optional): Nombre de processus. 1 pour convertir dans le processus courant.
+          Defaults to None (nombre de CPU).
+        options (Options, optional): Options de conversion. Defaults to Options().
+        xslt_budget (Path, optional): Voir ConvertisseurTotemBudget. Defaults to None.
+        moteur (MoteurConversion, optional): Voir ConvertisseurTotemBudget. Defaults to MoteurConversion.XSLT.
+        taille_cache_pdc (int, optional): Taille du cache des plans de comptes de chaque processus. Defaults to 16.
+        nom_csv (Callable[[Path], str], optional): Nom du fichier SCDL produit pour un fichier totem.
+          Defaults to None (nom_csv_par_defaut, avec l'extension du format de sortie).
+        progression (Callable[[ResultatConversion], None], optional): Appelée à chaque fichier traité.
+          Defaults to None.
+        pdcs_compiles (Path, optional): Fichier de plans de comptes compilés par compiler_plans_de_comptes,
+          chargé par chaque processus. Defaults to None.
+        metriques (MetriquesConversion, optional): Reçoit la mesure de chaque conversion,
+          transmise par les processus avec son résultat. Defaults to None.
+
+    Raises:
+        ValueError: si plusieurs fichiers totem produisent le même nom de fichier SCDL
+
+    Returns:
+        list[ResultatConversion]: Un résultat par fichier totem, dans l'ordre donné.
+    """
+    totem_fpaths = [Path(p) for p in totem_fpaths]
+    if nom_csv is None:
+        nom_csv = partial(nom_csv_par_defaut, format_sortie=options.format_sortie)
+    csv_fpaths = [Path(output_dpath) / nom_csv(p) for p in totem_fpaths]
+    _verifier_noms_uniques(csv_fpaths)
+
+    Path(output_dpath).mkdir(parents=True, exist_ok=True)
+    resultats: list[Optional[ResultatConversion]] = [None] * len(totem_fpaths)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if workers == 1:
+        convertisseur = _nouveau_convertisseur(xslt_budget, moteur, taille_cache_pdc, pdcs_compiles)
+        for i, (totem_fpath, csv_fpath) in enumerate(zip(totem_fpaths, csv_fpaths)):
+            resultats[i] = _convertir_avec(
+                convertisseur, totem_fpath, pdcs_dpath, csv_fpath, options
+            )
+            _enregistrer_mesure(metriques, resultats[i])  # type: ignore[arg-type]
+            if progression is not None:
+                progression(resultats[i])  # type: ignore[arg-type]
+        return resultats  # type: ignore[return-value]
+
+    logger.info(f"Conversion de {len(totem_fpaths)} fichiers sur {workers} processus")
+
+    def _nouveau_pool(max_workers: int) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_initialiser_worker,
+            initargs=(xslt_budget, moteur, taille_cache_pdc, pdcs_compiles),
+        )
+
+    def _soumettre(executor: ProcessPoolExecutor, i: int) -> Future:
+        return executor.submit(_convertir_worker, totem_fpaths[i], pdcs_dpath, csv_fpaths[i], options)
+
+    def _terminer(i: int, resultat: ResultatConversion):
+        resultats[i] = resultat
+        _enregistrer_mesure(metriques, resultat)
+        if progression is not None:
+            progression(resultat)
+
+    restants = deque(range(len(totem_fpaths)))
+    while restants:
+        with _nouveau_pool(workers) as executor:
+            suspects = _convertir_sur_pool(executor, restants, 2 * workers, _soumettre, _terminer)
+        if suspects:
+            # Un processus a été tué (manque de mémoire par exemple) et le pool est inutilisable.
+            # Les fichiers en cours sont reconvertis un par un pour n'attribuer l'échec qu'au coupable,
+            # puis le reste du lot repart sur un nouveau pool.
+            logger.warning(f"Pool de conversion interrompu, {len(suspects)} fichiers reconvertis isolément")
+            _convertir_isolement(suspects, _nouveau_pool, _soumettre, totem_fpaths, csv_fpaths, _terminer)
+
+    return resultats  # type: ignore[return-value]
+
+
+def _convertir_sur_pool(
+    executor: ProcessPoolExecutor,
+    restants: deque,
+    en_avance: int,
+    soumettre: Callable[[ProcessPoolExecutor, int], Future],
+    terminer: Callable[[int, ResultatConversion], None],
+) -> list[int]:
+    """Convertit les fichiers restants (indices consommés), au plus en_avance à la fois.
+    Si le pool est interrompu, s'arrête et renvoie les fichiers dont la conversion a été perdue."""
+    en_cours: dict[Future, int] = {}
+    perdus: list[int] = []
+    while (restants and not perdus) or en_cours:
+        while restants and not perdus and len(en_cours) < en_avance:
+            i = restants.popleft()
+            try:
+                en_cours[soumettre(executor, i)] = i
+            except BrokenProcessPool:
+                perdus.append(i)
+        if not en_cours:
+            break
+        termines, _ = wait(en_cours, return_when=FIRST_COMPLETED)
+        for future in termines:
+            i = en_cours.pop(future)
+            try:
+                terminer(i, future.result())
+            except BrokenProcessPool:
+                perdus.append(i)
+    return perdus
+
+
+def _convertir_isolement(
+    indices: list[int],
+    nouveau_pool: Callable[[int], ProcessPoolExecutor],
+    soumettre: Callable[[ProcessPoolExecutor, int], Future],
+    totem_fpaths: list[Path],
+    csv_fpaths: list[Path],
+    terminer: Callable[[int, ResultatConversion], None],
+):
+    """Convertit chaque fichier seul dans le pool: une nouvelle interruption est due à ce fichier"""
+    executor: Optional[ProcessPoolExecutor] = None
+    try:
+        for i in indices:
+            if executor is None:
+                executor = nouveau_pool(1)
+            try:
+                resultat = soumettre(executor, i).result()
+            except BrokenProcessPool as err:
+                logger.warning(f"Echec de la conversion de {totem_fpaths[i]}: processus de conversion interrompu")
+                executor.shutdown()
+                executor = None
+                csv_fpaths[i].unlink(missing_ok=True)
+                resultat = ResultatConversion(totem_fpath=totem_fpaths[i], csv_fpath=None, erreur=err)
+            terminer(i, resultat)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def metadata_lot(
+    totem_fpaths: Iterable[Path],
+    pdcs_dpath: Path,
+    workers: Optional[int] = None,
+    cache: Optional[CacheMetadata] = None,
+) -> Iterator[ResultatMetadata]:
+    """Extrait les metadata d'un lot de fichiers totem, en parallèle sur plusieurs processus
+
+    Une erreur sur un fichier n'interrompt pas le lot.
+
+    Args:
+        totem_fpaths (Iterable[Path]): Fichiers totem.
+        pdcs_dpath (Path): Chemin contenant les plans de comptes.
+        workers (int, optional): Nombre de processus, au plus un par fichier à extraire. 1 pour extraire
+          dans le processus courant. Defaults to None (nombre de CPU).
+        cache (CacheMetadata, optional): Cache persistant. Les fichiers inchangés depuis leur mise
+          en cache ne sont pas relus. Defaults to None.
+
+    Yields:
+        ResultatMetadata: Un résultat par fichier totem, dans l'ordre donné.
+    """
+    totem_fpaths = [Path(p) for p in totem_fpaths]
+    signatures = [signature(p) for p in totem_fpaths]
+    en_cache = [
+        cache.lire(p, pdcs_dpath, s) if cache is not None else None
+        for p, s in zip(totem_fpaths, signatures)
+    ]
+    a_extraire = [p for p, resultat in zip(totem_fpaths, en_cache) if resultat is None]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(a_extraire)))
+    # Les fichiers sont envoyés par paquets, répartis entre tous les processus
+    taille_paquet = min(_TAILLE_PAQUET_METADATA, math.ceil(len(a_extraire) / workers))
+
+    def _yield_dans_l_ordre(extraits: Iterator[ResultatMetadata]) -> Iterator[ResultatMetadata]:
+        for resultat, signature_totem in zip(en_cache, signatures):
+            if resultat is None:
+                resultat = next(extraits)
+                if cache is not None:
+                    cache.ecrire(resultat, pdcs_dpath, signature_totem)
+            yield resultat
+
+    try:
+        if workers == 1:
+            convertisseur = ConvertisseurTotemBudget()
+            yield from _yield_dans_l_ordre(
+                _metadata_avec(convertisseur, p, pdcs_dpath) for p in a_extraire
+            )
+            return
+
+        logger.info(f"Extraction des metadata de {len(a_extraire)} fichiers sur {workers} processus")
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            extraits = executor.map(
+                _metadata_worker,
+                a_extraire,
+                [pdcs_dpath] * len(a_extraire),
+                chunksize=taille_paquet,
+            )
+            yield from _yield_dans_l_ordre(iter(extraits))
+    finally:
+        if cache is not None:
+            cache.enregistrer()
+
+
+def _enregistrer_mesure(metriques: Optional[MetriquesConversion], resultat: ResultatConversion):
+    if metriques is not None and resultat.mesure is not None:
+        metriques.enregistrer(resultat.mesure)
+
+
+def _verifier_noms_uniques(fpaths: list[Path]):
+    vus: set[Path] = set()
+    for fpath in fpaths:
+        if fpath in vus:
+            raise ValueError(f"Plusieurs fichiers totem produiraient le même fichier '{fpath}'")
+        vus.add(fpath)
+
+
+def _nouveau_convertisseur(
+    xslt_budget: Optional[Path],
+    moteur: MoteurConversion,
+    taille_cache_pdc: int,
+    pdcs_compiles: Optional[Path] = None,
+) -> ConvertisseurTotemBudget:
+    compiles = PlansDeComptesCompiles(pdcs_compiles) if pdcs_compiles is not None else None
+    convertisseur = ConvertisseurTotemBudget(
+        xslt_budget=xslt_budget,
+        cache_pdc=CachePlansDeComptes(taille_max=taille_cache_pdc, compiles=compiles),
+        moteur=moteur,
+    )
+    if moteur is MoteurConversion.XSLT:
+        convertisseur._xslt_compilee()
+    return convertisseur
+
+
+def _initialiser_worker(
+    xslt_budget: Optional[Path],
+    moteur: MoteurConversion,
+    taille_cache_pdc: int,
+    pdcs_compiles: Optional[Path] = None,
+):
+    global _convertisseur_worker
+    _convertisseur_worker = _nouveau_convertisseur(
+        xslt_budget, moteur, taille_cache_pdc, pdcs_compiles
+    )
+
+
+def _convertir_worker(
+    totem_fpath: Path, pdcs_dpath: Path, csv_fpath: Path, options: Options
+) -> ResultatConversion:
+    assert _convertisseur_worker is not None, "Le processus n'a pas été initialisé"
+    return _convertir_avec(_convertisseur_worker, totem_fpath, pdcs_dpath, csv_fpath, options)
+
+
+def _convertir_avec(
+    convertisseur: ConvertisseurTotemBudget,
+    totem_fpath: Path,
+    pdcs_dpath: Path,
+    csv_fpath: Path,
+    options: Options,
+) -> ResultatConversion:
+    with _collecter_mesures() as mesures:
+        try:
+            with _ouvrir_sortie(csv_fpath, options) as output:
+                convertisseur.totem_budget_vers_scdl(
+                    totem_fpath=totem_fpath,
+                    pdcs_dpath=pdcs_dpath,
+                    output=output,
+                    options=options,
+                )
+            return ResultatConversion(
+                totem_fpath=totem_fpath, csv_fpath=csv_fpath, mesure=_derniere(mesures)
+            )
+        except Exception as err:
+            logger.warning(f"Echec de la conversion de {totem_fpath}: {err}")
+            csv_fpath.unlink(missing_ok=True)
+            return ResultatConversion(
+                totem_fpath=totem_fpath,
+                csv_fpath=None,
+                erreur=_erreur_transmissible(err),
+                mesure=_derniere(mesures),
+            )
+
+
+def _derniere(mesures: list[MesureConversion]) -> Optional[MesureConversion]:
+    return mesures[-1] if len(mesures) > 0 else None
+
+
+def _metadata_worker(totem_fpath: Path, pdcs_dpath: Path) -> ResultatMetadata:
+    global _convertisseur_worker
+    if _convertisseur_worker is None:
+        _convertisseur_worker = ConvertisseurTotemBudget()
+    return _metadata_avec(_convertisseur_worker, totem_fpath, pdcs_dpath)
+
+
+def _metadata_avec(
+    convertisseur: ConvertisseurTotemBudget, totem_fpath: Path, pdcs_dpath: Path
+) -> ResultatMetadata:
+    try:
+        metadata = convertisseur.totem_budget_metadata(totem_fpath, pdcs_dpath)
+        return ResultatMetadata(totem_fpath=totem_fpath, metadata=metadata)
+    except ExtractionMetadataErreur as err:
+        logger.warning(f"Echec de l'extraction des metadata de {totem_fpath}: {err}")
+        return ResultatMetadata(totem_fpath=totem_fpath, metadata=None, erreur=err)
+
+
+def _erreur_transmissible(err: Exception) -> Exception:
+    # La cause d'une exception n'est pas transmise entre processus:
+    # on remonte l'erreur la plus parlante.
+    if isinstance(err, ConversionErreur) and err.message is None and err.__cause__ is not None:
+        cause = err.__cause__
+        if isinstance(cause, (ConversionErreur, TotemInvalideErreur, ExtractionMetadataErreur)):
+            return cause
+        return ConversionErreur(f"{type(cause).__name__}: {cause}")
+    return err
@@ -1,30 +1,255 @@
 import argparse
+import glob
+import json
 import os
 from pathlib import Path
 import sys
 
-from yatotem2scdl.conversion import ConvertisseurTotemBudget
+from yatotem2scdl.data_structures import FormatSortie, Options, ResultatConversion
+from yatotem2scdl.exceptions import ExtractionMetadataErreur
+from yatotem2scdl.metadata import lire_totem_budget_metadata
 
+# La conversion (lxml, XSLT) n'est importée que par les commandes qui en ont besoin,
+# la commande metadata démarre ainsi sans la charger.
+
+
+def _convertisseur(args, metriques):
+    from yatotem2scdl.conversion import ConvertisseurTotemBudget
+    from yatotem2scdl.plan_de_compte import CachePlansDeComptes
+    from yatotem2scdl.plans_de_comptes_compiles import PlansDeComptesCompiles
+
+    compiles = (
+        PlansDeComptesCompiles(Path(args.plans_de_comptes_compiles))
+        if args.plans_de_comptes_compiles is not None
+        else None
+    )
+    return ConvertisseurTotemBudget(
+        cache_pdc=CachePlansDeComptes(compiles=compiles), metriques=metriques
+    )
 
-def process(args):
 
+def process(args):
     totem_filep = Path(args.totem_file)
     pdcs_dpath = Path(args.plans_de_comptes)
 
-    convertisseur = ConvertisseurTotemBudget()
-    convertisseur.totem_budget_vers_scdl(
-        totem_fpath=totem_filep, pdcs_dpath=pdcs_dpath, output=sys.stdout
+    options = Options(format_sortie=FormatSortie(args.format))
+    metriques = _metriques(args)
+    convertisseur = _convertisseur(args, metriques)
+    output = sys.stdout.buffer if options.format_sortie.binaire else sys.stdout
+    try:
+        if args.precedent is not None:
+            _process_incremental(args, convertisseur, totem_filep, pdcs_dpath, output, options)
+        elif args.enveloppe:
+            _process_enveloppe(args, convertisseur, totem_filep, pdcs_dpath, output, options)
+        else:
+            convertisseur.totem_budget_vers_scdl(
+                totem_fpath=totem_filep,
+                pdcs_dpath=pdcs_dpath,
+                output=output,
+                options=options,
+            )
+    finally:
+        _ecrire_metriques(args, metriques)
+
+
+def _process_incremental(args, convertisseur, totem_filep: Path, pdcs_dpath: Path, output, options: Options):
+    """Ecrit le SCDL complet sur output et le SCDL delta dans args.delta"""
+    if options.format_sortie.binaire:
+        delta_output = open(args.delta, "wb")
+    else:
+        delta_output = open(args.delta, "w", encoding="utf-8", newline="")
+    with delta_output:
+        resultat = convertisseur.totem_budget_vers_scdl_incremental(
+            totem_fpath=totem_filep,
+            precedent_fpath=Path(args.precedent),
+            pdcs_dpath=pdcs_dpath,
+            delta_output=delta_output,
+            output=output,
+            options=options,
+        )
+    sys.stderr.write(
+        f"{resultat.ajouts} ajouts, {resultat.modifications} modifications,"
+        f" {resultat.suppressions} suppressions, {resultat.inchangees} lignes inchangées\n"
+    )
+
+
+def _process_enveloppe(args, convertisseur, totem_filep: Path, pdcs_dpath: Path, output, options: Options):
+    """Ecrit le SCDL combiné des documents de l'enveloppe sur output, ou un SCDL par document dans args.output_dir"""
+    output_dpath = Path(args.output_dir) if args.output_dir is not None else None
+    documents = convertisseur.totem_enveloppe_vers_scdl(
+        totem_fpath=totem_filep,
+        pdcs_dpath=pdcs_dpath,
+        output=output if output_dpath is None else None,
+        output_dpath=output_dpath,
+        options=options,
+        workers=args.jobs,
+    )
+    for document in documents:
+        destination = f" dans {document.scdl_fpath}" if document.scdl_fpath is not None else ""
+        sys.stderr.write(
+            f"Document {document.position} ({document.metadata.id_etablissement}):"
+            f" {document.lignes} lignes{destination}\n"
+        )
+
+
+def process_partitions(args, totem_fpaths: list[Path]):
+    """Convertit les fichiers totem en un seul SCDL, réparti en partitions dans args.output_dir"""
+    from yatotem2scdl.partitions import SortiePartitionnee
+
+    pdcs_dpath = Path(args.plans_de_comptes)
+    options = Options(format_sortie=FormatSortie(args.format))
+    metriques = _metriques(args)
+    convertisseur = _convertisseur(args, metriques)
+    sortie = SortiePartitionnee(
+        Path(args.output_dir),
+        lignes_max=args.partitions_lignes,
+        octets_max=args.partitions_octets,
+        workers=args.jobs,
+    )
+    try:
+        with sortie:
+            for totem_fpath in totem_fpaths:
+                convertisseur.totem_budget_vers_scdl(totem_fpath, pdcs_dpath, sortie, options)
+    finally:
+        _ecrire_metriques(args, metriques)
+
+    assert sortie.manifeste is not None
+    sys.stderr.write(
+        f"{sortie.manifeste.lignes} lignes en {len(sortie.manifeste.partitions)} partitions"
+        f" dans {args.output_dir}\n"
     )
 
 
+def process_lot(args, totem_fpaths: list[Path]) -> int:
+    """Convertit un lot de fichiers dans args.output_dir. Renvoie le nombre d'échecs."""
+    from yatotem2scdl.lot import convertir_lot
+
+    pdcs_dpath = Path(args.plans_de_comptes)
+    options = Options(format_sortie=FormatSortie(args.format))
+    racine = _racine_commune(totem_fpaths)
+    total = len(totem_fpaths)
+    traites = 0
+
+    def _progression(resultat: ResultatConversion):
+        nonlocal traites
+        traites += 1
+        statut = "OK" if resultat.succes else f"ECHEC: {resultat.erreur}"
+        sys.stderr.write(f"[{traites}/{total}] {resultat.totem_fpath} {statut}\n")
+
+    metriques = _metriques(args)
+    try:
+        resultats = convertir_lot(
+            totem_fpaths,
+            pdcs_dpath,
+            Path(args.output_dir),
+            workers=args.jobs,
+            options=options,
+            nom_csv=lambda p: _nom_csv_relatif(p, racine, options.format_sortie),
+            progression=_progression,
+            pdcs_compiles=(
+                Path(args.plans_de_comptes_compiles)
+                if args.plans_de_comptes_compiles is not None
+                else None
+            ),
+            metriques=metriques,
+        )
+    finally:
+        _ecrire_metriques(args, metriques)
+
+    echecs = [r for r in resultats if not r.succes]
+    sys.stderr.write(f"{total - len(echecs)}/{total} fichiers convertis\n")
+    for echec in echecs:
+        sys.stderr.write(f"\t{echec.totem_fpath}: {echec.erreur}\n")
+    return len(echecs)
+
+
+def _metriques(args):
+    if args.metriques is None:
+        return None
+    from yatotem2scdl.metriques import MetriquesConversion
+
+    return MetriquesConversion()
+
+
+def _ecrire_metriques(args, metriques):
+    if metriques is not None:
+        metriques.ecrire_prometheus(Path(args.metriques))
+
+
+def process_metadata(args, totem_fpaths: list[Path]) -> int:
+    """Ecrit les metadata de chaque fichier sur la sortie standard, une ligne JSON par fichier.
+    Renvoie le nombre d'échecs."""
+
+    pdcs_dpath = Path(args.plans_de_comptes)
+    echecs = 0
+    for totem_fpath in totem_fpaths:
+        ligne: dict = {"fichier": str(totem_fpath)}
+        try:
+            metadata = lire_totem_budget_metadata(totem_fpath, pdcs_dpath)
+            ligne.update(
+                annee_exercice=metadata.annee_exercice,
+                id_etablissement=metadata.id_etablissement,
+                etape_budgetaire=metadata.etape_budgetaire.name,
+                scellement=(
+                    metadata.scellement.date.isoformat()
+                    if metadata.scellement is not None
+                    else None
+                ),
+                plan_de_compte=(
+                    str(metadata.plan_de_compte)
+                    if metadata.plan_de_compte is not None
+                    else None
+                ),
+            )
+        except ExtractionMetadataErreur as err:
+            echecs += 1
+            ligne["erreur"] = str(err)
+        sys.stdout.write(json.dumps(ligne, ensure_ascii=False) + "\n")
+    return echecs
+
+
+def _fichiers_totem(chemin: str) -> list[Path]:
+    """Fichiers totem désignés par un fichier, un dossier (ses *.xml) ou un glob"""
+    if glob.has_magic(chemin):
+        return sorted(Path(p) for p in glob.glob(chemin, recursive=True) if os.path.isfile(p))
+    path = Path(chemin)
+    if path.is_dir():
+        return sorted(p for p in path.glob("*.xml") if p.is_file())
+    return [path]
+
+
+def _racine_commune(fpaths: list[Path]) -> Path:
+    if len(fpaths) == 0:
+        return Path(".")
+    return Path(os.path.commonpath([p.resolve().parent for p in fpaths]))
+
+
+def _nom_csv_relatif(
+    totem_fpath: Path, racine: Path, format_sortie: FormatSortie = FormatSortie.CSV
+) -> str:
+    # Plusieurs dossiers peuvent contenir un totem.xml,
+    # on nomme donc le CSV d'après le chemin relatif du fichier.
+    relatif = totem_fpath.resolve().relative_to(racine).with_suffix("")
+    return "-".join(relatif.parts) + f".{format_sortie.value}"
+
+
 def main():
 
     pdc_argname = "--plans-de-comptes"
     pdc_envname = "PLANS_DE_COMPTES_DIR"
 
     parser = argparse.ArgumentParser(description="Convertit un fichier totem en SCDL")
-    parser.add_argument("nature_acte", type=str, help="Nature de l'acte (seul la valeur budget est supporté pour le moment)")
-    parser.add_argument("totem_file", type=str, help="Chemin du fichier totem")
+    parser.add_argument(
+        "nature_acte",
+        type=str,
+        help="Nature de l'acte (seul la valeur budget est supporté pour le moment)."
+        " La valeur metadata écrit les metadata des fichiers totem, une ligne JSON par fichier",
+    )
+    parser.add_argument(
+        "totem_file",
+        type=str,
+        help="Chemin du fichier totem. Un dossier ou un glob convertit un lot de fichiers vers --output-dir",
+    )
     parser.add_argument(
         pdc_argname,
         default=os.environ.get(pdc_envname),
@@ -33,14 +258,91 @@ def main():
         help="Dossier contenant les plans de comptes",
         required=False,
     )
+    parser.add_argument(
+        "--plans-de-comptes-compiles",
+        default=os.environ.get("PLANS_DE_COMPTES_COMPILES"),
+        type=str,
+        dest="plans_de_comptes_compiles",
+        help="Fichier produit par yatotem2scdl-compiler-pdc depuis le dossier des plans de comptes",
+        required=False,
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        type=str,
+        dest="output_dir",
+        help="Dossier dans lequel écrire les SCDL. Sans cette option, le SCDL est écrit sur la sortie standard",
+    )
+    parser.add_argument(
+        "--format",
+        default=FormatSortie.CSV.value,
+        choices=[f.value for f in FormatSortie],
+        type=str,
+        dest="format",
+        help="Format du SCDL produit. Les formats csv.zst, parquet et arrow nécessitent une dépendance optionnelle",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        default=None,
+        type=int,
+        dest="jobs",
+        help="Nombre de processus pour la conversion d'un lot. Par défaut, le nombre de CPU",
+    )
+    parser.add_argument(
+        "--metriques",
+        default=None,
+        type=str,
+        dest="metriques",
+        help="Fichier dans lequel écrire les métriques de la conversion (durée des phases, lignes,"
+        " accès aux caches), au format texte de Prometheus",
+    )
+    parser.add_argument(
+        "--precedent",
+        default=None,
+        type=str,
+        dest="precedent",
+        help="Fichier totem de l'étape budgétaire précédente, du même établissement et du même exercice."
+        " Seules les lignes changées sont calculées et écrites dans --delta",
+    )
+    parser.add_argument(
+        "--delta",
+        default=None,
+        type=str,
+        dest="delta",
+        help="Fichier dans lequel écrire le SCDL delta (lignes ajoutées, modifiées, supprimées) avec --precedent",
+    )
+    parser.add_argument(
+        "--partitions-lignes",
+        default=None,
+        type=int,
+        dest="partitions_lignes",
+        help="Avec --output-dir, écrit les SCDL de tous les fichiers totem en un seul export, réparti en"
+        " partitions d'au plus ce nombre de lignes et décrit par un fichier manifeste.json",
+    )
+    parser.add_argument(
+        "--partitions-octets",
+        default=None,
+        type=int,
+        dest="partitions_octets",
+        help="Comme --partitions-lignes, avec des partitions d'au plus cette taille estimée avant compression",
+    )
+    parser.add_argument(
+        "--enveloppe",
+        action="store_true",
+        dest="enveloppe",
+        help="Convertit chaque DocumentBudgetaire du fichier (budget principal et budgets annexes), en parallèle"
+        " sur --jobs threads. Le SCDL combiné est écrit sur la sortie standard, ou un SCDL par document"
+        " dans --output-dir",
+    )
     args = parser.parse_args()
 
     status = 0
 
-    if args.nature_acte != "budget":
+    if args.nature_acte not in ("budget", "metadata"):
         sys.stderr.write("Seul les budgets sont supportés.")
         sys.exit(-1)
-    
+
     if args.plans_de_comptes is None:
         sys.stderr.write("Vous devez spécifier oú se trouvent les plans de comptes ")
         sys.stderr.write(
@@ -49,8 +351,49 @@ def main():
         sys.stderr.write("\n")
         sys.exit(-1)
 
+    if args.jobs is not None and args.jobs < 1:
+        sys.stderr.write("Le nombre de processus doit être d'au moins 1\n")
+        sys.exit(-1)
+
+    if args.nature_acte == "metadata":
+        totem_fpaths = _fichiers_totem(args.totem_file)
+        if len(totem_fpaths) == 0:
+            sys.stderr.write(f"Aucun fichier totem trouvé pour '{args.totem_file}'\n")
+            sys.exit(-1)
+        sys.exit(-1 if process_metadata(args, totem_fpaths) > 0 else 0)
+
+    mode_partitions = args.partitions_lignes is not None or args.partitions_octets is not None
+    if mode_partitions and args.output_dir is None:
+        sys.stderr.write("Les partitions sont écrites dans le dossier --output-dir\n")
+        sys.exit(-1)
+    lot_demande = glob.has_magic(args.totem_file) or Path(args.totem_file).is_dir()
+    if args.enveloppe and (lot_demande or mode_partitions or args.precedent is not None):
+        sys.stderr.write("La conversion d'une enveloppe ne porte que sur un fichier totem\n")
+        sys.exit(-1)
+    mode_lot = args.output_dir is not None and not mode_partitions and not args.enveloppe
+    if args.output_dir is None and lot_demande:
+        sys.stderr.write("La conversion d'un dossier ou d'un glob nécessite l'argument --output-dir\n")
+        sys.exit(-1)
+
+    if (args.precedent is None) != (args.delta is None):
+        sys.stderr.write("Les arguments --precedent et --delta vont ensemble\n")
+        sys.exit(-1)
+    if args.output_dir is not None and args.precedent is not None:
+        sys.stderr.write("La conversion incrémentale ne porte que sur un fichier totem\n")
+        sys.exit(-1)
+
     try:
-        process(args)
+        if mode_lot or mode_partitions:
+            totem_fpaths = _fichiers_totem(args.totem_file)
+            if len(totem_fpaths) == 0:
+                sys.stderr.write(f"Aucun fichier totem trouvé pour '{args.totem_file}'\n")
+                sys.exit(-1)
+            if mode_partitions:
+                process_partitions(args, totem_fpaths)
+            elif process_lot(args, totem_fpaths) > 0:
+                status = -1
+        else:
+            process(args)
     except Exception as e:
         sys.stderr.write(str(e))
         status = -1
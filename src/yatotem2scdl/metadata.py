@@ -0,0 +1,235 @@
+"""Extraction des metadata d'un fichier totem
+
+Ce module ne dépend que de la bibliothèque standard: les outils qui n'ont besoin que des metadata,
+comme la commande `yatotem2scdl metadata`, démarrent ainsi sans charger lxml ni la XSLT.
+"""
+
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+from xml.etree import ElementTree
+
+from yatotem2scdl import logger
+
+from .data_structures import EtapeBudgetaire, TotemBudgetMetadata, TotemBudgetScellement
+from .sources import SourceTotem, ouvrir_totem_binaire
+from .exceptions import (
+    AnneeExerciceInvalideErreur,
+    EtapeBudgetaireInconnueErreur,
+    ExtractionMetadataErreur,
+    NomenclatureInvalideErreur,
+    SiretInvalideErreur,
+    TotemInvalideErreur,
+)
+
+if TYPE_CHECKING:
+    from .plans_de_comptes_compiles import PlansDeComptesCompiles
+
+
+def lire_totem_budget_metadata(totem_fpath: SourceTotem, pdcs_dpath: Path) -> TotemBudgetMetadata:
+    """Extrait les metadata d'un fichier totem, comme ConvertisseurTotemBudget.totem_budget_metadata, sans lxml
+
+    Args:
+        totem_fpath (SourceTotem): Chemin, contenu ou fichier binaire du document totem, éventuellement compressé.
+        pdcs_dpath (Path): Chemin contenant les plans de comptes.
+
+    Raises:
+        ExtractionMetadataErreur: si les metadata ne peuvent être extraites.
+    """
+    try:
+        valeurs = _lire_valeurs_metadata(totem_fpath)
+        return _metadata_depuis_valeurs(*valeurs, pdcs_dpath=pdcs_dpath)
+    except Exception as err:
+        raise ExtractionMetadataErreur(str(err)) from err
+
+
+def _metadata_depuis_valeurs(
+    nomenclature: Optional[str],
+    code_etape: Optional[str],
+    id_etab: Optional[str],
+    annee: Optional[str],
+    scellement_date: Optional[str],
+    pdcs_dpath: Path,
+    compiles: Optional["PlansDeComptesCompiles"] = None,
+) -> TotemBudgetMetadata:
+    try:
+        pdc_path: Optional[Path] = _calculer_pdc_from_totem_values(
+            nomenclature, annee, pdcs_dpath, compiles
+        )
+    except TotemInvalideErreur as err:
+        logger.warning(str(err))
+        pdc_path = None
+
+    etape = _parse_code_etape(code_etape)
+    annee_i = _parse_annee_exercice(annee)
+    id_etab_siret = _parse_siret(id_etab)
+
+    scellement_date_dt = _parse_scellement_annee(scellement_date)
+
+    metadata_scellement = (
+        TotemBudgetScellement(scellement_date_dt)
+        if scellement_date_dt is not None
+        else None
+    )
+
+    return TotemBudgetMetadata(
+        annee_exercice=annee_i,
+        etape_budgetaire=etape,
+        id_etablissement=id_etab_siret,
+        scellement=metadata_scellement,
+        plan_de_compte=pdc_path,
+    )
+
+
+def _calculer_pdc_from_totem_values(
+    nomenclature: Optional[str],
+    annee: Optional[str],
+    pdcs_dpath: Path,
+    compiles: Optional["PlansDeComptesCompiles"] = None,
+) -> Path:
+    """Calcule le chemin du plan de compte depuis une nomenclature et une annee
+
+    Args:
+        nomenclature (str): Valeur du tag Nomenclature dans un fichier totem
+        pdcs_dpath (Path): Chemin vers les plans de comptes
+        compiles (PlansDeComptesCompiles, optional): Plans de comptes compilés depuis pdcs_dpath.
+          L'existence du plan de compte y est vérifiée, plutôt que sur le système de fichiers.
+
+    Raises:
+        AnneeExerciceInvalideErreur: Si l'année d'exercice est irrécupérable
+        NomenclatureInvalideErreur: Si la nomenclature est invalide (aussi si aucun plan de compte ne correspond)
+
+    Returns:
+        Path: Chemin vers le plan de compte correspondant
+    """
+    if nomenclature is None:
+        raise NomenclatureInvalideErreur(None, pdcs_dpath)  # type: ignore
+    if annee is None:
+        raise AnneeExerciceInvalideErreur(annee)
+
+    logger.debug(f"Version de plan de compte trouvée: ({annee}, {nomenclature})")
+
+    (n1, n2) = nomenclature.split("-", 1)
+    pdc_path = pdcs_dpath / annee / n1 / n2 / "planDeCompte.xml"
+
+    if compiles is not None and compiles.couvre(pdcs_dpath):
+        existe = compiles.contient(annee, nomenclature)
+    else:
+        existe = pdc_path.is_file()
+
+    if not existe:
+        raise NomenclatureInvalideErreur(
+            nomenclature=nomenclature, pdcs_dpath=pdcs_dpath
+        )
+
+    logger.debug(f"Utilisation du plan de compte situé ici: '{pdc_path}'")
+    return pdc_path
+
+
+_TAGS_METADATA = {
+    "Nomenclature": "V",
+    "NatDec": "V",
+    "IdEtab": "V",
+    "Exer": "V",
+    "Scellement": "date",
+}
+_TAGS_LECTURE_METADATA = [
+    f"{{*}}{tag}" for tag in [*_TAGS_METADATA, "DocumentBudgetaire", "BlocBudget"]
+]
+# Petits blocs: l'entête tient généralement dans les premiers Ko du fichier
+_TAILLE_BLOC_METADATA = 4096
+
+
+def _lire_valeurs_metadata(totem_fpath: SourceTotem, parser=None) -> list[Optional[str]]:
+    """Valeurs (nomenclature, code_etape, id_etab, annee, scellement_date) du premier DocumentBudgetaire
+
+    Le fichier est donné par petits blocs à un XMLPullParser émettant les évènements start et end.
+    La lecture s'arrête dès que toutes les valeurs sont trouvées, ou à la fin du premier BlocBudget
+    puisque l'entête du document budgetaire le précède. Comme pour l'ancien lecteur SAX
+    (TotemMetadataHandler), une balise répétée avant l'arrêt prend la valeur de sa dernière occurrence.
+
+    Args:
+        totem_fpath (SourceTotem): Chemin, contenu ou fichier binaire du document totem.
+          Un fichier binaire n'est lu que jusqu'à la fin de l'entête.
+        parser (optional): XMLPullParser de lxml ou de la bibliothèque standard, qui partagent la même API.
+          Defaults to None (XMLPullParser de la bibliothèque standard).
+    """
+    valeurs: dict[str, Optional[str]] = {}
+    dans_document_budgetaire = False
+    if parser is None:
+        parser = ElementTree.XMLPullParser(events=("start", "end"))
+
+    with ouvrir_totem_binaire(totem_fpath) as totem:
+        while not _valeurs_completes(valeurs):
+            bloc = totem.read(_TAILLE_BLOC_METADATA)
+            if not bloc:
+                parser.close()
+                break
+            parser.feed(bloc)
+
+            for evenement, element in parser.read_events():
+                nom = element.tag.rsplit("}", 1)[-1]
+
+                if nom == "DocumentBudgetaire":
+                    dans_document_budgetaire = evenement == "start"
+                elif not dans_document_budgetaire:
+                    continue
+                elif evenement == "start" and nom in _TAGS_METADATA:
+                    valeurs[nom] = element.get(_TAGS_METADATA[nom])
+                    if _valeurs_completes(valeurs):
+                        break
+                elif evenement == "end" and nom == "BlocBudget":
+                    return [valeurs.get(tag) for tag in _TAGS_METADATA]
+
+    return [valeurs.get(tag) for tag in _TAGS_METADATA]
+
+
+def _valeurs_completes(valeurs: dict[str, Optional[str]]) -> bool:
+    return all(valeurs.get(tag) is not None for tag in _TAGS_METADATA)
+
+
+def _parse_annee_exercice(annee: Optional[str]) -> int:
+
+    try:
+        if annee is None:
+            raise Exception("L'annee ne peut pas etre None")
+        if len(annee) != 4:
+            raise Exception("L'annee doit etre une chaine de 4 digit.")
+        return int(annee)
+    except Exception as err:
+        raise AnneeExerciceInvalideErreur(annee) from err
+
+
+def _parse_siret(siret: Optional[str]) -> int:
+
+    try:
+        if siret is None:
+            raise Exception("le siret ne peut pas etre None")
+
+        if len(siret) != 14:
+            raise Exception("Nombre de digit incorrect")
+
+        siret_int = int(siret)
+
+        return siret_int
+    except Exception as err:
+        raise SiretInvalideErreur(siret) from err
+
+
+def _parse_code_etape(code_etape: Optional[str]) -> EtapeBudgetaire:
+
+    try:
+        if code_etape is None:
+            raise Exception("le siret ne peut pas etre None")
+
+        code_etape_i = int(code_etape)
+
+        return EtapeBudgetaire(code_etape_i)
+    except Exception as err:
+        raise EtapeBudgetaireInconnueErreur(code_etape) from err
+
+
+def _parse_scellement_annee(date: Optional[str]) -> Optional[datetime]:
+    if date is None:
+        return None
+    return datetime.fromisoformat(date)
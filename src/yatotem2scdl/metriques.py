@@ -0,0 +1,236 @@
+"""Mesures des conversions: durée de chaque phase, taille de l'entrée, lignes produites, accès aux caches
+
+Une MesureConversion est ouverte par ConvertisseurTotemBudget pour chaque appel. Elle est portée par
+une ContextVar: les phases, lignes et accès aux caches sont attribués à la bonne conversion,
+y compris lorsque le convertisseur est partagé entre threads. Les threads qui travaillent pour une
+conversion (documents d'une enveloppe) y sont rattachés en exécutant leurs tâches dans une copie du
+contexte (contextvars.copy_context); leurs phases s'additionnent alors à celles de la conversion. Les mesures sont agrégées par
+MetriquesConversion, exportables au format texte de Prometheus.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, Optional, TypeVar
+
+from yatotem2scdl import logger
+
+T = TypeVar("T")
+
+_PREFIXE = "yatotem2scdl"
+
+
+@dataclass
+class MesureConversion:
+    """Mesure d'un appel à ConvertisseurTotemBudget"""
+
+    operation: str  # "conversion" ou "metadata"
+    source: str  # Description du fichier totem, sans son contenu
+    phases: dict[str, float] = field(default_factory=dict)  # Durée de chaque phase, en secondes
+    octets_entree: Optional[int] = None  # Taille du fichier totem, None si inconnue (flux)
+    lignes: int = 0  # Lignes SCDL écrites. 0 lorsque le SCDL vient du cache.
+    cache_hits: dict[str, int] = field(default_factory=dict)  # Par cache: plan_de_compte, scdl
+    cache_misses: dict[str, int] = field(default_factory=dict)
+    erreur: Optional[str] = None  # Nom de la classe de l'exception levée
+
+    @property
+    def duree(self) -> float:
+        """Somme des phases. Pour une enveloppe, les phases des documents convertis en parallèle
+        s'ajoutent à la phase documents qui les contient: la somme dépasse alors la durée réelle."""
+        return sum(self.phases.values())
+
+
+# Protège les compteurs d'une mesure alimentée par plusieurs threads
+_VERROU_MESURE = threading.Lock()
+
+_MESURE: ContextVar[Optional[MesureConversion]] = ContextVar("yatotem2scdl_mesure", default=None)
+_COLLECTE: ContextVar[Optional[list[MesureConversion]]] = ContextVar("yatotem2scdl_collecte", default=None)
+
+
+@contextmanager
+def _mesurer(
+    operation: str,
+    source: str,
+    octets_entree: Optional[int] = None,
+    metriques: Optional["MetriquesConversion"] = None,
+) -> Iterator[MesureConversion]:
+    """Ouvre la mesure d'un appel, à laquelle sont rattachées les phases exécutées dans le contexte.
+    La mesure terminée est enregistrée dans metriques."""
+    mesure = MesureConversion(operation=operation, source=source, octets_entree=octets_entree)
+    jeton = _MESURE.set(mesure)
+    try:
+        yield mesure
+    except BaseException as err:
+        mesure.erreur = type(err).__name__
+        raise
+    finally:
+        _MESURE.reset(jeton)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f"{operation} de {source}: "
+                + ", ".join(f"{nom} {duree * 1000:.1f} ms" for nom, duree in mesure.phases.items())
+                + f", {mesure.lignes} lignes"
+            )
+        collecte = _COLLECTE.get()
+        if collecte is not None:
+            collecte.append(mesure)
+        if metriques is not None:
+            metriques.enregistrer(mesure)
+
+
+@contextmanager
+def _phase(nom: str) -> Iterator[None]:
+    debut = time.perf_counter()
+    try:
+        yield
+    finally:
+        mesure = _MESURE.get()
+        if mesure is not None:
+            duree = time.perf_counter() - debut
+            with _VERROU_MESURE:
+                mesure.phases[nom] = mesure.phases.get(nom, 0.0) + duree
+
+
+def _compter_cache(nom: str, hit: bool):
+    mesure = _MESURE.get()
+    if mesure is not None:
+        compteurs = mesure.cache_hits if hit else mesure.cache_misses
+        with _VERROU_MESURE:
+            compteurs[nom] = compteurs.get(nom, 0) + 1
+
+
+def _ajouter_lignes(nombre: int):
+    """Compte des lignes écrites hors de ecrire_lignes, éventuellement depuis un autre thread"""
+    mesure = _MESURE.get()
+    if mesure is not None:
+        with _VERROU_MESURE:
+            mesure.lignes += nombre
+
+
+def _compter_lignes(lignes: Iterable[T]) -> Iterator[T]:
+    mesure = _MESURE.get()
+    if mesure is None:
+        yield from lignes
+        return
+    for ligne in lignes:
+        mesure.lignes += 1
+        yield ligne
+
+
+@contextmanager
+def _collecter_mesures() -> Iterator[list[MesureConversion]]:
+    """Collecte les mesures terminées dans le contexte, pour les transmettre d'un processus à l'autre"""
+    mesures: list[MesureConversion] = []
+    jeton = _COLLECTE.set(mesures)
+    try:
+        yield mesures
+    finally:
+        _COLLECTE.reset(jeton)
+
+
+class MetriquesConversion:
+    def __init__(self, observateur: Optional[Callable[[MesureConversion], None]] = None):
+        """Agrégation des mesures des conversions, partageable entre convertisseurs et threads.
+
+        Args:
+            observateur (Callable[[MesureConversion], None], optional): Appelé avec chaque mesure
+              enregistrée, par exemple pour la journaliser. Defaults to None.
+        """
+        self.observateur = observateur
+
+        self.__lock = threading.Lock()
+        self.__operations: dict[tuple[str, str], int] = defaultdict(int)
+        self.__durees: dict[tuple[str, str], float] = defaultdict(float)
+        self.__phases: dict[tuple[str, str], int] = defaultdict(int)
+        self.__octets: dict[str, int] = defaultdict(int)
+        self.__lignes: dict[str, int] = defaultdict(int)
+        self.__cache_hits: dict[str, int] = defaultdict(int)
+        self.__cache_misses: dict[str, int] = defaultdict(int)
+
+    def enregistrer(self, mesure: MesureConversion):
+        with self.__lock:
+            resultat = "succes" if mesure.erreur is None else "echec"
+            self.__operations[(mesure.operation, resultat)] += 1
+            for nom, duree in mesure.phases.items():
+                self.__durees[(mesure.operation, nom)] += duree
+                self.__phases[(mesure.operation, nom)] += 1
+            self.__octets[mesure.operation] += mesure.octets_entree or 0
+            self.__lignes[mesure.operation] += mesure.lignes
+            for nom, nombre in mesure.cache_hits.items():
+                self.__cache_hits[nom] += nombre
+            for nom, nombre in mesure.cache_misses.items():
+                self.__cache_misses[nom] += nombre
+
+        if self.observateur is not None:
+            self.observateur(mesure)
+
+    def prometheus(self) -> str:
+        """Métriques au format texte de Prometheus"""
+        with self.__lock:
+            blocs = [
+                _bloc(
+                    "operations_total", "counter", "Appels au convertisseur, par opération et résultat",
+                    {_labels(operation=o, resultat=r): n for (o, r), n in self.__operations.items()},
+                ),
+                _bloc(
+                    "phase_duree_secondes", "summary", "Durée des phases de conversion",
+                    {
+                        **{_labels("_sum", operation=o, phase=p): d for (o, p), d in self.__durees.items()},
+                        **{_labels("_count", operation=o, phase=p): n for (o, p), n in self.__phases.items()},
+                    },
+                ),
+                _bloc(
+                    "entree_octets_total", "counter", "Taille des fichiers totem lus",
+                    {_labels(operation=o): n for o, n in self.__octets.items()},
+                ),
+                _bloc(
+                    "lignes_scdl_total", "counter", "Lignes SCDL écrites",
+                    {_labels(operation=o): n for o, n in self.__lignes.items()},
+                ),
+                _bloc(
+                    "cache_hits_total", "counter", "Accès aux caches servis par le cache",
+                    {_labels(cache=c): n for c, n in self.__cache_hits.items()},
+                ),
+                _bloc(
+                    "cache_misses_total", "counter", "Accès aux caches non servis par le cache",
+                    {_labels(cache=c): n for c, n in self.__cache_misses.items()},
+                ),
+            ]
+        return "".join(blocs)
+
+    def ecrire_prometheus(self, fpath: Path):
+        """Ecrit les métriques dans fpath, de façon atomique, pour le collecteur textfile de node_exporter"""
+        fpath = Path(fpath)
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=fpath.parent)
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                f.write(self.prometheus())
+            os.replace(tmp, fpath)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+
+def _bloc(nom: str, type_: str, aide: str, valeurs: dict[tuple[str, str], float]) -> str:
+    nom = f"{_PREFIXE}_{nom}"
+    lignes = [f"# HELP {nom} {aide}\n", f"# TYPE {nom} {type_}\n"]
+    # Les échantillons d'une même série (_sum et _count d'un summary) sont regroupés
+    for (suffixe, labels), valeur in sorted(valeurs.items(), key=lambda item: (item[0][1], item[0][0])):
+        valeur_str = str(valeur) if isinstance(valeur, int) else repr(float(valeur))
+        lignes.append(f"{nom}{suffixe}{{{labels}}} {valeur_str}\n")
+    return "".join(lignes)
+
+
+def _labels(suffixe: str = "", **labels: str) -> tuple[str, str]:
+    return suffixe, ",".join(f'{nom}="{_echapper(valeur)}"' for nom, valeur in sorted(labels.items()))
+
+
+def _echapper(valeur: str) -> str:
+    return valeur.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
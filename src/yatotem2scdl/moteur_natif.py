@@ -0,0 +1,275 @@
+"""Moteur de conversion natif, équivalent Python de la XSLT totem2xmlcsv.xsl
+
+Les lignes SCDL sont produites directement depuis les éléments LigneBudget,
+sans construire le modèle intermédiaire XML. La XSLT reste la référence:
+les deux moteurs doivent produire exactement le même CSV.
+"""
+
+from typing import Callable, Iterable, Iterator, Optional, Union
+
+from lxml import etree
+
+from .exceptions import TotemInvalideErreur
+from .plan_de_compte import IndexPlanDeCompte
+
+_NS = "http://www.minefi.gouv.fr/cp/demat/docbudgetaire"
+_NAMESPACES = {"totem": _NS}
+
+# DecNat labels from CommunBudget.xsd
+_LIBELLES_NATDEC = {
+    "01": "Budget primitif",
+    "02": "Décision modificative",
+    "03": "Budget supplémentaire",
+    "09": "Compte administratif",
+    "10": "Compte administratif",
+}
+_LIBELLES_SECTION = {"I": "investissement", "F": "fonctionnement"}
+_LIBELLES_OPBUDG = {"0": "réel", "1": "ordre"}
+_LIBELLES_CODRD = {"R": "recette", "D": "dépense"}
+_LIBELLES_ARTSPE = {"false": "non spécialisé", "true": "spécialisé"}
+
+_MONTANTS = [
+    f"{{{_NS}}}{tag}"
+    for tag in [
+        "MtReal",
+        "MtBudgPrec",
+        "MtRARPrec",
+        "MtPropNouv",
+        "MtPrev",
+        "CredOuv",
+        "MtRAR3112",
+    ]
+]
+_CONTNAT = f"{{{_NS}}}ContNat"
+_NATURE = f"{{{_NS}}}Nature"
+_FONCTION = f"{{{_NS}}}Fonction"
+_OPERATION = f"{{{_NS}}}Operation"
+_OPBUDG = f"{{{_NS}}}OpBudg"
+_CODRD = f"{{{_NS}}}CodRD"
+_ARTSPE = f"{{{_NS}}}ArtSpe"
+
+# Equivalents des expressions '//...' de la XSLT, évaluées depuis la racine du document budgetaire
+_XPATH_NATDEC = etree.XPath(
+    "(descendant-or-self::totem:BlocBudget/totem:NatDec/@V)[1]", namespaces=_NAMESPACES
+)
+_XPATH_EXER = etree.XPath(
+    "(descendant-or-self::totem:BlocBudget/totem:Exer/@V)[1]", namespaces=_NAMESPACES
+)
+_XPATH_ID_ETAB = etree.XPath(
+    "(descendant-or-self::totem:EnTeteBudget/totem:IdEtab/@V)[1]",
+    namespaces=_NAMESPACES,
+)
+_XPATH_LIBELLE_COLL = etree.XPath(
+    "(descendant-or-self::totem:EnTeteDocBudgetaire/totem:LibelleColl/@V)[1]",
+    namespaces=_NAMESPACES,
+)
+_XPATH_LIGNES = etree.XPath(
+    "descendant-or-self::totem:LigneBudget[@calculated='false' or not(@calculated)]",
+    namespaces=_NAMESPACES,
+)
+
+
+def lignes_scdl(
+    document_budgetaire: Union[etree._Element, etree._ElementTree],
+    index: IndexPlanDeCompte,
+) -> Iterator[list[str]]:
+    """Produit les lignes SCDL d'un document budgetaire
+
+    Args:
+        document_budgetaire: Noeud DocumentBudgetaire (ou arbre du fichier totem)
+        index (IndexPlanDeCompte): Index du plan de compte correspondant
+
+    Yields:
+        list[str]: Valeurs d'une ligne, dans l'ordre de COLONNES_SCDL_BUDGET
+    """
+    racine = racine_document(document_budgetaire)
+    entete = entete_document(racine)
+    return lignes_budget_scdl(lignes_budget(racine), entete, index)
+
+
+def racine_document(
+    document_budgetaire: Union[etree._Element, etree._ElementTree]
+) -> etree._Element:
+    return (
+        document_budgetaire.getroot()
+        if isinstance(document_budgetaire, etree._ElementTree)
+        else document_budgetaire
+    )
+
+
+def lignes_budget(racine: etree._Element) -> list[etree._Element]:
+    """LigneBudget non calculées d'un document budgetaire, dans l'ordre du document"""
+    return _XPATH_LIGNES(racine)
+
+
+def entete_document(racine: etree._Element) -> list[str]:
+    """Valeurs des colonnes communes à toutes les lignes d'un document budgetaire"""
+    return [
+        libelle_natdec(_premier(_XPATH_NATDEC(racine))),
+        _premier(_XPATH_EXER(racine)),
+        _premier(_XPATH_ID_ETAB(racine)),
+        _premier(_XPATH_LIBELLE_COLL(racine)),
+    ]
+
+
+def libelle_natdec(code: str) -> str:
+    return _LIBELLES_NATDEC.get(code, f"NatDec inconnu: {code}")
+
+
+def lignes_budget_scdl(
+    lignes: Iterable[etree._Element], entete: list[str], index: IndexPlanDeCompte
+) -> Iterator[list[str]]:
+    for ligne in lignes:
+        yield ligne_scdl(ligne, entete, index)
+
+
+def ligne_scdl(
+    ligne: etree._Element, entete: list[str], index: IndexPlanDeCompte
+) -> list[str]:
+    return ligne_scdl_valeurs(valeurs_ligne(ligne), entete, index)
+
+
+def valeurs_ligne(ligne: etree._Element) -> dict[str, str]:
+    """Valeurs d'une LigneBudget lues par la conversion, par tag"""
+    # Equivalent de 'totem:X/@V': premier fils X portant l'attribut V
+    valeurs: dict = {}
+    for enfant in ligne:
+        if enfant.tag not in valeurs:
+            v = enfant.get("V")
+            if v is not None:
+                valeurs[enfant.tag] = v
+    return valeurs
+
+
+def ligne_scdl_valeurs(
+    valeurs: dict[str, str], entete: list[str], index: IndexPlanDeCompte
+) -> list[str]:
+    cont_nat = valeurs.get(_CONTNAT)
+    nature = valeurs.get(_NATURE)
+    fonction = valeurs.get(_FONCTION)
+
+    row = entete + [
+        cont_nat or "",
+        _recherche(index.libelles_chapitres, cont_nat),
+        nature or "",
+        _recherche(index.libelles_comptes, nature),
+        fonction or "",
+        _recherche(index.libelles_fonctions, fonction),
+        valeurs.get(_OPERATION, ""),
+        _LIBELLES_SECTION.get(_recherche(index.sections_chapitres, cont_nat), ""),
+        _LIBELLES_OPBUDG.get(valeurs.get(_OPBUDG), ""),
+        _LIBELLES_CODRD.get(valeurs.get(_CODRD), ""),
+    ]
+    row.extend([valeurs.get(montant, "") for montant in _MONTANTS])
+    row.append(_LIBELLES_ARTSPE.get(valeurs.get(_ARTSPE), ""))
+    return row
+
+
+def _recherche(index: dict[str, str], code: Optional[str]) -> str:
+    if code is None:
+        return ""
+    return index.get(code, "")
+
+
+def _premier(valeurs: list) -> str:
+    return str(valeurs[0]) if len(valeurs) > 0 else ""
+
+
+_TAGS_FLUX = {
+    f"{{{_NS}}}{tag}": tag
+    for tag in [
+        "DocumentBudgetaire",
+        "LibelleColl",
+        "IdEtab",
+        "Nomenclature",
+        "NatDec",
+        "Exer",
+        "LigneBudget",
+        "Annexes",
+    ]
+}
+_PARENTS_ENTETE = {
+    "LibelleColl": f"{{{_NS}}}EnTeteDocBudgetaire",
+    "IdEtab": f"{{{_NS}}}EnTeteBudget",
+    "Nomenclature": f"{{{_NS}}}EnTeteBudget",
+    "NatDec": f"{{{_NS}}}BlocBudget",
+    "Exer": f"{{{_NS}}}BlocBudget",
+}
+
+
+def lignes_scdl_flux(
+    source,
+    index_pour: Callable[[Optional[str], Optional[str]], IndexPlanDeCompte],
+) -> Iterator[list[str]]:
+    """Produit les lignes SCDL d'un fichier totem en streaming (iterparse)
+
+    Les éléments sont libérés au fur et à mesure, la mémoire consommée ne dépend donc pas
+    de la taille du fichier. On suppose, comme le prévoit le schéma totem, que l'entête
+    du document (EnTeteDocBudgetaire, EnTeteBudget, BlocBudget) précède les LigneBudget.
+
+    Args:
+        source: Chemin ou fichier binaire du document totem
+        index_pour: Renvoie l'index du plan de compte pour une (nomenclature, année)
+
+    Raises:
+        TotemInvalideErreur: si le fichier contient plusieurs noeuds DocumentBudgetaire.
+          Les lignes du premier document peuvent alors déjà avoir été produites.
+    """
+    valeurs_entete: dict[str, str] = {}
+    entete: Optional[list[str]] = None
+    index: Optional[IndexPlanDeCompte] = None
+    nb_documents = 0
+
+    contexte = etree.iterparse(
+        source, events=("start", "end"), tag=list(_TAGS_FLUX.keys())
+    )
+    for evenement, element in contexte:
+        nom = _TAGS_FLUX[element.tag]
+
+        if nom == "DocumentBudgetaire":
+            if evenement == "start":
+                nb_documents += 1
+                if nb_documents > 1:
+                    raise TotemInvalideErreur(
+                        "Plusieurs noeuds DocumentBudgetaire présent dans le XML"
+                    )
+            continue
+
+        if evenement == "start":
+            continue
+
+        if nom == "LigneBudget":
+            if entete is None:
+                entete = [
+                    libelle_natdec(valeurs_entete.get("NatDec", "")),
+                    valeurs_entete.get("Exer", ""),
+                    valeurs_entete.get("IdEtab", ""),
+                    valeurs_entete.get("LibelleColl", ""),
+                ]
+                index = index_pour(
+                    valeurs_entete.get("Nomenclature"), valeurs_entete.get("Exer")
+                )
+            calculated = element.get("calculated")
+            if calculated is None or calculated == "false":
+                yield ligne_scdl(element, entete, index)  # type: ignore[arg-type]
+            _liberer(element)
+        elif nom == "Annexes":
+            _liberer(element)
+        elif nom not in valeurs_entete:
+            parent = element.getparent()
+            v = element.get("V")
+            if (
+                v is not None
+                and parent is not None
+                and parent.tag == _PARENTS_ENTETE[nom]
+            ):
+                valeurs_entete[nom] = v
+
+
+def _liberer(element: etree._Element):
+    element.clear(keep_tail=True)
+    parent = element.getparent()
+    if parent is None:
+        return
+    while element.getprevious() is not None:
+        del parent[0]
@@ -0,0 +1,209 @@
+"""SCDL réparti en partitions de taille bornée, écrites en parallèle, et décrites par un manifeste
+
+Les lignes sont découpées dans l'ordre où elles sont produites. Chaque partition pleine est formatée,
+compressée et écrite par un pool de threads pendant que la conversion continue. Le manifeste,
+écrit en dernier, liste les partitions avec leur nombre de lignes, leur taille et leur sha256:
+un chargeur qui le trouve sait que toutes les partitions sont complètes.
+"""
+
+import json
+import os
+import tempfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Iterable, Optional
+
+from yatotem2scdl import logger
+
+from .cache_scdl import empreinte_fichier
+from .data_structures import FormatSortie, Options
+from .exceptions import ConversionErreur
+from .sorties import SortieLignes, _ouvrir_sortie, ecrire_fichier
+
+NOM_MANIFESTE = "manifeste.json"
+
+
+@dataclass(frozen=True)
+class Partition:
+    fichier: str  # Nom du fichier, relatif au dossier des partitions
+    lignes: int  # Lignes SCDL, hors entête
+    octets: int  # Taille du fichier
+    sha256: str
+
+
+@dataclass(frozen=True)
+class ManifestePartitions:
+    format: str  # Valeur de FormatSortie
+    colonnes: list[str]
+    partitions: list[Partition]
+
+    @property
+    def lignes(self) -> int:
+        return sum(partition.lignes for partition in self.partitions)
+
+    @staticmethod
+    def lire(dpath: Path) -> "ManifestePartitions":
+        """Lit le manifeste d'un dossier de partitions"""
+        contenu = json.loads((Path(dpath) / NOM_MANIFESTE).read_text(encoding="utf-8"))
+        return ManifestePartitions(
+            format=contenu["format"],
+            colonnes=contenu["colonnes"],
+            partitions=[Partition(**partition) for partition in contenu["partitions"]],
+        )
+
+
+class SortiePartitionnee(SortieLignes):
+    def __init__(
+        self,
+        dpath: Path,
+        lignes_max: Optional[int] = None,
+        octets_max: Optional[int] = None,
+        workers: Optional[int] = None,
+        prefixe: str = "scdl",
+    ):
+        """Sortie du SCDL en partitions, à passer comme output au ConvertisseurTotemBudget
+
+        Plusieurs conversions peuvent écrire à la suite dans la même sortie, pour un export consolidé.
+        Les partitions et le manifeste ne sont complets qu'une fois la sortie fermée par fermer(),
+        ou en l'utilisant comme gestionnaire de contexte. En cas d'erreur, les partitions déjà
+        écrites sont supprimées et aucun manifeste n'est écrit.
+
+        Args:
+            dpath (Path): Dossier des partitions et du manifeste, créé au besoin.
+            lignes_max (int, optional): Nombre maximum de lignes par partition. Defaults to None.
+            octets_max (int, optional): Taille maximale d'une partition, estimée sur les valeurs des lignes
+              avant formatage et compression. Une ligne plus grande forme à elle seule une partition.
+              Defaults to None.
+            workers (int, optional): Nombre de partitions écrites simultanément. Defaults to None (nombre de CPU).
+            prefixe (str, optional): Préfixe du nom des fichiers de partitions. Defaults to "scdl".
+
+        Raises:
+            ValueError: si ni lignes_max ni octets_max n'est donné, ou si l'un d'eux est inférieur à 1.
+        """
+        if lignes_max is None and octets_max is None:
+            raise ValueError("Les partitions doivent être bornées en lignes ou en octets")
+        if (lignes_max is not None and lignes_max < 1) or (octets_max is not None and octets_max < 1):
+            raise ValueError("Les bornes des partitions doivent être d'au moins 1")
+        if workers is None:
+            workers = os.cpu_count() or 1
+
+        self.dpath = Path(dpath)
+        self.lignes_max = lignes_max
+        self.octets_max = octets_max
+        self.workers = workers
+        self.prefixe = prefixe
+        self.manifeste: Optional[ManifestePartitions] = None  # Renseigné à la fermeture
+
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="yatotem2scdl-partition")
+        self.__ecritures: list[Future] = []
+        self.__fichiers: list[Path] = []
+        self.__colonnes: Optional[list[str]] = None
+        self.__options: Optional[Options] = None
+        self.__tampon: list[list[str]] = []
+        self.__octets_tampon = 0
+        self.__ferme = False
+
+    def ecrire_lignes(self, colonnes: list[str], lignes: Iterable[list[str]], options: Options):
+        if self.__ferme:
+            raise ConversionErreur(f"La sortie partitionnée {self.dpath} est fermée")
+        if self.__colonnes is None:
+            self.dpath.mkdir(parents=True, exist_ok=True)
+            self.__colonnes = list(colonnes)
+            self.__options = options
+        elif list(colonnes) != self.__colonnes or options.format_sortie is not self.__format:
+            raise ConversionErreur(
+                "Les conversions écrites dans une même sortie partitionnée doivent avoir les mêmes colonnes"
+                " et le même format de sortie"
+            )
+
+        try:
+            for ligne in lignes:
+                octets = sum(map(len, ligne)) + len(ligne)
+                if self.__tampon and self.__depasse(len(self.__tampon) + 1, self.__octets_tampon + octets):
+                    self.__ecrire_tampon()
+                self.__tampon.append(ligne)
+                self.__octets_tampon += octets
+        except BaseException:
+            # Les lignes de la conversion en échec ne doivent pas se retrouver dans les partitions
+            self.__fermer_sans_manifeste()
+            raise
+
+    def fermer(self):
+        """Ecrit la dernière partition, attend la fin des écritures et écrit le manifeste"""
+        if self.__ferme:
+            return
+        try:
+            if self.__colonnes is not None:
+                if self.__tampon or not self.__ecritures:
+                    self.__ecrire_tampon()
+                partitions = [ecriture.result() for ecriture in self.__ecritures]
+                self.manifeste = ManifestePartitions(self.__format.value, self.__colonnes, partitions)
+                self.__ecrire_manifeste(self.manifeste)
+        except BaseException:
+            self.__fermer_sans_manifeste()
+            raise
+        self.__ferme = True
+        self.__executor.shutdown()
+
+    def __enter__(self) -> "SortiePartitionnee":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.fermer()
+        else:
+            self.__fermer_sans_manifeste()
+
+    @property
+    def __format(self) -> FormatSortie:
+        assert self.__options is not None
+        return self.__options.format_sortie
+
+    def __depasse(self, lignes: int, octets: int) -> bool:
+        return (self.lignes_max is not None and lignes > self.lignes_max) or (
+            self.octets_max is not None and octets > self.octets_max
+        )
+
+    def __ecrire_tampon(self):
+        # Limite les partitions en mémoire lorsque la conversion va plus vite que l'écriture
+        en_cours = [ecriture for ecriture in self.__ecritures if not ecriture.done()]
+        if len(en_cours) >= 2 * self.workers:
+            en_cours[0].result()
+
+        fpath = self.dpath / f"{self.prefixe}-{len(self.__ecritures):05d}.{self.__format.value}"
+        self.__fichiers.append(fpath)
+        self.__ecritures.append(
+            self.__executor.submit(_ecrire_partition, fpath, self.__colonnes, self.__tampon, self.__options)
+        )
+        self.__tampon = []
+        self.__octets_tampon = 0
+
+    def __ecrire_manifeste(self, manifeste: ManifestePartitions):
+        # Ecriture atomique: le manifeste n'est visible qu'une fois complet
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.dpath)
+        try:
+            with open(fd, "w", encoding="utf-8") as f:
+                json.dump(asdict(manifeste), f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.dpath / NOM_MANIFESTE)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    def __fermer_sans_manifeste(self):
+        """Abandonne la sortie: les partitions écrites ou en cours d'écriture sont supprimées"""
+        if self.__ferme:
+            return
+        self.__ferme = True
+        for ecriture in self.__ecritures:
+            ecriture.cancel()
+        self.__executor.shutdown()
+        for fpath in self.__fichiers:
+            fpath.unlink(missing_ok=True)
+        logger.debug(f"Sortie partitionnée {self.dpath} abandonnée")
+
+
+def _ecrire_partition(fpath: Path, colonnes: list[str], lignes: list[list[str]], options: Options) -> Partition:
+    with _ouvrir_sortie(fpath, options) as f:
+        ecrire_fichier(colonnes, lignes, f, options)
+    return Partition(fpath.name, len(lignes), fpath.stat().st_size, empreinte_fichier(fpath))
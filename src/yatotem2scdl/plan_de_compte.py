@@ -0,0 +1,173 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Optional, Union
+
+from lxml import etree
+
+from yatotem2scdl import logger
+
+from .metriques import _compter_cache
+
+if TYPE_CHECKING:
+    from .plans_de_comptes_compiles import PlansDeComptesCompiles
+
+NAMESPACE_EXTENSIONS = "https://github.com/megalis-bretagne/yatotem2scdl"
+
+
+@dataclass(frozen=True)
+class IndexPlanDeCompte:
+    """Index Code -> Libelle / Section d'un plan de compte
+
+    Pour chaque code, on garde la première valeur rencontrée dans l'ordre du document,
+    ce qui correspond à la sémantique de xsl:value-of.
+    """
+
+    libelles_chapitres: dict[str, str] = field(default_factory=dict)
+    sections_chapitres: dict[str, str] = field(default_factory=dict)
+    libelles_comptes: dict[str, str] = field(default_factory=dict)
+    libelles_fonctions: dict[str, str] = field(default_factory=dict)
+
+    @staticmethod
+    def depuis_tree(pdc_tree: etree._ElementTree) -> "IndexPlanDeCompte":
+        index = IndexPlanDeCompte()
+        racine = pdc_tree.getroot()
+        if racine.tag != "Nomenclature":
+            return index
+
+        for chapitre in racine.iterfind("./Nature/Chapitres/Chapitre"):
+            _indexer(index.libelles_chapitres, chapitre, "Libelle")
+            _indexer(index.sections_chapitres, chapitre, "Section")
+        for compte in racine.iterfind("./Nature/Comptes//Compte"):
+            _indexer(index.libelles_comptes, compte, "Libelle")
+        for ref_fonc in racine.iterfind("./Fonction/RefFonctionnelles//RefFonc"):
+            _indexer(index.libelles_fonctions, ref_fonc, "Libelle")
+
+        return index
+
+
+class _EntreePlanDeCompte:
+    def __init__(self, pdc_tree: etree._ElementTree):
+        self.pdc_tree = pdc_tree
+        self.index: Optional[IndexPlanDeCompte] = None
+
+
+class CachePlansDeComptes:
+    def __init__(
+        self,
+        taille_max: int = 16,
+        compiles: Optional["PlansDeComptesCompiles"] = None,
+    ):
+        """Cache LRU des plans de comptes parsés, partageable entre convertisseurs.
+
+        Un plan de compte est identifié par son chemin, qui correspond à un couple
+        (année, nomenclature) au sein d'un dossier de plans de comptes.
+
+        Args:
+            taille_max (int, optional): Nombre maximum de plans de comptes gardés en mémoire. Defaults to 16.
+            compiles (PlansDeComptesCompiles, optional): Plans de comptes compilés. Les index des plans
+              de comptes qu'ils contiennent y sont lus, sans parser le XML. Defaults to None.
+        """
+        if taille_max < 1:
+            raise ValueError("La taille du cache doit être d'au moins 1")
+
+        self.taille_max = taille_max
+        self.compiles = compiles
+        self.hits = 0
+        self.misses = 0
+
+        self.__lock = threading.Lock()
+        self.__plans: OrderedDict[str, _EntreePlanDeCompte] = OrderedDict()
+
+    def plan_de_compte(self, pdc_fpath: Path) -> etree._ElementTree:
+        """Renvoie l'arbre du plan de compte, en le parsant s'il n'est pas déjà en cache"""
+        return self.__entree(pdc_fpath).pdc_tree
+
+    def index(self, pdc_fpath: Path) -> IndexPlanDeCompte:
+        """Renvoie l'index Code -> Libelle / Section du plan de compte, calculé une seule fois"""
+        if self.compiles is not None:
+            index = self.compiles.index_pour_chemin(pdc_fpath)
+            if index is not None:
+                return index
+
+        entree = self.__entree(pdc_fpath)
+        if entree.index is None:
+            entree.index = IndexPlanDeCompte.depuis_tree(entree.pdc_tree)
+        return entree.index
+
+    def vider(self):
+        with self.__lock:
+            self.__plans.clear()
+
+    def __len__(self) -> int:
+        return len(self.__plans)
+
+    def extensions_xslt(self) -> dict[tuple[str, str], Callable]:
+        """Fonctions d'extension XSLT donnant accès aux plans de comptes en cache"""
+        return {
+            (NAMESPACE_EXTENSIONS, "libelle-chapitre"): self.__ext_recherche(
+                "libelles_chapitres"
+            ),
+            (NAMESPACE_EXTENSIONS, "section-chapitre"): self.__ext_recherche(
+                "sections_chapitres"
+            ),
+            (NAMESPACE_EXTENSIONS, "libelle-compte"): self.__ext_recherche(
+                "libelles_comptes"
+            ),
+            (NAMESPACE_EXTENSIONS, "libelle-fonction"): self.__ext_recherche(
+                "libelles_fonctions"
+            ),
+        }
+
+    def __entree(self, pdc_fpath: Path) -> _EntreePlanDeCompte:
+        cle = str(Path(pdc_fpath).resolve())
+
+        with self.__lock:
+            entree = self.__plans.get(cle)
+            if entree is not None:
+                self.__plans.move_to_end(cle)
+                self.hits += 1
+                _compter_cache("plan_de_compte", hit=True)
+                return entree
+            self.misses += 1
+        _compter_cache("plan_de_compte", hit=False)
+
+        logger.debug(f"Chargement du plan de compte '{cle}'")
+        entree = _EntreePlanDeCompte(etree.parse(cle))
+
+        with self.__lock:
+            self.__plans[cle] = entree
+            self.__plans.move_to_end(cle)
+            while len(self.__plans) > self.taille_max:
+                self.__plans.popitem(last=False)
+
+        return entree
+
+    def __ext_recherche(self, nom_index: str) -> Callable:
+        def _recherche(context, pdc_fpath, code) -> str:
+            # L'index est résolu une seule fois par transformation (eval_context)
+            cle = (nom_index, _xpath_valeur(pdc_fpath))
+            index = context.eval_context.get(cle)
+            if index is None:
+                index = getattr(self.index(Path(cle[1])), nom_index)
+                context.eval_context[cle] = index
+            if isinstance(code, list) and len(code) == 0:
+                return ""
+            return index.get(_xpath_valeur(code), "")
+
+        return _recherche
+
+
+def _indexer(index: dict[str, str], element: etree._Element, attribut: str):
+    code = element.get("Code")
+    valeur = element.get(attribut)
+    if code is not None and valeur is not None:
+        index.setdefault(code, valeur)
+
+
+def _xpath_valeur(valeur: Union[str, list]) -> str:
+    # Un node-set XPath arrive sous forme de liste, on en prend le premier noeud
+    if isinstance(valeur, list):
+        return str(valeur[0]) if len(valeur) > 0 else ""
+    return str(valeur)
@@ -0,0 +1,230 @@
+"""Plans de comptes compilés dans un unique fichier d'index
+
+Un dossier de plans de comptes (<annee>/<n1>/<n2>/planDeCompte.xml) est compilé une fois pour toutes
+dans une base sqlite qui associe à chaque couple (année, nomenclature) son IndexPlanDeCompte.
+Le convertisseur charge alors chaque index à la demande, sans parser le XML du plan de compte
+ni sonder le système de fichiers.
+
+Le fichier compilé n'est pas mis à jour automatiquement: il faut le recompiler lorsque
+les plans de comptes changent.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+from typing import Optional
+
+from lxml import etree
+
+from yatotem2scdl import logger
+
+from .plan_de_compte import IndexPlanDeCompte
+
+_VERSION_FORMAT = "1"
+
+_SCHEMA = [
+    "CREATE TABLE meta (cle TEXT PRIMARY KEY, valeur TEXT NOT NULL)",
+    """
+    CREATE TABLE plans (
+        annee TEXT NOT NULL,
+        nomenclature TEXT NOT NULL,
+        index_json TEXT NOT NULL,
+        PRIMARY KEY (annee, nomenclature)
+    )
+    """,
+]
+
+
+def compiler_plans_de_comptes(pdcs_dpath: Path, compile_fpath: Path) -> int:
+    """Compile tous les plans de comptes d'un dossier dans un fichier d'index
+
+    Args:
+        pdcs_dpath (Path): Chemin contenant les plans de comptes.
+        compile_fpath (Path): Fichier d'index produit. Remplacé s'il existe.
+
+    Returns:
+        int: Nombre de plans de comptes compilés.
+    """
+    pdcs_dpath = Path(pdcs_dpath)
+    compile_fpath = Path(compile_fpath)
+    tmp_fpath = compile_fpath.with_name(f"{compile_fpath.name}.tmp")
+    tmp_fpath.unlink(missing_ok=True)
+
+    nb_plans = 0
+    connexion = sqlite3.connect(str(tmp_fpath))
+    try:
+        with connexion:
+            for instruction in _SCHEMA:
+                connexion.execute(instruction)
+            connexion.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [("version", _VERSION_FORMAT), ("racine", str(pdcs_dpath.resolve()))],
+            )
+
+            for pdc_fpath in sorted(pdcs_dpath.glob("*/*/*/planDeCompte.xml")):
+                n2_dpath = pdc_fpath.parent
+                annee = n2_dpath.parent.parent.name
+                nomenclature = f"{n2_dpath.parent.name}-{n2_dpath.name}"
+
+                logger.debug(f"Compilation du plan de compte ({annee}, {nomenclature})")
+                index = IndexPlanDeCompte.depuis_tree(etree.parse(str(pdc_fpath)))
+                connexion.execute(
+                    "INSERT INTO plans VALUES (?, ?, ?)",
+                    (annee, nomenclature, _index_vers_json(index)),
+                )
+                nb_plans += 1
+    finally:
+        connexion.close()
+
+    os.replace(tmp_fpath, compile_fpath)
+    return nb_plans
+
+
+class PlansDeComptesCompiles:
+    def __init__(self, compile_fpath: Path):
+        """Plans de comptes compilés par compiler_plans_de_comptes, chargés à la demande
+
+        Args:
+            compile_fpath (Path): Fichier d'index compilé.
+
+        Raises:
+            ValueError: si le fichier n'est pas un index compilé dans un format supporté.
+        """
+        self.compile_fpath = Path(compile_fpath)
+        if not self.compile_fpath.is_file():
+            raise ValueError(f"Le fichier '{self.compile_fpath}' n'existe pas")
+
+        self.__lock = threading.Lock()
+        self.__connexion = sqlite3.connect(
+            f"file:{self.compile_fpath.resolve()}?mode=ro", uri=True, check_same_thread=False
+        )
+        meta = dict(self.__connexion.execute("SELECT cle, valeur FROM meta").fetchall())
+        if meta.get("version") != _VERSION_FORMAT:
+            raise ValueError(
+                f"Le fichier '{self.compile_fpath}' n'est pas au format {_VERSION_FORMAT}, il doit être recompilé"
+            )
+        self.racine = Path(meta["racine"])
+
+        self.__plans: set[tuple[str, str]] = set(
+            self.__connexion.execute("SELECT annee, nomenclature FROM plans").fetchall()
+        )
+        self.__index: dict[tuple[str, str], IndexPlanDeCompte] = {}
+        self.__empreintes: dict[tuple[str, str], str] = {}
+        # Chemins déjà résolus, pour ne pas solliciter le système de fichiers à chaque conversion
+        self.__cles_chemins: dict[str, Optional[tuple[str, str]]] = {}
+        self.__dossiers_couverts: dict[str, bool] = {}
+
+    def couvre(self, pdcs_dpath: Path) -> bool:
+        """Indique si ces plans de comptes ont été compilés depuis ce dossier"""
+        dpath = str(pdcs_dpath)
+        couvert = self.__dossiers_couverts.get(dpath)
+        if couvert is None:
+            couvert = Path(dpath).resolve() == self.racine
+            self.__dossiers_couverts[dpath] = couvert
+        return couvert
+
+    def contient(self, annee: str, nomenclature: str) -> bool:
+        return (annee, nomenclature) in self.__plans
+
+    def index(self, annee: str, nomenclature: str) -> Optional[IndexPlanDeCompte]:
+        """Index du plan de compte, chargé depuis le fichier compilé au premier accès"""
+        cle = (annee, nomenclature)
+        if cle not in self.__plans:
+            return None
+
+        with self.__lock:
+            index = self.__index.get(cle)
+            if index is None:
+                (index_json,) = self.__connexion.execute(
+                    "SELECT index_json FROM plans WHERE annee = ? AND nomenclature = ?", cle
+                ).fetchone()
+                index = _index_depuis_json(index_json)
+                self.__index[cle] = index
+            return index
+
+    def index_pour_chemin(self, pdc_fpath: Path) -> Optional[IndexPlanDeCompte]:
+        """Index du plan de compte situé à ce chemin, s'il fait partie des plans compilés"""
+        fpath = str(pdc_fpath)
+        if fpath not in self.__cles_chemins:
+            self.__cles_chemins[fpath] = self.__cle_chemin(Path(fpath))
+        cle = self.__cles_chemins[fpath]
+        return self.index(*cle) if cle is not None else None
+
+    def empreinte_pour_chemin(self, pdc_fpath: Path) -> Optional[str]:
+        """Empreinte sha256 de l'index compilé du plan de compte situé à ce chemin,
+        tel que lu par index_pour_chemin. None s'il ne fait pas partie des plans compilés."""
+        fpath = str(pdc_fpath)
+        if fpath not in self.__cles_chemins:
+            self.__cles_chemins[fpath] = self.__cle_chemin(Path(fpath))
+        cle = self.__cles_chemins[fpath]
+        if cle is None or cle not in self.__plans:
+            return None
+
+        with self.__lock:
+            empreinte = self.__empreintes.get(cle)
+            if empreinte is None:
+                (index_json,) = self.__connexion.execute(
+                    "SELECT index_json FROM plans WHERE annee = ? AND nomenclature = ?", cle
+                ).fetchone()
+                empreinte = hashlib.sha256(index_json.encode("utf-8")).hexdigest()
+                self.__empreintes[cle] = empreinte
+            return empreinte
+
+    def __len__(self) -> int:
+        return len(self.__plans)
+
+    def __cle_chemin(self, pdc_fpath: Path) -> Optional[tuple[str, str]]:
+        try:
+            relatif = pdc_fpath.resolve().relative_to(self.racine)
+        except ValueError:
+            return None
+        if len(relatif.parts) != 4 or relatif.name != "planDeCompte.xml":
+            return None
+        annee, n1, n2, _ = relatif.parts
+        return (annee, f"{n1}-{n2}")
+
+
+def _index_vers_json(index: IndexPlanDeCompte) -> str:
+    return json.dumps(
+        [
+            index.libelles_chapitres,
+            index.sections_chapitres,
+            index.libelles_comptes,
+            index.libelles_fonctions,
+        ],
+        ensure_ascii=False,
+    )
+
+
+def _index_depuis_json(index_json: str) -> IndexPlanDeCompte:
+    libelles_chapitres, sections_chapitres, libelles_comptes, libelles_fonctions = json.loads(index_json)
+    return IndexPlanDeCompte(
+        libelles_chapitres=libelles_chapitres,
+        sections_chapitres=sections_chapitres,
+        libelles_comptes=libelles_comptes,
+        libelles_fonctions=libelles_fonctions,
+    )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(
+        description="Compile un dossier de plans de comptes dans un unique fichier d'index"
+    )
+    parser.add_argument("plans_de_comptes", type=str, help="Dossier contenant les plans de comptes")
+    parser.add_argument("sortie", type=str, help="Fichier d'index produit")
+    args = parser.parse_args()
+
+    try:
+        nb_plans = compiler_plans_de_comptes(Path(args.plans_de_comptes), Path(args.sortie))
+    except Exception as e:
+        sys.stderr.write(str(e))
+        sys.exit(-1)
+
+    sys.stderr.write(f"{nb_plans} plans de comptes compilés dans {args.sortie}\n")
+    sys.exit(0)
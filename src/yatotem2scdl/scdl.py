@@ -0,0 +1,50 @@
+"""Colonnes du SCDL budget
+
+Les colonnes et leur type sont déclarés ici une fois pour toutes. Le moteur natif produit ses lignes
+dans cet ordre et les formats de sortie typés (Parquet, Arrow) en tirent leur schéma.
+https://schema.data.gouv.fr/scdl/budget/0.8.1/documentation.html
+"""
+
+from enum import Enum
+
+
+class TypeColonne(Enum):
+    """Type d'une colonne SCDL dans les formats de sortie typés"""
+
+    TEXTE = "texte"  # Codes et libellés, conservés tels quels
+    ENTIER = "entier"
+    MONTANT = "montant"  # Nombre décimal à deux chiffres après la virgule
+
+
+_DECLARATION_COLONNES = [
+    ("BGT_NATDEC", TypeColonne.TEXTE),
+    ("BGT_ANNEE", TypeColonne.ENTIER),
+    ("BGT_SIRET", TypeColonne.TEXTE),
+    ("BGT_NOM", TypeColonne.TEXTE),
+    ("BGT_CONTNAT", TypeColonne.TEXTE),
+    ("BGT_CONTNAT_LABEL", TypeColonne.TEXTE),
+    ("BGT_NATURE", TypeColonne.TEXTE),
+    ("BGT_NATURE_LABEL", TypeColonne.TEXTE),
+    ("BGT_FONCTION", TypeColonne.TEXTE),
+    ("BGT_FONCTION_LABEL", TypeColonne.TEXTE),
+    ("BGT_OPERATION", TypeColonne.TEXTE),
+    ("BGT_SECTION", TypeColonne.TEXTE),
+    ("BGT_OPBUDG", TypeColonne.TEXTE),
+    ("BGT_CODRD", TypeColonne.TEXTE),
+    ("BGT_MTREAL", TypeColonne.MONTANT),
+    ("BGT_MTBUDGPREC", TypeColonne.MONTANT),
+    ("BGT_MTRARPREC", TypeColonne.MONTANT),
+    ("BGT_MTPROPNOUV", TypeColonne.MONTANT),
+    ("BGT_MTPREV", TypeColonne.MONTANT),
+    ("BGT_CREDOUV", TypeColonne.MONTANT),
+    ("BGT_MTRAR3112", TypeColonne.MONTANT),
+    ("BGT_ARTSPE", TypeColonne.TEXTE),
+]
+
+COLONNES_SCDL_BUDGET: list[str] = [nom for nom, _ in _DECLARATION_COLONNES]
+TYPES_COLONNES_SCDL_BUDGET: dict[str, TypeColonne] = dict(_DECLARATION_COLONNES)
+
+
+def type_colonne(nom: str) -> TypeColonne:
+    """Type d'une colonne. Une colonne ajoutée par une XSLT personnalisée est du texte."""
+    return TYPES_COLONNES_SCDL_BUDGET.get(nom, TypeColonne.TEXTE)
@@ -0,0 +1,374 @@
+"""Service HTTP local de conversion, qui garde XSLT compilée et plans de comptes en mémoire
+
+Le fichier totem est envoyé en corps d'une requête POST /budget. Le SCDL est renvoyé au fil de la
+conversion (Transfer-Encoding: chunked): le processus de conversion l'écrit dans un tube nommé que
+lit le thread de la requête, sans passer par un fichier. Les tubes nommés limitent le service aux
+systèmes POSIX. Les conversions tournent sur un pool de processus borné. Au-delà de la capacité du
+pool et de sa file d'attente, le service répond 503 plutôt que d'accumuler les requêtes.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+from yatotem2scdl import logger
+
+from .data_structures import MoteurConversion, Options, ResultatConversion
+from .exceptions import ConversionErreur, TotemInvalideErreur
+from .lot import _convertir_worker, _initialiser_worker
+
+_TAILLE_BLOC = 64 * 1024
+_CONTENT_TYPE_CSV = "text/csv; charset=utf-8"
+
+
+class ServeurConversion(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        adresse: tuple[str, int],
+        pdcs_dpath: Path,
+        workers: Optional[int] = None,
+        max_attente: Optional[int] = None,
+        taille_max_requete: int = 512 * 1024 * 1024,
+        xslt_budget: Optional[Path] = None,
+        moteur: MoteurConversion = MoteurConversion.XSLT,
+        taille_cache_pdc: int = 16,
+        delai_reseau: Optional[float] = 60.0,
+    ):
+        """Serveur HTTP de conversion totem vers SCDL
+
+        Args:
+            adresse (tuple[str, int]): Couple (hôte, port) d'écoute.
+            pdcs_dpath (Path): Chemin contenant les plans de comptes.
+            workers (int, optional): Nombre de processus de conversion. Defaults to None (nombre de CPU).
+            max_attente (int, optional): Nombre de conversions pouvant attendre un processus libre.
+              Defaults to None (autant que de processus).
+            taille_max_requete (int, optional): Taille maximale d'un fichier totem, en octets. Defaults to 512 Mo.
+            xslt_budget (Path, optional): Voir ConvertisseurTotemBudget. Defaults to None.
+            moteur (MoteurConversion, optional): Voir ConvertisseurTotemBudget. Defaults to MoteurConversion.XSLT.
+            taille_cache_pdc (int, optional): Taille du cache des plans de comptes de chaque processus. Defaults to 16.
+            delai_reseau (float, optional): Délai en secondes au-delà duquel une connexion qui n'envoie ni ne reçoit
+              plus rien est abandonnée. None pour attendre indéfiniment. Defaults to 60 secondes.
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if max_attente is None:
+            max_attente = workers
+        if workers < 1 or max_attente < 0:
+            raise ValueError("Le nombre de processus doit être d'au moins 1 et la file d'attente positive")
+
+        self.pdcs_dpath = Path(pdcs_dpath)
+        self.taille_max_requete = taille_max_requete
+        self.delai_reseau = delai_reseau
+
+        super().__init__(adresse, _GestionnaireRequete)
+
+        self.__places = threading.BoundedSemaphore(workers + max_attente)
+        self.__workers = workers
+        self.__initargs = (xslt_budget, moteur, taille_cache_pdc)
+        self.__executor_lock = threading.Lock()
+        self.__executor = self.__nouveau_pool()
+
+    def __nouveau_pool(self) -> ProcessPoolExecutor:
+        # Des processus forkés depuis le serveur hériteraient des tubes ouverts par les requêtes
+        # en cours, dont la fin ne serait alors jamais lue: ils sont créés par un forkserver.
+        return ProcessPoolExecutor(
+            max_workers=self.__workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+            initializer=_initialiser_worker,
+            initargs=self.__initargs,
+        )
+
+    def reserver_place(self) -> bool:
+        """Réserve une place dans le pool. Renvoie False si le pool et sa file d'attente sont pleins"""
+        return self.__places.acquire(blocking=False)
+
+    def liberer_place(self):
+        self.__places.release()
+
+    def soumettre(self, totem_fpath: Path, csv_fpath: Path, options: Options) -> Future:
+        """Soumet une conversion au pool, sans en attendre la fin. Voir _resultat pour son résultat"""
+        executor = self.__executor
+        try:
+            future = executor.submit(
+                _convertir_worker, totem_fpath, self.pdcs_dpath, csv_fpath, options
+            )
+        except BrokenProcessPool as err:
+            self.__pool_interrompu(executor, err)
+            future = Future()
+            future.set_exception(err)
+            return future
+        future.add_done_callback(partial(self.__verifier_pool, executor))
+        return future
+
+    def __verifier_pool(self, executor: ProcessPoolExecutor, future: Future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self.__pool_interrompu(executor, future.exception())
+
+    def __pool_interrompu(self, casse: ProcessPoolExecutor, err: BaseException):
+        # Un processus a été tué (manque de mémoire par exemple): le pool est inutilisable,
+        # il est remplacé pour les requêtes suivantes.
+        logger.error(f"Pool de conversion interrompu, il est recréé: {err}")
+        self.__remplacer_pool(casse)
+
+    def __remplacer_pool(self, casse: ProcessPoolExecutor):
+        with self.__executor_lock:
+            # Plusieurs requêtes peuvent constater la même interruption
+            if self.__executor is casse:
+                self.__executor = self.__nouveau_pool()
+        casse.shutdown(wait=False, cancel_futures=True)
+
+    def server_close(self):
+        super().server_close()
+        self.__executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _GestionnaireRequete(BaseHTTPRequestHandler):
+
+    server: ServeurConversion
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def timeout(self) -> Optional[float]:  # type: ignore[override]
+        # Lu par StreamRequestHandler.setup pour le délai de la socket
+        return self.server.delai_reseau
+
+    def do_GET(self):
+        if urlsplit(self.path).path != "/sante":
+            self._repondre_erreur(HTTPStatus.NOT_FOUND, "Ressource inconnue")
+            return
+        self._repondre(HTTPStatus.OK, b"ok\n", "text/plain; charset=utf-8")
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/budget":
+            self._repondre_erreur(HTTPStatus.NOT_FOUND, "Ressource inconnue")
+            return
+
+        taille = self.headers.get("Content-Length")
+        if taille is None:
+            self._repondre_erreur(HTTPStatus.LENGTH_REQUIRED, "Content-Length requis")
+            return
+        try:
+            taille_i = int(taille)
+        except ValueError:
+            taille_i = -1
+        if taille_i < 0:
+            self.close_connection = True
+            self._repondre_erreur(HTTPStatus.BAD_REQUEST, "Content-Length invalide", {"Connection": "close"})
+            return
+        if taille_i > self.server.taille_max_requete:
+            self._repondre_erreur(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, "Fichier totem trop volumineux")
+            return
+
+        with tempfile.TemporaryDirectory(prefix="yatotem2scdl-") as tmp_dpath:
+            totem_fpath = Path(tmp_dpath) / "totem.xml"
+            # Le corps est lu avant de réserver une place: un envoi lent n'occupe pas le pool
+            try:
+                with open(totem_fpath, "wb") as totem:
+                    _copier(self.rfile, totem, taille_i)
+            except ConversionErreur as err:
+                self.close_connection = True
+                self._repondre_erreur(HTTPStatus.BAD_REQUEST, str(err), {"Connection": "close"})
+                return
+            except TimeoutError:
+                self.close_connection = True
+                self._repondre_erreur(
+                    HTTPStatus.REQUEST_TIMEOUT, "Fichier totem non reçu dans le délai", {"Connection": "close"}
+                )
+                return
+
+            if not self.server.reserver_place():
+                self._repondre_erreur(
+                    HTTPStatus.SERVICE_UNAVAILABLE, "Trop de conversions en cours", {"Retry-After": "1"}
+                )
+                return
+            self._envoyer_scdl(totem_fpath, Path(tmp_dpath) / "scdl.csv", _options(url.query))
+
+    def _envoyer_scdl(self, totem_fpath: Path, tube_fpath: Path, options: Options):
+        """Convertit le fichier totem et renvoie le SCDL au fil de la conversion
+
+        Le statut est envoyé à l'arrivée du premier bloc, ou à la fin d'une conversion qui n'a rien écrit.
+        Une erreur de conversion survenue après le premier bloc interrompt la réponse sans le bloc final:
+        le client reçoit une réponse incomplète. Un client lent ralentit la conversion, qui attend que
+        le tube se vide, dans la limite du délai réseau.
+        """
+        os.mkfifo(tube_fpath)
+        lecteur = os.open(tube_fpath, os.O_RDONLY | os.O_NONBLOCK)
+        # Ecrivain tenu jusqu'à la fin de la conversion: la fin du tube n'est lue qu'une fois la
+        # conversion terminée, y compris si le processus n'a jamais ouvert le tube
+        garde = os.open(tube_fpath, os.O_WRONLY)
+        os.set_blocking(lecteur, True)
+
+        def _terminer(_):
+            # La place est libérée avant que la fin du tube ne soit lue, donc avant la fin de la réponse
+            self.server.liberer_place()
+            os.close(garde)
+
+        try:
+            future = self.server.soumettre(totem_fpath, tube_fpath, options)
+        except BaseException:
+            os.close(lecteur)
+            _terminer(None)
+            raise
+        future.add_done_callback(_terminer)
+
+        with open(lecteur, "rb", buffering=0) as scdl:
+            bloc = scdl.read(_TAILLE_BLOC)
+            if not bloc:
+                resultat = _resultat(future, totem_fpath)
+                if resultat.succes:
+                    self._repondre(HTTPStatus.OK, b"", _CONTENT_TYPE_CSV)
+                else:
+                    self._repondre_erreur(_statut(resultat.erreur), str(resultat.erreur))
+                return
+
+            chunked = self.request_version != "HTTP/1.0"
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", _CONTENT_TYPE_CSV)
+            if chunked:
+                self.send_header("Transfer-Encoding", "chunked")
+            else:
+                # Sans chunked, la fin de la réponse est marquée par la fermeture de la connexion
+                self.close_connection = True
+                self.send_header("Connection", "close")
+            self.end_headers()
+            try:
+                while bloc:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(bloc), bloc) if chunked else bloc)
+                    bloc = scdl.read(_TAILLE_BLOC)
+            except OSError as err:
+                logger.info(f"Envoi du SCDL interrompu: {err}")
+                self.close_connection = True
+                # Le tube est vidé jusqu'à la fin de la conversion, qui sinon resterait bloquée en écriture
+                future.cancel()
+                while scdl.read(_TAILLE_BLOC):
+                    pass
+                return
+
+            resultat = _resultat(future, totem_fpath)
+            if not resultat.succes:
+                logger.warning(f"Conversion de {totem_fpath} interrompue en cours de réponse: {resultat.erreur}")
+                self.close_connection = True
+            elif chunked:
+                self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+    def _repondre_erreur(self, statut: HTTPStatus, message: str, entetes: Optional[dict[str, str]] = None):
+        self._repondre(statut, f"{message}\n".encode("utf-8"), "text/plain; charset=utf-8", entetes)
+
+    def _repondre(
+        self, statut: HTTPStatus, corps: bytes, content_type: str, entetes: Optional[dict[str, str]] = None
+    ):
+        self.send_response(statut)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(corps)))
+        for nom, valeur in (entetes or {}).items():
+            self.send_header(nom, valeur)
+        self.end_headers()
+        self.wfile.write(corps)
+
+
+def _copier(source, destination, taille: int):
+    restant = taille
+    while restant > 0:
+        bloc = source.read(min(_TAILLE_BLOC, restant))
+        if not bloc:
+            raise ConversionErreur("Requête interrompue avant la fin du fichier totem")
+        destination.write(bloc)
+        restant -= len(bloc)
+
+
+def _resultat(future: Future, totem_fpath: Path) -> ResultatConversion:
+    """Résultat d'une conversion soumise. Une conversion dont le processus a été tué,
+    ou annulée à l'arrêt du service, est en échec."""
+    try:
+        return future.result()
+    except (BrokenProcessPool, CancelledError) as err:
+        return ResultatConversion(totem_fpath=totem_fpath, csv_fpath=None, erreur=err)
+
+
+def _options(query: str) -> Options:
+    parametres = parse_qs(query)
+    entetes = parametres.get("entetes", ["true"])[-1]
+    return Options(
+        inclure_header_csv=entetes != "false",
+        streaming=parametres.get("streaming", ["false"])[-1] == "true",
+    )
+
+
+def _statut(erreur: Optional[Exception]) -> HTTPStatus:
+    if isinstance(erreur, (ConversionErreur, TotemInvalideErreur)):
+        return HTTPStatus.UNPROCESSABLE_ENTITY
+    return HTTPStatus.INTERNAL_SERVER_ERROR
+
+
+def main():
+
+    pdc_argname = "--plans-de-comptes"
+    pdc_envname = "PLANS_DE_COMPTES_DIR"
+
+    parser = argparse.ArgumentParser(description="Service HTTP local de conversion totem vers SCDL")
+    parser.add_argument("--hote", default="127.0.0.1", type=str, help="Adresse d'écoute")
+    parser.add_argument("--port", default=8080, type=int, help="Port d'écoute")
+    parser.add_argument(
+        pdc_argname,
+        default=os.environ.get(pdc_envname),
+        type=str,
+        dest="plans_de_comptes",
+        help="Dossier contenant les plans de comptes",
+        required=False,
+    )
+    parser.add_argument(
+        "--jobs", "-j", default=None, type=int, dest="jobs",
+        help="Nombre de processus de conversion. Par défaut, le nombre de CPU",
+    )
+    parser.add_argument(
+        "--attente", default=None, type=int, dest="attente",
+        help="Nombre de conversions en attente au-delà duquel le service répond 503",
+    )
+    parser.add_argument(
+        "--delai", default=60.0, type=float, dest="delai",
+        help="Délai en secondes au-delà duquel une connexion inactive est abandonnée",
+    )
+    args = parser.parse_args()
+
+    if args.plans_de_comptes is None:
+        sys.stderr.write("Vous devez spécifier oú se trouvent les plans de comptes ")
+        sys.stderr.write(
+            f"via l'argument {pdc_argname} ou la variable d'environnement {pdc_envname}"
+        )
+        sys.stderr.write("\n")
+        sys.exit(-1)
+
+    serveur = ServeurConversion(
+        (args.hote, args.port),
+        Path(args.plans_de_comptes),
+        workers=args.jobs,
+        max_attente=args.attente,
+        delai_reseau=args.delai,
+    )
+    sys.stderr.write(f"Conversion disponible sur http://{args.hote}:{serveur.server_port}/budget\n")
+    try:
+        serveur.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        serveur.server_close()
+
+    sys.exit(0)
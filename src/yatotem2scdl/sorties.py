@@ -0,0 +1,220 @@
+"""Ecriture des lignes SCDL dans le format de sortie demandé par les options
+
+Le CSV, compressé ou non, est écrit au fil des lignes. Les formats typés (Parquet, Arrow) sont écrits
+par paquets de lignes, la mémoire consommée ne dépend donc pas non plus de la taille du SCDL.
+Le zstd et les formats typés reposent sur des dépendances optionnelles, importées uniquement à l'usage.
+"""
+
+import csv
+import gzip
+import io
+from abc import ABC, abstractmethod
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from pathlib import Path
+from typing import IO, Iterable, Iterator, Union
+
+from .data_structures import FormatSortie, Options
+from .exceptions import ConversionErreur
+from .metriques import _compter_lignes
+from .scdl import TypeColonne, type_colonne
+
+# Nombre de lignes par paquet (record batch) dans les formats typés
+_TAILLE_PAQUET = 64 * 1024
+# Nombre de lignes CSV formatées en mémoire avant chaque écriture dans la sortie
+_TAILLE_PAQUET_CSV = 4096
+# Les montants du SCDL ont deux chiffres après la virgule
+_PRECISION_MONTANT = 18
+_ECHELLE_MONTANT = 2
+_QUANTUM_MONTANT = Decimal(1).scaleb(-_ECHELLE_MONTANT)
+
+
+class SortieLignes(ABC):
+    """Sortie qui reçoit les lignes SCDL elles-mêmes plutôt qu'un fichier, par exemple pour les
+    répartir entre plusieurs fichiers. S'utilise comme output du ConvertisseurTotemBudget."""
+
+    @abstractmethod
+    def ecrire_lignes(self, colonnes: list[str], lignes: Iterable[list[str]], options: Options):
+        """Reçoit les colonnes puis les lignes SCDL d'une conversion, dans l'ordre des colonnes"""
+
+
+def ecrire_lignes(
+    colonnes: list[str],
+    lignes: Iterable[list[str]],
+    output: Union[IO, SortieLignes],
+    options: Options,
+):
+    """Ecrit les lignes SCDL dans output, au format options.format_sortie
+
+    Args:
+        colonnes (list[str]): Noms des colonnes.
+        lignes (Iterable[list[str]]): Valeurs de chaque ligne, dans l'ordre des colonnes.
+        output (IO | SortieLignes): TextIO pour le CSV, fichier binaire pour les autres formats. N'est pas fermé.
+          Une SortieLignes reçoit directement les lignes.
+        options (Options): Options de conversion. inclure_header_csv et lineterminator
+          ne s'appliquent qu'aux formats CSV.
+
+    Raises:
+        ConversionErreur: si output est en lecture seule, ou si la dépendance du format est absente.
+    """
+    lignes = _compter_lignes(lignes)
+    if isinstance(output, SortieLignes):
+        output.ecrire_lignes(colonnes, lignes, options)
+    else:
+        ecrire_fichier(colonnes, lignes, output, options)
+
+
+def ecrire_fichier(
+    colonnes: list[str],
+    lignes: Iterable[list[str]],
+    output: IO,
+    options: Options,
+):
+    """Ecrit les lignes SCDL dans un fichier. Voir ecrire_lignes"""
+    if not output.writable():
+        raise ConversionErreur(f"{str(output)} est en lecture seule.")
+
+    format_sortie = options.format_sortie
+    if format_sortie is FormatSortie.CSV:
+        _ecrire_csv(colonnes, lignes, output, options)
+    elif format_sortie is FormatSortie.CSV_GZIP:
+        # mtime fixé: deux conversions identiques produisent le même fichier
+        with gzip.GzipFile(fileobj=output, mode="wb", mtime=0) as compresse:
+            _ecrire_csv_binaire(colonnes, lignes, compresse, options)
+    elif format_sortie is FormatSortie.CSV_ZSTD:
+        zstandard = _importer("zstandard", "zstd", format_sortie)
+        with zstandard.ZstdCompressor().stream_writer(output, closefd=False) as compresse:
+            _ecrire_csv_binaire(colonnes, lignes, compresse, options)
+    else:
+        _ecrire_colonnes_typees(colonnes, lignes, output, format_sortie)
+
+
+def _ouvrir_sortie(fpath: Path, options: Options) -> IO:
+    """Ouvre en écriture le fichier fpath, en mode binaire ou texte suivant le format de sortie"""
+    if options.format_sortie.binaire:
+        return open(fpath, "wb")
+    return open(fpath, "w", encoding="utf-8", newline="")
+
+
+def _ecrire_csv(colonnes: list[str], lignes: Iterable[list[str]], text_io: IO, options: Options):
+    # Les lignes sont formatées par paquets dans un tampon, puis écrites en une fois:
+    # la sortie ne reçoit qu'un appel à write par paquet, quel que soit son propre tampon.
+    tampon = io.StringIO(newline="")
+    writer = _make_writer(tampon, options)
+
+    if options.inclure_header_csv:
+        writer.writerow(colonnes)
+
+    iterateur = iter(lignes)
+    while True:
+        writer.writerows(islice(iterateur, _TAILLE_PAQUET_CSV))
+        contenu = tampon.getvalue()
+        if not contenu:
+            break
+        text_io.write(contenu)
+        tampon.seek(0)
+        tampon.truncate()
+
+
+def _ecrire_csv_binaire(colonnes: list[str], lignes: Iterable[list[str]], binaire: IO, options: Options):
+    text_io = io.TextIOWrapper(binaire, encoding="utf-8", newline="")
+    try:
+        _ecrire_csv(colonnes, lignes, text_io, options)
+        text_io.flush()
+    finally:
+        # Le flux compressé est fermé par l'appelant, une fois le CSV terminé
+        text_io.detach()
+
+
+def _make_writer(text_io, options: Options):
+    if options.lineterminator is None:
+        return csv.writer(text_io)
+    else:
+        return csv.writer(text_io, lineterminator=options.lineterminator)
+
+
+def _ecrire_colonnes_typees(
+    colonnes: list[str],
+    lignes: Iterable[list[str]],
+    output: IO,
+    format_sortie: FormatSortie,
+):
+    pa = _importer("pyarrow", "arrow", format_sortie)
+
+    types = [type_colonne(nom) for nom in colonnes]
+    schema = pa.schema(
+        [pa.field(nom, _type_arrow(pa, type_)) for nom, type_ in zip(colonnes, types)]
+    )
+    convertisseurs = [_CONVERTISSEURS[type_] for type_ in types]
+
+    if format_sortie is FormatSortie.PARQUET:
+        import pyarrow.parquet as pq
+
+        writer = pq.ParquetWriter(output, schema)
+    else:
+        writer = pa.ipc.new_stream(output, schema)
+
+    try:
+        for paquet in _paquets(lignes):
+            valeurs_colonnes = zip(*paquet)
+            writer.write_batch(
+                pa.record_batch(
+                    [
+                        pa.array([convertir(v) for v in valeurs], type=champ.type)
+                        for convertir, valeurs, champ in zip(convertisseurs, valeurs_colonnes, schema)
+                    ],
+                    schema=schema,
+                )
+            )
+    finally:
+        writer.close()
+
+
+def _type_arrow(pa, type_: TypeColonne):
+    if type_ is TypeColonne.MONTANT:
+        return pa.decimal128(_PRECISION_MONTANT, _ECHELLE_MONTANT)
+    if type_ is TypeColonne.ENTIER:
+        return pa.int64()
+    return pa.string()
+
+
+def _montant(valeur: str) -> Decimal:
+    """Montant au format decimal128(18, 2). Un montant n'est jamais arrondi: les zéros
+    non significatifs au-delà de deux décimales sont retirés, tout autre montant est refusé."""
+    try:
+        montant = Decimal(valeur).quantize(_QUANTUM_MONTANT)
+        exact = montant == Decimal(valeur)
+    except InvalidOperation:
+        exact = False
+    if not exact or len(montant.as_tuple().digits) > _PRECISION_MONTANT:
+        raise ConversionErreur(
+            f"Le montant {valeur!r} n'est pas représentable avec {_ECHELLE_MONTANT} décimales"
+            f" et {_PRECISION_MONTANT} chiffres"
+        )
+    return montant
+
+
+# Une valeur vide du CSV est une valeur absente (null) dans les formats typés
+_CONVERTISSEURS = {
+    TypeColonne.TEXTE: lambda v: v if v != "" else None,
+    TypeColonne.ENTIER: lambda v: int(v) if v != "" else None,
+    TypeColonne.MONTANT: lambda v: _montant(v) if v != "" else None,
+}
+
+
+def _paquets(lignes: Iterable[list[str]]) -> Iterator[list[list[str]]]:
+    iterateur = iter(lignes)
+    while paquet := list(islice(iterateur, _TAILLE_PAQUET)):
+        yield paquet
+
+
+def _importer(module: str, extra: str, format_sortie: FormatSortie):
+    try:
+        import importlib
+
+        return importlib.import_module(module)
+    except ImportError as err:
+        raise ConversionErreur(
+            f"Le format de sortie {format_sortie.value} nécessite le paquet {module}"
+            f" (pip install yatotem2scdl[{extra}])"
+        ) from err
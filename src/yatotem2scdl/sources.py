@@ -0,0 +1,157 @@
+"""Ouverture des documents totem, depuis un chemin, des octets ou un fichier binaire
+
+Les documents compressés en gzip ou en zip (contenant un unique fichier XML) sont reconnus
+à leurs premiers octets et décompressés à la volée. Ce module ne dépend que de la bibliothèque standard.
+"""
+
+import io
+import os
+import tempfile
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Union
+
+from .exceptions import TotemInvalideErreur
+
+# Chemin du fichier totem, contenu du fichier ou fichier binaire ouvert en lecture
+SourceTotem = Union[Path, str, bytes, bytearray, memoryview, BinaryIO]
+
+_MAGIQUE_GZIP = b"\x1f\x8b"
+_MAGIQUE_ZIP = b"PK\x03\x04"
+# Taille au-delà de laquelle une archive zip lue depuis un flux est recopiée sur disque
+_TAILLE_MAX_ZIP_EN_MEMOIRE = 64 * 1024 * 1024
+
+
+def est_chemin(source: SourceTotem) -> bool:
+    return isinstance(source, (Path, str))
+
+
+def description(source: SourceTotem) -> str:
+    """Description de la source pour les logs, sans son contenu"""
+    if est_chemin(source):
+        return str(source)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return f"<document de {len(source)} octets>"
+    return str(getattr(source, "name", repr(source)))
+
+
+def taille(source: SourceTotem) -> Optional[int]:
+    """Taille en octets de la source, telle que lue (compressée le cas échéant). None pour un flux."""
+    if est_chemin(source):
+        try:
+            return os.stat(source).st_size  # type: ignore[arg-type]
+        except OSError:
+            return None
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return memoryview(source).nbytes
+    return None
+
+
+@contextmanager
+def ouvrir_totem(source: SourceTotem) -> Iterator[Union[str, BinaryIO]]:
+    """Ouvre un document totem pour lxml
+
+    Un fichier non compressé est renvoyé sous forme de chemin, que lxml lit plus vite qu'un fichier python.
+    Dans les autres cas, renvoie un fichier binaire du document XML décompressé.
+    Un fichier binaire fourni par l'appelant n'est pas fermé.
+    """
+    if est_chemin(source):
+        with open(source, "rb") as fichier:  # type: ignore[arg-type]
+            compresse = _magique(fichier) != b""
+        if not compresse:
+            yield str(source)
+            return
+
+    with ouvrir_totem_binaire(source) as fichier:
+        yield fichier
+
+
+@contextmanager
+def ouvrir_totem_binaire(source: SourceTotem) -> Iterator[BinaryIO]:
+    """Ouvre un document totem sous forme de fichier binaire du document XML décompressé
+
+    Un fichier binaire fourni par l'appelant n'est pas fermé.
+    """
+    with ExitStack() as pile:
+        if est_chemin(source):
+            fichier = pile.enter_context(open(source, "rb"))  # type: ignore[arg-type]
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            fichier = io.BytesIO(source)
+        elif isinstance(source, io.TextIOBase):
+            raise TypeError("Le document totem doit être ouvert en mode binaire")
+        elif hasattr(source, "read"):
+            fichier = source
+        else:
+            raise TypeError(f"Source de document totem non supportée: {type(source)}")
+
+        if not _seekable(fichier) and not hasattr(fichier, "peek"):
+            fichier = io.BufferedReader(_LectureBrute(fichier))  # type: ignore[arg-type]
+
+        magique = _magique(fichier)
+        if magique == _MAGIQUE_GZIP:
+            import gzip
+
+            yield pile.enter_context(gzip.GzipFile(fileobj=fichier, mode="rb"))  # type: ignore[misc]
+        elif magique == _MAGIQUE_ZIP:
+            yield _ouvrir_membre_zip(fichier, pile)
+        else:
+            yield fichier
+
+
+def _magique(fichier: BinaryIO) -> bytes:
+    """Signature de compression en tête du fichier, sans consommer ses octets. b"" si non compressé"""
+    if _seekable(fichier):
+        position = fichier.tell()
+        debut = fichier.read(len(_MAGIQUE_ZIP))
+        fichier.seek(position)
+    else:
+        debut = fichier.peek(len(_MAGIQUE_ZIP))  # type: ignore[attr-defined]
+
+    for magique in (_MAGIQUE_GZIP, _MAGIQUE_ZIP):
+        if debut.startswith(magique):
+            return magique
+    return b""
+
+
+def _seekable(fichier) -> bool:
+    # Un flux peut ne proposer que read()
+    return hasattr(fichier, "seekable") and fichier.seekable()
+
+
+def _ouvrir_membre_zip(fichier: BinaryIO, pile: ExitStack) -> BinaryIO:
+    import zipfile
+
+    if not _seekable(fichier):
+        # zipfile lit le répertoire central en fin d'archive, le flux doit donc être recopié
+        copie = pile.enter_context(
+            tempfile.SpooledTemporaryFile(max_size=_TAILLE_MAX_ZIP_EN_MEMOIRE)
+        )
+        while bloc := fichier.read(1024 * 1024):
+            copie.write(bloc)
+        copie.seek(0)
+        fichier = copie  # type: ignore[assignment]
+
+    archive = pile.enter_context(zipfile.ZipFile(fichier))
+    membres = [
+        m for m in archive.infolist() if not m.is_dir() and m.filename.lower().endswith(".xml")
+    ]
+    if len(membres) != 1:
+        raise TotemInvalideErreur(
+            f"L'archive zip doit contenir un unique fichier XML, {len(membres)} trouvé(s)"
+        )
+    return pile.enter_context(archive.open(membres[0]))  # type: ignore[return-value]
+
+
+class _LectureBrute(io.RawIOBase):
+    """Adapte un objet ne proposant que read() à io.BufferedReader, qui permet de lire son début sans le consommer"""
+
+    def __init__(self, fichier):
+        self.__fichier = fichier
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, tampon) -> int:
+        donnees = self.__fichier.read(len(tampon))
+        tampon[: len(donnees)] = donnees
+        return len(donnees)
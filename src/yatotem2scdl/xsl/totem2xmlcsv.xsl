@@ -10,13 +10,17 @@ pierre.dittgen@jailbreak.paris
 -->
 <xsl:stylesheet version="1.0"
     xmlns:xsl="http://www.w3.org/1999/XSL/Transform"
-    xmlns:totem="http://www.minefi.gouv.fr/cp/demat/docbudgetaire">
+    xmlns:totem="http://www.minefi.gouv.fr/cp/demat/docbudgetaire"
+    xmlns:yat="https://github.com/megalis-bretagne/yatotem2scdl"
+    exclude-result-prefixes="yat">
     <xsl:output method="xml" encoding="utf-8" />
 
     <xsl:param name="plandecompte" />
 
     <!-- plandecompte path is given as parameter now -->
-    <xsl:variable name="plan_de_compte" select="document($plandecompte)" />
+    <!-- labels and sections are looked up in an index of the chart maintained by the converter (yat:* functions).
+         Other XSLT processors, without these functions, fall back on document($plandecompte) -->
+    <xsl:variable name="extensions" select="function-available('yat:libelle-compte')" />
 
     <xsl:template match="/">
         
@@ -66,7 +70,6 @@ pierre.dittgen@jailbreak.paris
                     <row lineno="{position()}">
 
                         <xsl:variable name="contNat" select="totem:ContNat/@V" />
-                        <xsl:variable name="chapitre" select="$plan_de_compte/Nomenclature/Nature/Chapitres/Chapitre[@Code=$contNat]" />
                         <xsl:variable name="nature" select="totem:Nature/@V" />
                         <xsl:variable name="fonction" select="totem:Fonction/@V" />
 
@@ -77,19 +80,28 @@ pierre.dittgen@jailbreak.paris
                         <cell name="BGT_CONTNAT" value="{$contNat}" />
                         <cell name="BGT_CONTNAT_LABEL">
                             <xsl:attribute name="value">
-                                <xsl:value-of select="$chapitre/@Libelle" />
+                                <xsl:choose>
+                                    <xsl:when test="$extensions"><xsl:value-of select="yat:libelle-chapitre($plandecompte, $contNat)" /></xsl:when>
+                                    <xsl:otherwise><xsl:value-of select="document($plandecompte)/Nomenclature/Nature/Chapitres/Chapitre[@Code=$contNat]/@Libelle" /></xsl:otherwise>
+                                </xsl:choose>
                             </xsl:attribute>
                         </cell>
                         <cell name="BGT_NATURE" value="{$nature}" />
                         <cell name="BGT_NATURE_LABEL">
                             <xsl:attribute name="value">
-                                <xsl:value-of select="$plan_de_compte/Nomenclature/Nature/Comptes//Compte[@Code=$nature]/@Libelle" />
+                                <xsl:choose>
+                                    <xsl:when test="$extensions"><xsl:value-of select="yat:libelle-compte($plandecompte, $nature)" /></xsl:when>
+                                    <xsl:otherwise><xsl:value-of select="document($plandecompte)/Nomenclature/Nature/Comptes//Compte[@Code=$nature]/@Libelle" /></xsl:otherwise>
+                                </xsl:choose>
                             </xsl:attribute>
                         </cell>
                         <cell name="BGT_FONCTION" value="{$fonction}" />
                         <cell name="BGT_FONCTION_LABEL">
                             <xsl:attribute name="value">
-                                <xsl:value-of select="$plan_de_compte/Nomenclature/Fonction/RefFonctionnelles//RefFonc[@Code=$fonction]/@Libelle" />
+                                <xsl:choose>
+                                    <xsl:when test="$extensions"><xsl:value-of select="yat:libelle-fonction($plandecompte, $fonction)" /></xsl:when>
+                                    <xsl:otherwise><xsl:value-of select="document($plandecompte)/Nomenclature/Fonction/RefFonctionnelles//RefFonc[@Code=$fonction]/@Libelle" /></xsl:otherwise>
+                                </xsl:choose>
                             </xsl:attribute>
                         </cell>
                         <cell name="BGT_OPERATION">
@@ -100,7 +112,12 @@ pierre.dittgen@jailbreak.paris
                             </xsl:attribute>
                         </cell>
                         <cell name="BGT_SECTION">
-                            <xsl:variable name="section" select="$chapitre/@Section" />
+                            <xsl:variable name="section">
+                                <xsl:choose>
+                                    <xsl:when test="$extensions"><xsl:value-of select="yat:section-chapitre($plandecompte, $contNat)" /></xsl:when>
+                                    <xsl:otherwise><xsl:value-of select="document($plandecompte)/Nomenclature/Nature/Chapitres/Chapitre[@Code=$contNat]/@Section" /></xsl:otherwise>
+                                </xsl:choose>
+                            </xsl:variable>
                             <xsl:attribute name="value">
                                 <xsl:if test="$section = 'I'">investissement</xsl:if>
                                 <xsl:if test="$section = 'F'">fonctionnement</xsl:if>
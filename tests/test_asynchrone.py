@@ -0,0 +1,149 @@
+import asyncio
+import io
+import threading
+
+import pytest
+
+from yatotem2scdl import (
+    ConversionErreur,
+    ConvertisseurAsync,
+    ConvertisseurTotemBudget,
+    FormatSortie,
+    Options,
+)
+
+from data import EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+_PETIT = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000" / "totem.xml"
+_GRAND = EXEMPLES_PATH / "DOCBUDG-21560046100010-056025-CA-2021-01032022000000" / "totem.xml"
+
+
+def _attendu(totem_fpath) -> str:
+    output = io.StringIO(newline="")
+    ConvertisseurTotemBudget().totem_budget_vers_scdl(totem_fpath, PLANS_DE_COMPTE_PATH, output)
+    return output.getvalue()
+
+
+async def _scdl(convertisseur: ConvertisseurAsync, totem_fpath, options: Options = Options()) -> list:
+    return [morceau async for morceau in convertisseur.convertir(totem_fpath, PLANS_DE_COMPTE_PATH, options)]
+
+
+def test_convertir_par_morceaux():
+    async def scenario():
+        async with ConvertisseurAsync(taille_morceau=4096) as convertisseur:
+            return await _scdl(convertisseur, _GRAND)
+
+    morceaux = asyncio.run(scenario())
+
+    assert len(morceaux) > 1
+    assert all(isinstance(morceau, str) for morceau in morceaux)
+    assert all(len(morceau) == 4096 for morceau in morceaux[:-1])
+    assert "".join(morceaux) == _attendu(_GRAND)
+
+
+def test_convertir_binaire():
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    async def scenario():
+        async with ConvertisseurAsync() as convertisseur:
+            return await _scdl(convertisseur, _PETIT, Options(format_sortie=FormatSortie.PARQUET))
+
+    morceaux = asyncio.run(scenario())
+
+    assert all(isinstance(morceau, bytes) for morceau in morceaux)
+    table = pq.read_table(io.BytesIO(b"".join(morceaux)))
+    assert table.num_rows == len(_attendu(_PETIT).splitlines()) - 1
+
+
+def test_conversions_concurrentes_caches_partages():
+    convertisseur = ConvertisseurTotemBudget()
+    totem_fpaths = [_GRAND] * 6
+
+    async def scenario():
+        async with ConvertisseurAsync(convertisseur, concurrence=2) as convertisseur_async:
+            await _scdl(convertisseur_async, _GRAND)
+            return await asyncio.gather(*(_scdl(convertisseur_async, p) for p in totem_fpaths))
+
+    resultats = asyncio.run(scenario())
+
+    assert ["".join(m) for m in resultats] == [_attendu(p) for p in totem_fpaths]
+    # Le plan de compte chargé par la première conversion sert à toutes les suivantes
+    assert convertisseur.cache_pdc.misses == 1
+
+
+def test_limite_de_concurrence():
+    en_cours = 0
+    maximum = 0
+    verrou = threading.Lock()
+
+    class ConvertisseurCompteur(ConvertisseurTotemBudget):
+        def totem_budget_metadata(self, *args, **kwargs):
+            nonlocal en_cours, maximum
+            with verrou:
+                en_cours += 1
+                maximum = max(maximum, en_cours)
+            try:
+                return super().totem_budget_metadata(*args, **kwargs)
+            finally:
+                with verrou:
+                    en_cours -= 1
+
+    async def scenario():
+        async with ConvertisseurAsync(ConvertisseurCompteur(), concurrence=2) as convertisseur:
+            return await asyncio.gather(
+                *(convertisseur.metadata(_GRAND, PLANS_DE_COMPTE_PATH) for _ in range(8))
+            )
+
+    metadatas = asyncio.run(scenario())
+
+    assert len(set(metadatas)) == 1
+    assert maximum <= 2
+
+
+def test_interruption_arrete_la_conversion():
+    async def scenario():
+        async with ConvertisseurAsync(concurrence=1, taille_morceau=1024, morceaux_en_attente=1) as convertisseur:
+            iterateur = convertisseur.convertir(_GRAND, PLANS_DE_COMPTE_PATH)
+            premier = await iterateur.__anext__()
+            await iterateur.aclose()
+            # La place est rendue: une autre conversion peut démarrer
+            return premier, await _scdl(convertisseur, _PETIT)
+
+    premier, morceaux = asyncio.run(scenario())
+
+    assert _attendu(_GRAND).startswith(premier)
+    assert "".join(morceaux) == _attendu(_PETIT)
+
+
+def test_annulation():
+    async def consommer(convertisseur, demarre: asyncio.Event):
+        async for _ in convertisseur.convertir(_GRAND, PLANS_DE_COMPTE_PATH):
+            demarre.set()
+            await asyncio.sleep(3600)
+
+    async def scenario():
+        async with ConvertisseurAsync(concurrence=1, taille_morceau=1024, morceaux_en_attente=1) as convertisseur:
+            demarre = asyncio.Event()
+            tache = asyncio.create_task(consommer(convertisseur, demarre))
+            await demarre.wait()
+            tache.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await tache
+            return await convertisseur.metadata(_PETIT, PLANS_DE_COMPTE_PATH)
+
+    assert asyncio.run(scenario()).annee_exercice == 2022
+
+
+def test_erreur_de_conversion():
+    async def scenario():
+        async with ConvertisseurAsync() as convertisseur:
+            await _scdl(convertisseur, b"<pas du totem")
+
+    with pytest.raises(ConversionErreur):
+        asyncio.run(scenario())
+
+
+def test_parametres_invalides():
+    with pytest.raises(ValueError):
+        ConvertisseurAsync(concurrence=0)
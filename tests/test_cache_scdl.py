@@ -0,0 +1,118 @@
+import io
+import shutil
+from pathlib import Path
+
+import pytest
+
+from yatotem2scdl import (
+    CacheScdl,
+    ConversionErreur,
+    ConvertisseurTotemBudget,
+    MoteurConversion,
+    Options,
+    PlansDeComptesCompiles,
+    compiler_plans_de_comptes,
+)
+from yatotem2scdl.plan_de_compte import CachePlansDeComptes
+
+from data import A_LA_MARGE_PATH, EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+_EXEMPLE_BP = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000"
+_EXEMPLE_DM = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-DM1-2022-05072022000000"
+
+
+def _convertir(convertisseur: ConvertisseurTotemBudget, totem_fpath: Path, options: Options = Options()) -> str:
+    output = io.StringIO()
+    convertisseur.totem_budget_vers_scdl(totem_fpath, PLANS_DE_COMPTE_PATH, output, options)
+    return output.getvalue()
+
+
+def test_cache_scdl(tmp_path: Path):
+    cache = CacheScdl(tmp_path)
+    convertisseur = ConvertisseurTotemBudget(cache_scdl=cache)
+    attendu = (_EXEMPLE_BP / "expected.csv").read_bytes().decode("utf-8")
+
+    assert _convertir(convertisseur, _EXEMPLE_BP / "totem.xml") == attendu
+    assert (cache.hits, cache.misses, len(cache)) == (0, 1, 1)
+
+    # Le cache est partagé par les convertisseurs qui produisent le même SCDL
+    assert _convertir(ConvertisseurTotemBudget(cache_scdl=cache), _EXEMPLE_BP / "totem.xml") == attendu
+    assert cache.hits == 1
+
+    # Même contenu à un autre chemin
+    copie = tmp_path / "copie.xml"
+    copie.write_bytes((_EXEMPLE_BP / "totem.xml").read_bytes())
+    assert _convertir(convertisseur, copie) == attendu
+    assert (cache.misses, len(cache)) == (1, 1)
+
+
+def test_cache_scdl_cle(tmp_path: Path):
+    cache = CacheScdl(tmp_path)
+    convertisseur = ConvertisseurTotemBudget(cache_scdl=cache)
+
+    _convertir(convertisseur, _EXEMPLE_BP / "totem.xml")
+    sans_entete = _convertir(convertisseur, _EXEMPLE_BP / "totem.xml", Options(inclure_header_csv=False))
+    _convertir(ConvertisseurTotemBudget(cache_scdl=cache, moteur=MoteurConversion.NATIF), _EXEMPLE_BP / "totem.xml")
+    _convertir(convertisseur, _EXEMPLE_DM / "totem.xml")
+
+    assert not sans_entete.startswith("BGT_NATDEC")
+    assert cache.misses == len(cache) == 4
+
+
+def test_cache_scdl_plans_compiles_seuls(tmp_path: Path):
+    # Déploiement avec l'index compilé seul, sans les fichiers XML des plans de comptes
+    pdcs_dpath = tmp_path / "pdcs"
+    shutil.copytree(PLANS_DE_COMPTE_PATH, pdcs_dpath)
+    pdc_fpath = pdcs_dpath / "2022" / "M14" / "M14_COM_500_3500" / "planDeCompte.xml"
+    contenu_pdc = pdc_fpath.read_text(encoding="utf-8")
+    cache = CacheScdl(tmp_path / "cache")
+
+    def _convertir_compile(contenu: str) -> str:
+        pdc_fpath.write_text(contenu, encoding="utf-8")
+        compiler_plans_de_comptes(pdcs_dpath, tmp_path / "pdcs.sqlite")
+        for fpath in pdcs_dpath.glob("*/*/*/planDeCompte.xml"):
+            fpath.unlink()
+        compiles = PlansDeComptesCompiles(tmp_path / "pdcs.sqlite")
+        convertisseur = ConvertisseurTotemBudget(
+            cache_pdc=CachePlansDeComptes(compiles=compiles), moteur=MoteurConversion.NATIF, cache_scdl=cache
+        )
+        output = io.StringIO()
+        convertisseur.totem_budget_vers_scdl(_EXEMPLE_BP / "totem.xml", pdcs_dpath, output)
+        return output.getvalue()
+
+    scdl = _convertir_compile(contenu_pdc)
+    assert scdl == (_EXEMPLE_BP / "expected.csv").read_bytes().decode("utf-8")
+    assert "Charges à caractère général" in scdl
+
+    # Un index recompilé avec d'autres libellés ne sert pas le SCDL déjà en cache
+    scdl_modifie = _convertir_compile(contenu_pdc.replace("Charges à caractère général", "Charges générales"))
+    assert "Charges générales" in scdl_modifie
+    assert (cache.hits, cache.misses) == (0, 2)
+
+
+def test_cache_scdl_eviction(tmp_path: Path):
+    taille_scdl = (_EXEMPLE_BP / "expected.csv").stat().st_size
+    cache = CacheScdl(tmp_path, taille_max=taille_scdl + 1)
+    convertisseur = ConvertisseurTotemBudget(cache_scdl=cache)
+
+    _convertir(convertisseur, _EXEMPLE_BP / "totem.xml")
+    _convertir(convertisseur, _EXEMPLE_DM / "totem.xml")
+    assert len(cache) == 1
+    assert cache.taille() <= cache.taille_max
+
+    _convertir(convertisseur, _EXEMPLE_BP / "totem.xml")
+    assert cache.misses == 3
+
+    # Un nouveau cache sur le même dossier retrouve les entrées
+    assert len(CacheScdl(tmp_path)) == 1
+
+
+def test_cache_scdl_erreur(tmp_path: Path):
+    cache = CacheScdl(tmp_path)
+    convertisseur = ConvertisseurTotemBudget(cache_scdl=cache)
+
+    with pytest.raises(ConversionErreur):
+        _convertir(convertisseur, A_LA_MARGE_PATH / "mauvais_totem.xml")
+
+    assert len(cache) == 0
+    assert list(tmp_path.iterdir()) == []
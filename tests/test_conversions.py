@@ -1,5 +1,9 @@
+import gzip
 import hashlib
+import io
 import json
+import os
+import shutil
 from sys import stderr
 import tempfile
 from os.path import isdir
@@ -7,11 +11,15 @@ from pathlib import Path
 from csv_diff import load_csv, compare
 
 import pytest
+from lxml import etree
 
-from yatotem2scdl import ConvertisseurTotemBudget, Options
+from yatotem2scdl import ConversionErreur, ConvertisseurTotemBudget, Options
+from yatotem2scdl.conversion import _BUDGET_XSLT
 
 from data import PLANS_DE_COMPTE_PATH
-from data import examples_directories
+from data import EXEMPLES_PATH, examples_directories
+
+_TOTEM = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000" / "totem.xml"
 
 
 @pytest.mark.parametrize(
@@ -71,3 +79,59 @@ def test_scdl_entetes():
     convertisseur = ConvertisseurTotemBudget()
     entetes = convertisseur.budget_scdl_entetes()
     assert "BGT_NOM" in entetes
+
+
+def test_xslt_compilee_une_seule_fois(tmp_path: Path):
+    xslt_fpath = tmp_path / "totem2xmlcsv.xsl"
+    shutil.copy(_BUDGET_XSLT, xslt_fpath)
+    convertisseur = ConvertisseurTotemBudget(xslt_budget=xslt_fpath)
+
+    premiere = convertisseur._xslt_compilee()
+    assert convertisseur._xslt_compilee() is premiere
+
+    stat = xslt_fpath.stat()
+    os.utime(xslt_fpath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert (
+        convertisseur._xslt_compilee() is not premiere
+    ), "La XSLT doit être recompilée lorsque le fichier est modifié"
+
+
+def _xml_intermediaire(tmp_path: Path, nom: str, **options) -> tuple[etree._ElementTree, str]:
+    intermediaire_fpath = tmp_path / nom
+    output = io.StringIO(newline="")
+    ConvertisseurTotemBudget().totem_budget_vers_scdl(
+        _TOTEM, PLANS_DE_COMPTE_PATH, output, Options(xml_intermediaire_path=str(intermediaire_fpath), **options)
+    )
+    contenu = intermediaire_fpath.read_bytes()
+    if nom.endswith(".gz"):
+        contenu = gzip.decompress(contenu)
+    # L'indentation du XML synchrone est ignorée à la lecture
+    racine = etree.fromstring(contenu, etree.XMLParser(remove_blank_text=True))
+    return etree.ElementTree(racine), output.getvalue()
+
+
+def test_xml_intermediaire_asynchrone(tmp_path: Path):
+    synchrone, scdl = _xml_intermediaire(tmp_path, "synchrone.xml")
+    asynchrone, scdl_asynchrone = _xml_intermediaire(tmp_path, "asynchrone.xml.gz", xml_intermediaire_asynchrone=True)
+
+    assert scdl_asynchrone == scdl
+    assert etree.tostring(asynchrone) == etree.tostring(synchrone)
+    assert len(asynchrone.findall("./data/row")) == len(scdl.splitlines()) - 1
+
+
+def test_xml_intermediaire_echantillon(tmp_path: Path):
+    complet, _ = _xml_intermediaire(tmp_path, "complet.xml")
+    echantillon, _ = _xml_intermediaire(
+        tmp_path, "echantillon.xml", xml_intermediaire_asynchrone=True, xml_intermediaire_lignes_max=5
+    )
+
+    data = complet.find("./data")
+    assert len(data) > 5
+    del data[5:]
+    assert etree.tostring(echantillon) == etree.tostring(complet)
+
+
+def test_xml_intermediaire_erreur_asynchrone(tmp_path: Path):
+    with pytest.raises(ConversionErreur) as err:
+        _xml_intermediaire(tmp_path, "absent/intermediaire.xml", xml_intermediaire_asynchrone=True)
+    assert isinstance(err.value.__cause__, OSError)
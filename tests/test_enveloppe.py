@@ -0,0 +1,160 @@
+import io
+import threading
+from pathlib import Path
+
+import pytest
+from lxml import etree
+
+from yatotem2scdl import conversion
+from yatotem2scdl import (
+    ConversionErreur,
+    ConvertisseurTotemBudget,
+    DocumentEnveloppe,
+    FormatSortie,
+    MesureConversion,
+    MetriquesConversion,
+    MoteurConversion,
+    Options,
+)
+
+from data import EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+_PRINCIPAL = EXEMPLES_PATH / "DOCBUDG-21560046100010-056025-CA-2021-01032022000000" / "totem.xml"
+_ANNEXE = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000" / "totem.xml"
+
+
+def _enveloppe(tmp_path: Path, totem_fpaths: list[Path]) -> Path:
+    racine = etree.Element("Enveloppe")
+    for totem_fpath in totem_fpaths:
+        racine.append(etree.parse(str(totem_fpath)).getroot())
+    enveloppe_fpath = tmp_path / "enveloppe.xml"
+    etree.ElementTree(racine).write(str(enveloppe_fpath), xml_declaration=True, encoding="utf-8")
+    return enveloppe_fpath
+
+
+def _attendu(totem_fpath: Path) -> str:
+    return (totem_fpath.parent / "expected.csv").read_bytes().decode("utf-8")
+
+
+@pytest.mark.parametrize("moteur", [MoteurConversion.XSLT, MoteurConversion.NATIF])
+def test_scdl_combine(tmp_path: Path, moteur: MoteurConversion):
+    enveloppe_fpath = _enveloppe(tmp_path, [_PRINCIPAL, _ANNEXE])
+    output = io.StringIO(newline="")
+
+    documents = ConvertisseurTotemBudget(moteur=moteur).totem_enveloppe_vers_scdl(
+        enveloppe_fpath, PLANS_DE_COMPTE_PATH, output, workers=2
+    )
+
+    principal, annexe = _attendu(_PRINCIPAL), _attendu(_ANNEXE)
+    assert output.getvalue() == principal + annexe.split("\r\n", 1)[1]
+    assert [(d.position, d.metadata.id_etablissement, d.scdl_fpath) for d in documents] == [
+        (0, 21560046100010, None),
+        (1, 21560046100085, None),
+    ]
+    assert [d.lignes for d in documents] == [len(principal.splitlines()) - 1, len(annexe.splitlines()) - 1]
+    # Chaque document est converti avec son propre plan de compte
+    assert documents[0].metadata.plan_de_compte != documents[1].metadata.plan_de_compte
+
+
+def test_scdl_par_document(tmp_path: Path):
+    enveloppe_fpath = _enveloppe(tmp_path, [_PRINCIPAL, _ANNEXE])
+    output_dpath = tmp_path / "scdl"
+
+    documents = ConvertisseurTotemBudget().totem_enveloppe_vers_scdl(
+        enveloppe_fpath, PLANS_DE_COMPTE_PATH, output_dpath=output_dpath
+    )
+
+    assert [d.scdl_fpath for d in documents] == [
+        output_dpath / "000-21560046100010.csv",
+        output_dpath / "001-21560046100085.csv",
+    ]
+    for document, totem_fpath in zip(documents, [_PRINCIPAL, _ANNEXE]):
+        assert document.scdl_fpath is not None
+        assert document.scdl_fpath.read_bytes().decode("utf-8") == _attendu(totem_fpath)
+
+
+def test_documents_en_parallele(tmp_path: Path):
+    totem_fpaths = [_PRINCIPAL, _ANNEXE] * 4
+    enveloppe_fpath = _enveloppe(tmp_path, totem_fpaths)
+    convertisseur = ConvertisseurTotemBudget()
+
+    paralleles = convertisseur.totem_enveloppe_vers_scdl(
+        enveloppe_fpath, PLANS_DE_COMPTE_PATH, output_dpath=tmp_path / "paralleles", workers=4
+    )
+    sequentiels = convertisseur.totem_enveloppe_vers_scdl(
+        enveloppe_fpath, PLANS_DE_COMPTE_PATH, output_dpath=tmp_path / "sequentiels", workers=1
+    )
+
+    assert [d.lignes for d in paralleles] == [d.lignes for d in sequentiels]
+    for parallele, totem_fpath in zip(paralleles, totem_fpaths):
+        assert parallele.scdl_fpath is not None
+        assert parallele.scdl_fpath.read_bytes().decode("utf-8") == _attendu(totem_fpath)
+
+
+@pytest.mark.parametrize("moteur", [MoteurConversion.XSLT, MoteurConversion.NATIF])
+def test_mesure_des_documents(tmp_path: Path, moteur: MoteurConversion):
+    enveloppe_fpath = _enveloppe(tmp_path, [_PRINCIPAL, _ANNEXE])
+    mesures: list[MesureConversion] = []
+    convertisseur = ConvertisseurTotemBudget(moteur=moteur, metriques=MetriquesConversion(observateur=mesures.append))
+
+    convertisseur.totem_enveloppe_vers_scdl(enveloppe_fpath, PLANS_DE_COMPTE_PATH, io.StringIO(), workers=2)
+
+    # Les phases et accès aux caches des threads de conversion sont rattachés à la mesure de l'enveloppe
+    [mesure] = mesures
+    assert mesure.operation == "conversion_enveloppe"
+    assert {"plan_de_compte", "documents"} < set(mesure.phases)
+    if moteur is MoteurConversion.XSLT:
+        assert "xslt" in mesure.phases
+    else:
+        assert mesure.cache_misses["plan_de_compte"] == 2
+
+
+@pytest.mark.parametrize("par_document", [False, True])
+def test_lignes_natives_extraites_par_le_pool(tmp_path: Path, monkeypatch, par_document: bool):
+    enveloppe_fpath = _enveloppe(tmp_path, [_PRINCIPAL, _ANNEXE])
+    threads: set[str] = set()
+    lignes_scdl = conversion.lignes_scdl
+
+    def _lignes_scdl(*args):
+        for ligne in lignes_scdl(*args):
+            threads.add(threading.current_thread().name)
+            yield ligne
+
+    monkeypatch.setattr(conversion, "lignes_scdl", _lignes_scdl)
+    mesures: list[MesureConversion] = []
+    convertisseur = ConvertisseurTotemBudget(
+        moteur=MoteurConversion.NATIF, metriques=MetriquesConversion(observateur=mesures.append)
+    )
+    sorties = {"output_dpath": tmp_path / "scdl"} if par_document else {"output": io.StringIO()}
+
+    documents = convertisseur.totem_enveloppe_vers_scdl(enveloppe_fpath, PLANS_DE_COMPTE_PATH, workers=2, **sorties)
+
+    # Les lignes ne sont pas extraites paresseusement par le thread qui écrit la sortie
+    assert threads and all(nom.startswith("yatotem2scdl-document") for nom in threads)
+    [mesure] = mesures
+    assert mesure.lignes == sum(d.lignes for d in documents) > 0
+
+
+def test_document_sans_enveloppe():
+    output = io.BytesIO()
+
+    [document] = ConvertisseurTotemBudget().totem_enveloppe_vers_scdl(
+        _ANNEXE, PLANS_DE_COMPTE_PATH, output, options=Options(format_sortie=FormatSortie.CSV_GZIP)
+    )
+
+    assert document == DocumentEnveloppe(0, document.metadata, len(_attendu(_ANNEXE).splitlines()) - 1)
+
+
+def test_conversion_simple_refuse_une_enveloppe(tmp_path: Path):
+    enveloppe_fpath = _enveloppe(tmp_path, [_PRINCIPAL, _ANNEXE])
+
+    with pytest.raises(ConversionErreur):
+        ConvertisseurTotemBudget().totem_budget_vers_scdl(enveloppe_fpath, PLANS_DE_COMPTE_PATH, io.StringIO())
+
+
+def test_une_seule_sortie(tmp_path: Path):
+    convertisseur = ConvertisseurTotemBudget()
+    with pytest.raises(ValueError):
+        convertisseur.totem_enveloppe_vers_scdl(_ANNEXE, PLANS_DE_COMPTE_PATH)
+    with pytest.raises(ValueError):
+        convertisseur.totem_enveloppe_vers_scdl(_ANNEXE, PLANS_DE_COMPTE_PATH, io.StringIO(), tmp_path)
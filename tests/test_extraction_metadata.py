@@ -1,4 +1,6 @@
 from genericpath import isdir
+import io
+import xml.sax
 from pathlib import Path
 import pytest
 import time
@@ -11,8 +13,13 @@ from yatotem2scdl import (
     SiretInvalideErreur,
     TotemInvalideErreur,
     EtapeBudgetaire,
+    Options,
 )
 
+from yatotem2scdl.conversion import _lire_metadata
+from yatotem2scdl.metadata import _lire_valeurs_metadata, lire_totem_budget_metadata
+from yatotem2scdl.TotemMetadataHandler import TotemMetadataHandler, FinishedParsing
+
 from data import PLANS_DE_COMPTE_PATH, EXTRACT_METADATA_PATH
 from data import examples_directories
 
@@ -122,3 +129,150 @@ def test_parse_metadata_mauvaise_etape(_convertisseur: ConvertisseurTotemBudget)
         type(err.value.__cause__) is EtapeBudgetaireInconnueErreur
         and isinstance(err.value.__cause__, TotemInvalideErreur) is True
     )
+
+
+@pytest.mark.parametrize(
+    "totem_path",
+    [
+        d / "totem.xml"
+        for d in examples_directories()
+        if isdir(d) and (d / "totem.xml").exists() and not (d / "totem2xmlcsv-custom.xsl").exists()
+    ],
+)
+def test_conversion_et_metadata(
+    _convertisseur: ConvertisseurTotemBudget, totem_path: Path
+):
+    attendu_csv = io.StringIO()
+    _convertisseur.totem_budget_vers_scdl(totem_path, PLANS_DE_COMPTE_PATH, attendu_csv)
+    attendu_metadata = _convertisseur.totem_budget_metadata(totem_path, PLANS_DE_COMPTE_PATH)
+
+    output = io.StringIO()
+    metadata = _convertisseur.totem_budget_vers_scdl_et_metadata(
+        totem_path, PLANS_DE_COMPTE_PATH, output
+    )
+
+    assert metadata == attendu_metadata
+    assert output.getvalue() == attendu_csv.getvalue()
+
+
+def test_conversion_et_metadata_mauvais_siret(_convertisseur: ConvertisseurTotemBudget):
+    totem_filep = EXTRACT_METADATA_PATH / "totem_mauvais_siret.xml"
+    output = io.StringIO()
+
+    with pytest.raises(ExtractionMetadataErreur) as err:
+        _convertisseur.totem_budget_vers_scdl_et_metadata(totem_filep, PLANS_DE_COMPTE_PATH, output)
+
+    assert type(err.value.__cause__) is SiretInvalideErreur
+    assert output.getvalue() == ""
+
+
+def test_conversion_et_metadata_mauvaise_nomenclature(_convertisseur: ConvertisseurTotemBudget):
+    totem_filep = EXTRACT_METADATA_PATH / "totem_mauvaise_nomenclature.xml"
+    output = io.StringIO()
+
+    metadata = _convertisseur.totem_budget_vers_scdl_et_metadata(
+        totem_filep, PLANS_DE_COMPTE_PATH, output, Options(inclure_header_csv=False)
+    )
+
+    assert metadata == _convertisseur.totem_budget_metadata(totem_filep, PLANS_DE_COMPTE_PATH)
+    assert metadata.plan_de_compte is None
+
+
+def _metadata_sax(totem_path: Path) -> TotemMetadataHandler:
+    handler = TotemMetadataHandler()
+    try:
+        xml.sax.parse(str(totem_path), handler)
+    except FinishedParsing:
+        pass
+    return handler
+
+
+@pytest.mark.parametrize(
+    "totem_path",
+    [d / "totem.xml" for d in examples_directories() if isdir(d) and (d / "totem.xml").exists()]
+    + sorted(EXTRACT_METADATA_PATH.glob("*.xml")),
+)
+def test_iterparse_identique_sax(totem_path: Path):
+    handler = _metadata_sax(totem_path)
+
+    assert _lire_metadata(totem_path) == [
+        handler.nomenclature,
+        handler.code_etape,
+        handler.id_etab,
+        handler.annee,
+        handler.scellement_date,
+    ]
+
+
+@pytest.mark.parametrize(
+    "totem_path",
+    [d / "totem.xml" for d in examples_directories() if isdir(d) and (d / "totem.xml").exists()]
+    + sorted(EXTRACT_METADATA_PATH.glob("*.xml")),
+)
+def test_lecture_sans_lxml_identique(totem_path: Path):
+    assert _lire_valeurs_metadata(totem_path) == _lire_metadata(totem_path)
+
+
+@pytest.mark.parametrize(
+    "totem_path",
+    [d / "totem.xml" for d in examples_directories() if isdir(d) and (d / "totem.xml").exists()],
+)
+def test_lire_totem_budget_metadata(_convertisseur: ConvertisseurTotemBudget, totem_path: Path):
+    assert lire_totem_budget_metadata(
+        totem_path, PLANS_DE_COMPTE_PATH
+    ) == _convertisseur.totem_budget_metadata(totem_path, PLANS_DE_COMPTE_PATH)
+
+
+def test_lire_totem_budget_metadata_mauvaise_etape():
+    with pytest.raises(ExtractionMetadataErreur) as err:
+        lire_totem_budget_metadata(
+            EXTRACT_METADATA_PATH / "totem_mauvaise_etape.xml", PLANS_DE_COMPTE_PATH
+        )
+    assert isinstance(err.value.__cause__, EtapeBudgetaireInconnueErreur)
+
+
+def test_metadata_sans_scellement_arret_apres_entete(
+    _convertisseur: ConvertisseurTotemBudget, tmp_path: Path
+):
+    # Sans Scellement, la lecture doit s'arrêter après le BlocBudget:
+    # la suite du fichier, invalide, n'est jamais lue.
+    totem_filep = tmp_path / "totem.xml"
+    totem_filep.write_text(
+        '<DocumentBudgetaire xmlns="http://www.minefi.gouv.fr/cp/demat/docbudgetaire">'
+        "<Budget>"
+        '<EnTeteBudget><IdEtab V="21560046100010"/><Nomenclature V="M14-M14_COM_SUP3500"/></EnTeteBudget>'
+        '<BlocBudget><NatDec V="09"/><Exer V="2021"/></BlocBudget>'
+        + " " * 10_000
+        + "<LigneBudget></Invalide>"
+    )
+
+    metadata = _convertisseur.totem_budget_metadata(totem_filep, PLANS_DE_COMPTE_PATH)
+
+    assert metadata.scellement is None
+    assert metadata.etape_budgetaire == EtapeBudgetaire.COMPTE_ADMIN
+    assert metadata.annee_exercice == 2021
+
+
+def test_metadata_balise_repetee(tmp_path: Path):
+    # Comme le lecteur SAX, la dernière occurrence d'une balise lue avant l'arrêt l'emporte
+    totem_filep = tmp_path / "totem.xml"
+    totem_filep.write_text(
+        '<DocumentBudgetaire xmlns="http://www.minefi.gouv.fr/cp/demat/docbudgetaire">'
+        "<Budget>"
+        '<EnTeteBudget><IdEtab V="11111111111111"/><IdEtab V="21560046100010"/>'
+        '<Nomenclature V="M14-M14_COM_SUP3500"/></EnTeteBudget>'
+        '<BlocBudget><NatDec V="01"/><Exer V="2021"/><NatDec V="09"/><Scellement date="2022-03-01"/></BlocBudget>'
+        "</Budget></DocumentBudgetaire>"
+    )
+    handler = _metadata_sax(totem_filep)
+    attendu = [
+        handler.nomenclature,
+        handler.code_etape,
+        handler.id_etab,
+        handler.annee,
+        handler.scellement_date,
+    ]
+
+    assert attendu == ["M14-M14_COM_SUP3500", "09", "21560046100010", "2021", "2022-03-01"]
+    assert _lire_metadata(totem_filep) == attendu
+    assert _lire_valeurs_metadata(totem_filep) == attendu
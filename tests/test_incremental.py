@@ -0,0 +1,128 @@
+import csv
+import io
+from pathlib import Path
+
+import pytest
+from lxml import etree
+
+from yatotem2scdl import (
+    ConversionErreur,
+    ConvertisseurTotemBudget,
+    DocumentIncremental,
+    OperationDelta,
+    ResultatIncremental,
+)
+from yatotem2scdl.incremental import COLONNE_DELTA, difference_lignes
+from yatotem2scdl.scdl import COLONNES_SCDL_BUDGET
+
+from data import EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+_ETABLISSEMENT = "DOCBUDG-21560046100085-056025"
+_BP = EXEMPLES_PATH / f"{_ETABLISSEMENT}-BP-2022-07042022000000" / "totem.xml"
+_DM1 = EXEMPLES_PATH / f"{_ETABLISSEMENT}-DM1-2022-05072022000000" / "totem.xml"
+_CA_2021 = EXEMPLES_PATH / f"{_ETABLISSEMENT}-CA-2021-01032022000000" / "totem.xml"
+
+_NS = "{http://www.minefi.gouv.fr/cp/demat/docbudgetaire}"
+
+
+def _incremental(totem_fpath, precedent_fpath) -> tuple[ResultatIncremental, list[dict], str]:
+    delta = io.StringIO(newline="")
+    complet = io.StringIO(newline="")
+    resultat = ConvertisseurTotemBudget().totem_budget_vers_scdl_incremental(
+        totem_fpath, precedent_fpath, PLANS_DE_COMPTE_PATH, delta, complet
+    )
+    return resultat, list(csv.DictReader(io.StringIO(delta.getvalue(), newline=""))), complet.getvalue()
+
+
+def _attendu(totem_fpath) -> str:
+    output = io.StringIO(newline="")
+    ConvertisseurTotemBudget().totem_budget_vers_scdl(totem_fpath, PLANS_DE_COMPTE_PATH, output)
+    return output.getvalue()
+
+
+def test_primitif_vers_decision_modificative():
+    resultat, delta, complet = _incremental(_DM1, _BP)
+
+    assert complet == (_DM1.parent / "expected.csv").read_bytes().decode("utf-8")
+    assert resultat.ajouts + resultat.modifications + resultat.inchangees == len(complet.splitlines()) - 1
+    assert len(delta) == resultat.lignes_delta
+    assert {ligne[COLONNE_DELTA] for ligne in delta} <= {o.value for o in OperationDelta}
+    # Les lignes supprimées portent l'entête du document précédent
+    for ligne in delta:
+        attendu = "Budget primitif" if ligne[COLONNE_DELTA] == "suppression" else "Décision modificative"
+        assert ligne["BGT_NATDEC"] == attendu
+
+
+def test_lignes_changees(tmp_path: Path):
+    tree = etree.parse(str(_BP))
+    lignes = tree.findall(f".//{_NS}LigneBudget")
+    lignes[0].find(f"{_NS}MtPrev").set("V", "123456.78")
+    supprimee = lignes[1]
+    supprimee.getparent().remove(supprimee)
+    ajoutee = etree.fromstring(etree.tostring(lignes[2]))
+    ajoutee.find(f"{_NS}Nature").set("V", "6042")
+    lignes[2].addnext(ajoutee)
+    modifie_fpath = tmp_path / "totem.xml"
+    tree.write(str(modifie_fpath), xml_declaration=True, encoding="utf-8")
+
+    resultat, delta, complet = _incremental(modifie_fpath, _BP)
+
+    nb_lignes = len(_attendu(_BP).splitlines()) - 1
+    assert resultat == ResultatIncremental(
+        ajouts=1, modifications=1, suppressions=1, inchangees=nb_lignes - 2
+    )
+    assert [ligne[COLONNE_DELTA] for ligne in delta] == ["modification", "ajout", "suppression"]
+    assert delta[0]["BGT_MTPREV"] == "123456.78"
+    assert delta[1]["BGT_NATURE"] == "6042"
+    assert list(delta[0])[1:] == COLONNES_SCDL_BUDGET
+    assert complet == _attendu(modifie_fpath)
+
+
+def test_document_identique():
+    resultat, delta, complet = _incremental(_BP, _BP)
+
+    assert resultat.lignes_delta == 0
+    assert delta == []
+    assert complet == _attendu(_BP)
+
+
+def test_exercices_differents():
+    with pytest.raises(ConversionErreur):
+        _incremental(_BP, _CA_2021)
+
+
+def test_document_precedent_deja_lu():
+    resultat_bp, _, _ = _incremental(_BP, _BP)
+    assert isinstance(resultat_bp.document, DocumentIncremental)
+
+    attendu, delta_attendu, complet_attendu = _incremental(_DM1, _BP)
+    resultat, delta, complet = _incremental(_DM1, resultat_bp.document)
+
+    assert resultat == attendu
+    assert delta == delta_attendu
+    assert complet == complet_attendu
+
+
+@pytest.mark.parametrize("balise", ["IdEtab", "Exer"])
+def test_document_sans_etablissement_ou_exercice(tmp_path: Path, balise: str):
+    tree = etree.parse(str(_BP))
+    element = tree.find(f".//{_NS}{balise}")
+    element.getparent().remove(element)
+    modifie_fpath = tmp_path / "totem.xml"
+    tree.write(str(modifie_fpath), xml_declaration=True, encoding="utf-8")
+
+    with pytest.raises(ConversionErreur, match="établissement ou son exercice"):
+        _incremental(modifie_fpath, modifie_fpath)
+
+
+def test_lignes_de_meme_identite():
+    def ligne(mtprev: str) -> dict[str, str]:
+        return {f"{_NS}Nature": "6042", f"{_NS}CodRD": "D", f"{_NS}MtPrev": mtprev}
+
+    precedentes = [ligne("1"), ligne("2"), ligne("3")]
+    nouvelles = [ligne("3"), ligne("1"), ligne("4")]
+
+    operations, supprimees = difference_lignes(precedentes, nouvelles)
+
+    assert operations == [None, None, OperationDelta.MODIFICATION]
+    assert supprimees == []
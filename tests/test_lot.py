@@ -0,0 +1,180 @@
+import os
+import pickle
+import signal
+from concurrent.futures.process import BrokenProcessPool
+from os.path import isdir
+from pathlib import Path
+
+import pytest
+
+from yatotem2scdl import lot
+from yatotem2scdl import (
+    CacheMetadata,
+    ConvertisseurTotemBudget,
+    convertir_lot,
+    metadata_lot,
+    ExtractionMetadataErreur,
+    NomenclatureInvalideErreur,
+    SiretInvalideErreur,
+)
+
+from data import A_LA_MARGE_PATH, EXTRACT_METADATA_PATH, PLANS_DE_COMPTE_PATH
+from data import examples_directories
+
+_CONVERTIR_WORKER = lot._convertir_worker
+
+_EXEMPLES = [
+    d
+    for d in examples_directories()
+    if isdir(d)
+    and (d / "totem.xml").exists()
+    and not (d / "totem2xmlcsv-custom.xsl").exists()
+    and not (d / "convert-options.json").exists()
+]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_convertir_lot(tmp_path: Path, workers: int):
+    totem_fpaths = [d / "totem.xml" for d in _EXEMPLES] + [A_LA_MARGE_PATH / "mauvais_totem.xml"]
+    progression = []
+
+    resultats = convertir_lot(
+        totem_fpaths,
+        PLANS_DE_COMPTE_PATH,
+        tmp_path,
+        workers=workers,
+        nom_csv=lambda p: f"{p.parent.name}-{p.stem}.csv",
+        progression=progression.append,
+    )
+
+    assert [r.totem_fpath for r in resultats] == totem_fpaths
+    assert len(progression) == len(totem_fpaths)
+
+    *succes, echec = resultats
+    for resultat in succes:
+        assert resultat.succes, resultat.erreur
+        attendu = resultat.totem_fpath.parent / "expected.csv"
+        assert resultat.csv_fpath.read_bytes() == attendu.read_bytes()
+
+    assert not echec.succes
+    assert echec.csv_fpath is None
+    assert not (tmp_path / "data_alamarge-mauvais_totem.csv").exists()
+
+
+def _convertir_ou_tuer(totem_fpath: Path, *args):
+    # Simule un processus tué par le système (manque de mémoire) pendant la conversion
+    if totem_fpath.name == "tue.xml":
+        os.kill(os.getpid(), signal.SIGKILL)
+    return _CONVERTIR_WORKER(totem_fpath, *args)
+
+
+def test_convertir_lot_processus_tue(tmp_path: Path, monkeypatch):
+    monkeypatch.setattr(lot, "_convertir_worker", _convertir_ou_tuer)
+    tue_fpath = tmp_path / "tue.xml"
+    tue_fpath.write_bytes((_EXEMPLES[0] / "totem.xml").read_bytes())
+    totem_fpaths = [d / "totem.xml" for d in _EXEMPLES]
+    totem_fpaths.insert(1, tue_fpath)
+    vus = []
+
+    resultats = convertir_lot(
+        totem_fpaths,
+        PLANS_DE_COMPTE_PATH,
+        tmp_path / "scdl",
+        workers=2,
+        nom_csv=lambda p: f"{p.parent.name}-{p.name}.csv",
+        progression=vus.append,
+    )
+
+    assert [r.totem_fpath for r in resultats] == totem_fpaths
+    assert sorted(map(id, vus)) == sorted(map(id, resultats))
+    [echec] = [r for r in resultats if not r.succes]
+    assert echec.totem_fpath == tue_fpath
+    assert isinstance(echec.erreur, BrokenProcessPool)
+    for resultat in resultats:
+        if resultat.succes:
+            assert resultat.csv_fpath.read_bytes() == (resultat.totem_fpath.parent / "expected.csv").read_bytes()
+
+
+def test_convertir_lot_noms_dupliques(tmp_path: Path):
+    with pytest.raises(ValueError):
+        convertir_lot(
+            [d / "totem.xml" for d in _EXEMPLES], PLANS_DE_COMPTE_PATH, tmp_path, workers=1
+        )
+
+
+def test_erreurs_picklables():
+    for err in [
+        SiretInvalideErreur("123"),
+        NomenclatureInvalideErreur("M14-M14", PLANS_DE_COMPTE_PATH),
+    ]:
+        copie = pickle.loads(pickle.dumps(err))
+        assert type(copie) is type(err)
+        assert str(copie) == str(err)
+
+
+def _fichiers_metadata() -> list[Path]:
+    return [d / "totem.xml" for d in _EXEMPLES] + sorted(EXTRACT_METADATA_PATH.glob("*.xml"))
+
+
+def _metadata_attendue(totem_fpath: Path):
+    try:
+        return ConvertisseurTotemBudget().totem_budget_metadata(totem_fpath, PLANS_DE_COMPTE_PATH)
+    except ExtractionMetadataErreur:
+        return None
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_metadata_lot(workers: int):
+    totem_fpaths = _fichiers_metadata() * 20
+
+    resultats = list(metadata_lot(totem_fpaths, PLANS_DE_COMPTE_PATH, workers=workers))
+
+    assert [r.totem_fpath for r in resultats] == totem_fpaths
+    for resultat in resultats:
+        assert resultat.metadata == _metadata_attendue(resultat.totem_fpath)
+        assert resultat.succes == (resultat.metadata is not None)
+        if not resultat.succes:
+            assert isinstance(resultat.erreur, ExtractionMetadataErreur)
+
+
+def test_metadata_lot_petit_lot(monkeypatch):
+    # Même un petit lot est réparti sur le nombre de processus demandé
+    pools = []
+
+    class _Pool(lot.ProcessPoolExecutor):
+        def __init__(self, max_workers):
+            pools.append(max_workers)
+            super().__init__(max_workers=max_workers)
+
+    monkeypatch.setattr(lot, "ProcessPoolExecutor", _Pool)
+    totem_fpaths = _fichiers_metadata()[:3]
+
+    resultats = list(metadata_lot(totem_fpaths, PLANS_DE_COMPTE_PATH, workers=2))
+
+    assert pools == [2]
+    assert [r.metadata for r in resultats] == [_metadata_attendue(p) for p in totem_fpaths]
+
+
+def test_metadata_lot_cache(tmp_path: Path):
+    totem_fpaths = []
+    for fpath in _fichiers_metadata():
+        copie = tmp_path / f"{fpath.parent.name}-{fpath.name}"
+        copie.write_bytes(fpath.read_bytes())
+        totem_fpaths.append(copie)
+
+    with CacheMetadata(tmp_path / "cache.sqlite") as cache:
+        premier = list(metadata_lot(totem_fpaths, PLANS_DE_COMPTE_PATH, workers=1, cache=cache))
+        assert (cache.hits, cache.misses) == (0, len(totem_fpaths))
+        assert len(cache) == len(totem_fpaths)
+
+    with CacheMetadata(tmp_path / "cache.sqlite") as cache:
+        second = list(metadata_lot(totem_fpaths, PLANS_DE_COMPTE_PATH, workers=1, cache=cache))
+        assert cache.hits == len(totem_fpaths)
+
+        assert [r.metadata for r in second] == [r.metadata for r in premier]
+        assert [str(r.erreur) for r in second] == [str(r.erreur) for r in premier]
+
+        # Un fichier modifié est relu
+        totem_fpaths[0].write_bytes(totem_fpaths[0].read_bytes() + b"\n")
+        list(metadata_lot(totem_fpaths[:1], PLANS_DE_COMPTE_PATH, workers=1, cache=cache))
+        assert cache.misses == 1
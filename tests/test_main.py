@@ -0,0 +1,182 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from lxml import etree
+
+from yatotem2scdl.main import main
+
+from data import A_LA_MARGE_PATH, EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+
+def _main(monkeypatch, *args: str, commande: str = "budget") -> int:
+    monkeypatch.setattr(sys, "argv", ["yatotem2scdl", commande, *args])
+    with pytest.raises(SystemExit) as exit_info:
+        main()
+    return exit_info.value.code
+
+
+def test_lot_glob(monkeypatch, tmp_path: Path):
+    glob = str(EXEMPLES_PATH / "DOCBUDG-21560046100085-*" / "totem.xml")
+
+    status = _main(
+        monkeypatch,
+        glob,
+        "--plans-de-comptes", str(PLANS_DE_COMPTE_PATH),
+        "--output-dir", str(tmp_path),
+        "--jobs", "2",
+    )
+
+    assert status == 0
+    csv_fpaths = sorted(tmp_path.iterdir())
+    assert [p.name for p in csv_fpaths] == [
+        "DOCBUDG-21560046100085-056025-BP-2022-07042022000000-totem.csv",
+        "DOCBUDG-21560046100085-056025-CA-2021-01032022000000-totem.csv",
+        "DOCBUDG-21560046100085-056025-DM1-2022-05072022000000-totem.csv",
+    ]
+    for csv_fpath in csv_fpaths:
+        attendu = EXEMPLES_PATH / csv_fpath.stem[: -len("-totem")] / "expected.csv"
+        assert csv_fpath.read_bytes() == attendu.read_bytes()
+
+
+def test_lot_dossier_avec_echec(monkeypatch, tmp_path: Path, capsys):
+    status = _main(
+        monkeypatch,
+        str(A_LA_MARGE_PATH),
+        "--plans-de-comptes", str(PLANS_DE_COMPTE_PATH),
+        "--output-dir", str(tmp_path),
+        "--jobs", "1",
+    )
+
+    assert status != 0
+    assert (tmp_path / "totem.csv").exists()
+    assert not (tmp_path / "mauvais_totem.csv").exists()
+    assert "1/2 fichiers convertis" in capsys.readouterr().err
+
+
+def test_lot_metriques(monkeypatch, tmp_path: Path):
+    metriques_fpath = tmp_path / "yatotem2scdl.prom"
+
+    status = _main(
+        monkeypatch,
+        str(A_LA_MARGE_PATH),
+        "--plans-de-comptes", str(PLANS_DE_COMPTE_PATH),
+        "--output-dir", str(tmp_path / "scdl"),
+        "--jobs", "2",
+        "--metriques", str(metriques_fpath),
+    )
+
+    assert status != 0
+    texte = metriques_fpath.read_text(encoding="utf-8")
+    assert 'yatotem2scdl_operations_total{operation="conversion",resultat="succes"} 1\n' in texte
+    assert 'yatotem2scdl_operations_total{operation="conversion",resultat="echec"} 1\n' in texte
+
+
+def test_dossier_sans_output_dir(monkeypatch):
+    status = _main(
+        monkeypatch, str(A_LA_MARGE_PATH), "--plans-de-comptes", str(PLANS_DE_COMPTE_PATH)
+    )
+
+    assert status != 0
+
+
+def test_incremental(monkeypatch, tmp_path: Path, capsys):
+    bp = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000"
+    dm1 = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-DM1-2022-05072022000000"
+    delta_fpath = tmp_path / "delta.csv"
+
+    status = _main(
+        monkeypatch,
+        str(dm1 / "totem.xml"),
+        "--plans-de-comptes", str(PLANS_DE_COMPTE_PATH),
+        "--precedent", str(bp / "totem.xml"),
+        "--delta", str(delta_fpath),
+    )
+
+    assert status == 0
+    sortie = capsys.readouterr()
+    assert sortie.out.splitlines() == (dm1 / "expected.csv").read_text(encoding="utf-8").splitlines()
+    assert "ajouts" in sortie.err
+    assert delta_fpath.read_text(encoding="utf-8").startswith("DELTA,BGT_NATDEC,")
+
+
+def test_enveloppe_par_document(monkeypatch, tmp_path: Path, capsys):
+    bp = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000"
+    ca = EXEMPLES_PATH / "DOCBUDG-21560046100010-056025-CA-2021-01032022000000"
+    racine = etree.Element("Enveloppe")
+    for dpath in (bp, ca):
+        racine.append(etree.parse(str(dpath / "totem.xml")).getroot())
+    enveloppe_fpath = tmp_path / "enveloppe.xml"
+    etree.ElementTree(racine).write(str(enveloppe_fpath), encoding="utf-8")
+
+    status = _main(
+        monkeypatch,
+        str(enveloppe_fpath),
+        "--plans-de-comptes", str(PLANS_DE_COMPTE_PATH),
+        "--output-dir", str(tmp_path / "scdl"),
+        "--enveloppe",
+    )
+
+    assert status == 0
+    assert (tmp_path / "scdl" / "000-21560046100085.csv").read_bytes() == (bp / "expected.csv").read_bytes()
+    assert (tmp_path / "scdl" / "001-21560046100010.csv").read_bytes() == (ca / "expected.csv").read_bytes()
+    assert "Document 1 (21560046100010)" in capsys.readouterr().err
+
+
+def test_export_partitionne(monkeypatch, tmp_path: Path):
+    glob = str(EXEMPLES_PATH / "DOCBUDG-21560046100085-*" / "totem.xml")
+
+    status = _main(
+        monkeypatch,
+        glob,
+        "--plans-de-comptes", str(PLANS_DE_COMPTE_PATH),
+        "--output-dir", str(tmp_path),
+        "--partitions-lignes", "50",
+    )
+
+    assert status == 0
+    manifeste = json.loads((tmp_path / "manifeste.json").read_text(encoding="utf-8"))
+    attendu = sum(
+        len((p.parent / "expected.csv").read_bytes().splitlines()) - 1
+        for p in EXEMPLES_PATH.glob("DOCBUDG-21560046100085-*/totem.xml")
+    )
+    assert sum(partition["lignes"] for partition in manifeste["partitions"]) == attendu
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        ["manifeste.json", *(partition["fichier"] for partition in manifeste["partitions"])]
+    )
+
+
+def test_metadata(monkeypatch, capsys):
+    status = _main(
+        monkeypatch,
+        str(A_LA_MARGE_PATH),
+        "--plans-de-comptes", str(PLANS_DE_COMPTE_PATH),
+        commande="metadata",
+    )
+
+    assert status != 0
+    lignes = [json.loads(ligne) for ligne in capsys.readouterr().out.splitlines()]
+    assert [Path(ligne["fichier"]).name for ligne in lignes] == ["mauvais_totem.xml", "totem.xml"]
+    assert "erreur" in lignes[0]
+    assert lignes[1]["annee_exercice"] == 2022
+    assert lignes[1]["etape_budgetaire"] == "PRIMITIF"
+    assert lignes[1]["plan_de_compte"].endswith("planDeCompte.xml")
+
+
+def test_metadata_sans_lxml():
+    # Le démarrage de la commande metadata ne doit charger ni lxml ni la conversion
+    code = (
+        "import sys\n"
+        "from yatotem2scdl.main import main\n"
+        f"sys.argv = ['yatotem2scdl', 'metadata', {str(A_LA_MARGE_PATH / 'totem.xml')!r},"
+        f" '--plans-de-comptes', {str(PLANS_DE_COMPTE_PATH)!r}]\n"
+        "try:\n"
+        "    main()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "charges = [m for m in sys.modules if m.startswith(('lxml', 'yatotem2scdl.conversion'))]\n"
+        "assert charges == [], charges\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True, capture_output=True)
@@ -0,0 +1,153 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pytest
+
+from yatotem2scdl import (
+    CacheScdl,
+    ConversionErreur,
+    ConvertisseurTotemBudget,
+    MesureConversion,
+    MetriquesConversion,
+    MoteurConversion,
+    Options,
+    convertir_lot,
+)
+
+from data import EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+_PETIT = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000" / "totem.xml"
+_GRAND = EXEMPLES_PATH / "DOCBUDG-21560046100010-056025-CA-2021-01032022000000" / "totem.xml"
+
+
+def _nb_lignes(totem_fpath: Path) -> int:
+    expected = (totem_fpath.parent / "expected.csv").read_bytes().decode("utf-8")
+    return len(expected.splitlines()) - 1
+
+
+def _convertir(convertisseur: ConvertisseurTotemBudget, totem_fpath: Path, options: Options = Options()):
+    convertisseur.totem_budget_vers_scdl(totem_fpath, PLANS_DE_COMPTE_PATH, io.StringIO(newline=""), options)
+
+
+def _mesures() -> tuple[MetriquesConversion, list[MesureConversion]]:
+    mesures: list[MesureConversion] = []
+    return MetriquesConversion(observateur=mesures.append), mesures
+
+
+@pytest.mark.parametrize(
+    "moteur, options, phases",
+    [
+        (MoteurConversion.XSLT, Options(), {"parse", "plan_de_compte", "xslt", "ecriture"}),
+        (MoteurConversion.NATIF, Options(), {"parse", "plan_de_compte", "ecriture"}),
+        (MoteurConversion.XSLT, Options(streaming=True), {"flux"}),
+    ],
+)
+def test_mesure_conversion(moteur: MoteurConversion, options: Options, phases: set):
+    metriques, mesures = _mesures()
+
+    _convertir(ConvertisseurTotemBudget(moteur=moteur, metriques=metriques), _GRAND, options)
+
+    [mesure] = mesures
+    assert mesure.operation == "conversion"
+    assert mesure.erreur is None
+    assert set(mesure.phases) == phases
+    assert all(duree > 0 for duree in mesure.phases.values())
+    assert mesure.octets_entree == _GRAND.stat().st_size
+    assert mesure.lignes == _nb_lignes(_GRAND)
+
+
+def test_cache_plan_de_compte():
+    metriques, mesures = _mesures()
+    convertisseur = ConvertisseurTotemBudget(metriques=metriques)
+
+    _convertir(convertisseur, _GRAND)
+    _convertir(convertisseur, _GRAND)
+
+    assert mesures[0].cache_misses == {"plan_de_compte": 1}
+    assert mesures[1].cache_misses == {}
+    assert mesures[1].cache_hits["plan_de_compte"] > 0
+
+
+def test_cache_scdl(tmp_path: Path):
+    metriques, mesures = _mesures()
+    convertisseur = ConvertisseurTotemBudget(cache_scdl=CacheScdl(tmp_path), metriques=metriques)
+
+    _convertir(convertisseur, _PETIT)
+    _convertir(convertisseur, _PETIT)
+
+    assert mesures[0].cache_misses["scdl"] == 1
+    assert mesures[0].lignes == _nb_lignes(_PETIT)
+    assert mesures[1].cache_hits == {"scdl": 1}
+    assert set(mesures[1].phases) == {"cle_cache_scdl", "cache_scdl"}
+
+
+def test_mesure_metadata():
+    metriques, mesures = _mesures()
+
+    ConvertisseurTotemBudget(metriques=metriques).totem_budget_metadata(_PETIT, PLANS_DE_COMPTE_PATH)
+
+    [mesure] = mesures
+    assert mesure.operation == "metadata"
+    assert set(mesure.phases) == {"lecture", "plan_de_compte"}
+    assert mesure.lignes == 0
+
+
+def test_mesure_erreur():
+    metriques, mesures = _mesures()
+
+    with pytest.raises(ConversionErreur):
+        _convertir(ConvertisseurTotemBudget(metriques=metriques), b"<pas du totem")
+
+    [mesure] = mesures
+    assert mesure.erreur == "ConversionErreur"
+    assert mesure.octets_entree == len(b"<pas du totem")
+    assert 'yatotem2scdl_operations_total{operation="conversion",resultat="echec"} 1\n' in metriques.prometheus()
+
+
+def test_threads_mesures_separees():
+    metriques, mesures = _mesures()
+    convertisseur = ConvertisseurTotemBudget(metriques=metriques)
+    totem_fpaths = [_PETIT, _GRAND] * 4
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda p: _convertir(convertisseur, p), totem_fpaths))
+
+    assert sorted(m.lignes for m in mesures) == sorted(_nb_lignes(p) for p in totem_fpaths)
+
+
+def test_prometheus(tmp_path: Path):
+    metriques, _ = _mesures()
+    convertisseur = ConvertisseurTotemBudget(metriques=metriques)
+    _convertir(convertisseur, _PETIT)
+    _convertir(convertisseur, _GRAND)
+
+    fpath = tmp_path / "yatotem2scdl.prom"
+    metriques.ecrire_prometheus(fpath)
+
+    texte = fpath.read_text(encoding="utf-8")
+    assert texte == metriques.prometheus()
+    assert "# TYPE yatotem2scdl_phase_duree_secondes summary\n" in texte
+    assert 'yatotem2scdl_phase_duree_secondes_count{operation="conversion",phase="xslt"} 2\n' in texte
+    total_octets = _PETIT.stat().st_size + _GRAND.stat().st_size
+    assert f'yatotem2scdl_entree_octets_total{{operation="conversion"}} {total_octets}\n' in texte
+    total_lignes = _nb_lignes(_PETIT) + _nb_lignes(_GRAND)
+    assert f'yatotem2scdl_lignes_scdl_total{{operation="conversion"}} {total_lignes}\n' in texte
+    assert list(tmp_path.iterdir()) == [fpath]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_lot(tmp_path: Path, workers: int):
+    metriques, mesures = _mesures()
+
+    resultats = convertir_lot(
+        [_PETIT, _GRAND],
+        PLANS_DE_COMPTE_PATH,
+        tmp_path,
+        workers=workers,
+        nom_csv=lambda p: f"{p.parent.name}.csv",
+        metriques=metriques,
+    )
+
+    assert [r.mesure.lignes for r in resultats] == [_nb_lignes(_PETIT), _nb_lignes(_GRAND)]
+    assert len(mesures) == 2
@@ -0,0 +1,87 @@
+"""Les moteurs XSLT et natif doivent produire exactement le même SCDL"""
+
+import io
+import json
+from os.path import isdir
+from pathlib import Path
+
+import pytest
+
+from yatotem2scdl import ConvertisseurTotemBudget, MoteurConversion, Options
+
+from data import A_LA_MARGE_PATH, PLANS_DE_COMPTE_PATH
+from data import examples_directories
+
+
+def _convertir(moteur: MoteurConversion, totem_path: Path, pdcs_dpath: Path, options: Options) -> str:
+    convertisseur = ConvertisseurTotemBudget(moteur=moteur)
+    output = io.StringIO()
+    convertisseur.totem_budget_vers_scdl(
+        totem_fpath=totem_path, pdcs_dpath=pdcs_dpath, output=output, options=options
+    )
+    return output.getvalue()
+
+
+def _options(exemple_dpath: Path) -> Options:
+    options = Options()
+    convert_options_conf = exemple_dpath / "convert-options.json"
+    if convert_options_conf.exists():
+        with convert_options_conf.open("r") as f:
+            options.__dict__.update(json.load(f))
+    return options
+
+
+@pytest.mark.parametrize(
+    "totem_path",
+    [
+        d / "totem.xml"
+        for d in examples_directories()
+        if isdir(d)
+        and (d / "totem.xml").exists()
+        # Le moteur natif reproduit uniquement la XSLT par défaut
+        and not (d / "totem2xmlcsv-custom.xsl").exists()
+    ],
+)
+def test_moteurs_identiques(totem_path: Path):
+    options = _options(totem_path.parent)
+
+    attendu = _convertir(MoteurConversion.XSLT, totem_path, PLANS_DE_COMPTE_PATH, options)
+    candidat = _convertir(MoteurConversion.NATIF, totem_path, PLANS_DE_COMPTE_PATH, options)
+
+    assert candidat.encode("utf-8") == attendu.encode("utf-8")
+
+
+def test_moteurs_identiques_sans_pdc():
+    totem_path = A_LA_MARGE_PATH / "totem.xml"
+    pdcs_dpath = PLANS_DE_COMPTE_PATH / "wrong"
+    options = Options(inclure_header_csv=False)
+
+    attendu = _convertir(MoteurConversion.XSLT, totem_path, pdcs_dpath, options)
+    candidat = _convertir(MoteurConversion.NATIF, totem_path, pdcs_dpath, options)
+
+    assert candidat == attendu
+
+
+def test_moteur_natif_refuse_xslt_custom(tmp_path: Path):
+    with pytest.raises(ValueError):
+        ConvertisseurTotemBudget(xslt_budget=tmp_path / "custom.xsl", moteur=MoteurConversion.NATIF)
+
+
+@pytest.mark.parametrize(
+    "totem_path",
+    [
+        d / "totem.xml"
+        for d in examples_directories()
+        if isdir(d)
+        and (d / "totem.xml").exists()
+        and not (d / "totem2xmlcsv-custom.xsl").exists()
+    ],
+)
+def test_streaming_identique(totem_path: Path):
+    options = _options(totem_path.parent)
+    attendu = _convertir(MoteurConversion.XSLT, totem_path, PLANS_DE_COMPTE_PATH, options)
+
+    options.streaming = True
+    candidat = _convertir(MoteurConversion.XSLT, totem_path, PLANS_DE_COMPTE_PATH, options)
+
+    assert candidat.encode("utf-8") == attendu.encode("utf-8")
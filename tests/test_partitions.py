@@ -0,0 +1,117 @@
+import csv
+import gzip
+import hashlib
+import io
+from pathlib import Path
+
+import pytest
+
+from yatotem2scdl import (
+    ConversionErreur,
+    ConvertisseurTotemBudget,
+    FormatSortie,
+    ManifestePartitions,
+    MoteurConversion,
+    Options,
+    SortiePartitionnee,
+)
+from yatotem2scdl.partitions import NOM_MANIFESTE
+
+from data import EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+_PETIT = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000" / "totem.xml"
+_GRAND = EXEMPLES_PATH / "DOCBUDG-21560046100010-056025-CA-2021-01032022000000" / "totem.xml"
+
+
+def _attendu(totem_fpath: Path) -> list[list[str]]:
+    expected = (totem_fpath.parent / "expected.csv").read_bytes().decode("utf-8")
+    return list(csv.reader(io.StringIO(expected, newline="")))
+
+
+def _lignes_partitions(dpath: Path, manifeste: ManifestePartitions) -> list[list[str]]:
+    lignes = []
+    for partition in manifeste.partitions:
+        contenu = (dpath / partition.fichier).read_bytes()
+        assert len(contenu) == partition.octets
+        assert hashlib.sha256(contenu).hexdigest() == partition.sha256
+        if manifeste.format == FormatSortie.CSV_GZIP.value:
+            contenu = gzip.decompress(contenu)
+        [entete, *lignes_partition] = csv.reader(io.StringIO(contenu.decode("utf-8"), newline=""))
+        assert entete == manifeste.colonnes
+        assert len(lignes_partition) == partition.lignes
+        lignes.extend(lignes_partition)
+    return lignes
+
+
+@pytest.mark.parametrize("moteur", [MoteurConversion.XSLT, MoteurConversion.NATIF])
+def test_partitions_en_lignes(tmp_path: Path, moteur: MoteurConversion):
+    with SortiePartitionnee(tmp_path, lignes_max=100, workers=2) as sortie:
+        ConvertisseurTotemBudget(moteur=moteur).totem_budget_vers_scdl(_GRAND, PLANS_DE_COMPTE_PATH, sortie)
+
+    [entete, *attendues] = _attendu(_GRAND)
+    manifeste = ManifestePartitions.lire(tmp_path)
+    assert manifeste == sortie.manifeste
+    assert manifeste.colonnes == entete
+    assert manifeste.lignes == len(attendues)
+    assert len(manifeste.partitions) == -(-len(attendues) // 100)
+    assert all(partition.lignes == 100 for partition in manifeste.partitions[:-1])
+    assert _lignes_partitions(tmp_path, manifeste) == attendues
+
+
+def test_partitions_en_octets_compressees(tmp_path: Path):
+    options = Options(format_sortie=FormatSortie.CSV_GZIP)
+    with SortiePartitionnee(tmp_path, octets_max=16 * 1024) as sortie:
+        ConvertisseurTotemBudget().totem_budget_vers_scdl(_GRAND, PLANS_DE_COMPTE_PATH, sortie, options)
+
+    manifeste = ManifestePartitions.lire(tmp_path)
+    assert manifeste.format == "csv.gz"
+    assert len(manifeste.partitions) > 1
+    assert all(p.fichier.endswith(".csv.gz") for p in manifeste.partitions)
+    assert _lignes_partitions(tmp_path, manifeste) == _attendu(_GRAND)[1:]
+
+
+def test_export_consolide(tmp_path: Path):
+    convertisseur = ConvertisseurTotemBudget()
+    with SortiePartitionnee(tmp_path, lignes_max=1000) as sortie:
+        convertisseur.totem_budget_vers_scdl(_PETIT, PLANS_DE_COMPTE_PATH, sortie)
+        convertisseur.totem_budget_vers_scdl(_GRAND, PLANS_DE_COMPTE_PATH, sortie)
+
+    assert _lignes_partitions(tmp_path, sortie.manifeste) == _attendu(_PETIT)[1:] + _attendu(_GRAND)[1:]
+
+
+def test_sans_ligne(tmp_path: Path):
+    options = Options(inclure_header_csv=True)
+    with SortiePartitionnee(tmp_path, lignes_max=10) as sortie:
+        sortie.ecrire_lignes(["A", "B"], [], options)
+
+    [partition] = sortie.manifeste.partitions
+    assert partition.lignes == 0
+    assert (tmp_path / partition.fichier).read_bytes() == b"A,B\r\n"
+
+
+def test_erreur_supprime_les_partitions(tmp_path: Path):
+    def lignes():
+        for i in range(25):
+            yield [str(i)]
+        raise ConversionErreur("erreur au milieu des lignes")
+
+    with pytest.raises(ConversionErreur):
+        with SortiePartitionnee(tmp_path, lignes_max=10) as sortie:
+            sortie.ecrire_lignes(["A"], lignes(), Options())
+
+    assert list(tmp_path.iterdir()) == []
+    assert sortie.manifeste is None
+
+
+def test_colonnes_differentes(tmp_path: Path):
+    with pytest.raises(ConversionErreur):
+        with SortiePartitionnee(tmp_path, lignes_max=10) as sortie:
+            sortie.ecrire_lignes(["A"], [["1"]], Options())
+            sortie.ecrire_lignes(["B"], [["2"]], Options())
+
+    assert not (tmp_path / NOM_MANIFESTE).exists()
+
+
+def test_bornes_obligatoires(tmp_path: Path):
+    with pytest.raises(ValueError):
+        SortiePartitionnee(tmp_path)
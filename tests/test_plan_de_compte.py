@@ -0,0 +1,133 @@
+import io
+from os.path import isdir
+from pathlib import Path
+
+import pytest
+from lxml import etree
+
+from yatotem2scdl import (
+    CachePlansDeComptes,
+    ConvertisseurTotemBudget,
+    MoteurConversion,
+    Options,
+    PlansDeComptesCompiles,
+    compiler_plans_de_comptes,
+)
+from yatotem2scdl.conversion import _BUDGET_XSLT, _xml_to_csv
+
+from data import A_LA_MARGE_PATH, EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+from data import examples_directories
+
+_PDC_M14 = PLANS_DE_COMPTE_PATH / "2022" / "M14" / "M14_COM_500_3500" / "planDeCompte.xml"
+_PDC_M57 = PLANS_DE_COMPTE_PATH / "2022" / "M57" / "M57" / "planDeCompte.xml"
+_PDC_M4 = PLANS_DE_COMPTE_PATH / "2022" / "M4" / "M4" / "planDeCompte.xml"
+
+
+def test_cache_lru():
+    cache = CachePlansDeComptes(taille_max=2)
+
+    m14 = cache.plan_de_compte(_PDC_M14)
+    cache.plan_de_compte(_PDC_M57)
+    assert cache.plan_de_compte(_PDC_M14) is m14
+
+    cache.plan_de_compte(_PDC_M4)  # M57 est le moins récemment utilisé
+    assert len(cache) == 2
+    assert cache.plan_de_compte(_PDC_M14) is m14
+    assert (cache.hits, cache.misses) == (2, 3)
+
+    cache.plan_de_compte(_PDC_M57)
+    assert cache.misses == 4
+
+
+def test_cache_partage_entre_conversions():
+    cache = CachePlansDeComptes()
+    convertisseurs = [ConvertisseurTotemBudget(cache_pdc=cache) for _ in range(2)]
+
+    for convertisseur in convertisseurs:
+        convertisseur.totem_budget_vers_scdl(
+            totem_fpath=A_LA_MARGE_PATH / "totem.xml",
+            pdcs_dpath=PLANS_DE_COMPTE_PATH,
+            output=io.StringIO(),
+        )
+
+    assert cache.misses == 1
+    assert len(cache) == 1
+
+
+def test_index_equivalent_xpath():
+    cache = CachePlansDeComptes()
+    pdc_tree = cache.plan_de_compte(_PDC_M57)
+    index = cache.index(_PDC_M57)
+
+    for code in ["6042", "2031", "65", "not_a_code"]:
+        libelles = pdc_tree.xpath(
+            "/Nomenclature/Nature/Comptes//Compte[@Code=$code]/@Libelle", code=code
+        )
+        assert index.libelles_comptes.get(code, "") == (libelles[0] if libelles else "")
+
+    for code in ["011", "20", "not_a_code"]:
+        sections = pdc_tree.xpath(
+            "/Nomenclature/Nature/Chapitres/Chapitre[@Code=$code]/@Section", code=code
+        )
+        assert index.sections_chapitres.get(code, "") == (sections[0] if sections else "")
+
+
+@pytest.fixture(scope="module")
+def _compiles(tmp_path_factory) -> PlansDeComptesCompiles:
+    compile_fpath = tmp_path_factory.mktemp("pdc") / "plans_de_comptes.sqlite"
+    nb_plans = compiler_plans_de_comptes(PLANS_DE_COMPTE_PATH, compile_fpath)
+    assert nb_plans == len(list(PLANS_DE_COMPTE_PATH.glob("*/*/*/planDeCompte.xml")))
+    return PlansDeComptesCompiles(compile_fpath)
+
+
+def test_plans_compiles_identiques(_compiles: PlansDeComptesCompiles):
+    cache = CachePlansDeComptes()
+    for pdc_fpath in [_PDC_M14, _PDC_M57, _PDC_M4]:
+        assert _compiles.index_pour_chemin(pdc_fpath) == cache.index(pdc_fpath)
+
+    assert _compiles.contient("2022", "M57-M57")
+    assert not _compiles.contient("2022", "M57-INCONNUE")
+    assert _compiles.index_pour_chemin(A_LA_MARGE_PATH / "totem.xml") is None
+
+
+@pytest.mark.parametrize("moteur", [MoteurConversion.XSLT, MoteurConversion.NATIF])
+@pytest.mark.parametrize(
+    "totem_path",
+    [
+        d / "totem.xml"
+        for d in examples_directories()
+        if isdir(d)
+        and (d / "totem.xml").exists()
+        and not (d / "totem2xmlcsv-custom.xsl").exists()
+    ],
+)
+def test_conversion_plans_compiles(
+    _compiles: PlansDeComptesCompiles, moteur: MoteurConversion, totem_path: Path
+):
+    attendu = io.StringIO()
+    ConvertisseurTotemBudget(moteur=moteur).totem_budget_vers_scdl(
+        totem_path, PLANS_DE_COMPTE_PATH, attendu
+    )
+
+    cache = CachePlansDeComptes(compiles=_compiles)
+    candidat = io.StringIO()
+    ConvertisseurTotemBudget(moteur=moteur, cache_pdc=cache).totem_budget_vers_scdl(
+        totem_path, PLANS_DE_COMPTE_PATH, candidat
+    )
+
+    assert candidat.getvalue() == attendu.getvalue()
+    # Aucun plan de compte XML n'a été parsé
+    assert cache.misses == 0
+
+
+def test_xslt_sans_extensions():
+    # Un processeur XSLT sans les fonctions yat:* lit le plan de compte par document()
+    exemple_dpath = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000"
+    transform = etree.XSLT(etree.parse(str(_BUDGET_XSLT)))
+    resultat = transform(
+        etree.parse(str(exemple_dpath / "totem.xml")), plandecompte=etree.XSLT.strparam(str(_PDC_M14))
+    )
+
+    output = io.StringIO(newline="")
+    _xml_to_csv(resultat, output, Options())
+    assert output.getvalue() == (exemple_dpath / "expected.csv").read_bytes().decode("utf-8")
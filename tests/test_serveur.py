@@ -0,0 +1,176 @@
+import importlib.util
+import os
+import signal
+import socket
+import threading
+import time
+from http.client import HTTPConnection
+from pathlib import Path
+
+import pytest
+
+from yatotem2scdl.serveur import ServeurConversion
+
+from data import A_LA_MARGE_PATH, EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+_GENERATEUR = Path(__file__).parent.parent / "benchmarks" / "generer_totem.py"
+_spec = importlib.util.spec_from_file_location("generer_totem", _GENERATEUR)
+generer_totem = importlib.util.module_from_spec(_spec)  # type: ignore[arg-type]
+_spec.loader.exec_module(generer_totem)  # type: ignore[union-attr]
+
+
+@pytest.fixture(scope="module")
+def _serveur():
+    serveur = ServeurConversion(("127.0.0.1", 0), PLANS_DE_COMPTE_PATH, workers=1, max_attente=0)
+    thread = threading.Thread(target=serveur.serve_forever, daemon=True)
+    thread.start()
+    yield serveur
+    serveur.shutdown()
+    serveur.server_close()
+
+
+def _post(serveur: ServeurConversion, totem_fpath: Path, query: str = ""):
+    connexion = HTTPConnection("127.0.0.1", serveur.server_port)
+    connexion.request("POST", f"/budget{query}", body=totem_fpath.read_bytes())
+    reponse = connexion.getresponse()
+    return reponse.status, reponse.read()
+
+
+def test_conversion(_serveur):
+    exemple_dpath = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000"
+
+    for _ in range(2):
+        status, corps = _post(_serveur, exemple_dpath / "totem.xml")
+        assert status == 200
+        assert corps == (exemple_dpath / "expected.csv").read_bytes()
+
+
+def test_reponse_au_fil_de_la_conversion(_serveur, tmp_path: Path):
+    totem_fpath = tmp_path / "totem.xml"
+    generer_totem.ecrire_totem(totem_fpath, 5000)
+    connexion = HTTPConnection("127.0.0.1", _serveur.server_port)
+    connexion.request("POST", "/budget", body=totem_fpath.read_bytes())
+    reponse = connexion.getresponse()
+
+    assert reponse.status == 200
+    assert reponse.getheader("Transfer-Encoding") == "chunked"
+    debut = reponse.read1()
+    # Le SCDL non lu bloque l'écriture de la conversion, qui occupe donc toujours la place du pool
+    place = _serveur.reserver_place()
+    if place:
+        _serveur.liberer_place()
+    assert not place
+    scdl = (debut + reponse.read()).decode("utf-8")
+    assert len(scdl.splitlines()) == 5001
+    assert _serveur.reserver_place()
+    _serveur.liberer_place()
+
+
+def test_client_parti_en_cours_de_reponse(_serveur, tmp_path: Path):
+    totem_fpath = tmp_path / "totem.xml"
+    generer_totem.ecrire_totem(totem_fpath, 5000)
+    connexion = HTTPConnection("127.0.0.1", _serveur.server_port)
+    connexion.request("POST", "/budget", body=totem_fpath.read_bytes())
+    reponse = connexion.getresponse()
+    reponse.read1()
+    connexion.close()
+
+    # La conversion n'attend pas indéfiniment un lecteur: la place du pool est libérée
+    limite = time.monotonic() + 60
+    while not _serveur.reserver_place():
+        assert time.monotonic() < limite
+        time.sleep(0.05)
+    _serveur.liberer_place()
+    status, _ = _post(_serveur, A_LA_MARGE_PATH / "mauvais_totem.xml")
+    assert status == 422
+
+
+def test_conversion_sans_entetes(_serveur):
+    exemple_dpath = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000"
+
+    status, corps = _post(_serveur, exemple_dpath / "totem.xml", "?entetes=false")
+
+    assert status == 200
+    assert corps == (exemple_dpath / "expected.csv").read_bytes().split(b"\n", 1)[1]
+
+
+def test_mauvais_totem(_serveur):
+    status, _ = _post(_serveur, A_LA_MARGE_PATH / "mauvais_totem.xml")
+    assert status == 422
+
+
+def test_pool_plein(_serveur):
+    assert _serveur.reserver_place()
+    try:
+        status, _ = _post(_serveur, A_LA_MARGE_PATH / "totem.xml")
+        assert status == 503
+    finally:
+        _serveur.liberer_place()
+
+
+def _post_brut(serveur: ServeurConversion, content_length: str, corps: bytes = b"") -> int:
+    """Envoie une requête dont le corps peut être plus court que Content-Length, puis ferme l'envoi"""
+    with socket.create_connection(("127.0.0.1", serveur.server_port)) as connexion:
+        connexion.sendall(
+            f"POST /budget HTTP/1.1\r\nHost: test\r\nContent-Length: {content_length}\r\n\r\n".encode()
+            + corps
+        )
+        connexion.shutdown(socket.SHUT_WR)
+        reponse = connexion.makefile("rb").readline()
+    return int(reponse.split()[1])
+
+
+@pytest.mark.parametrize("content_length", ["abc", "-1"])
+def test_content_length_invalide(_serveur, content_length: str):
+    assert _post_brut(_serveur, content_length) == 400
+
+
+def test_requete_tronquee(_serveur):
+    assert _post_brut(_serveur, "1000", b"<DocumentBudgetaire") == 400
+    # La place réservée pour la conversion a été libérée
+    status, _ = _post(_serveur, A_LA_MARGE_PATH / "mauvais_totem.xml")
+    assert status == 422
+
+
+def test_envoi_lent_sans_place(_serveur):
+    # Un client qui n'envoie pas la fin du fichier n'occupe pas la seule place du pool
+    with socket.create_connection(("127.0.0.1", _serveur.server_port)) as lent:
+        lent.sendall(b"POST /budget HTTP/1.1\r\nHost: test\r\nContent-Length: 1000\r\n\r\n<Document")
+        status, _ = _post(_serveur, A_LA_MARGE_PATH / "mauvais_totem.xml")
+        assert status == 422
+        lent.shutdown(socket.SHUT_WR)
+        assert int(lent.makefile("rb").readline().split()[1]) == 400
+
+
+def test_delai_envoi():
+    serveur = ServeurConversion(("127.0.0.1", 0), PLANS_DE_COMPTE_PATH, workers=1, delai_reseau=0.2)
+    thread = threading.Thread(target=serveur.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with socket.create_connection(("127.0.0.1", serveur.server_port)) as lent:
+            lent.sendall(b"POST /budget HTTP/1.1\r\nHost: test\r\nContent-Length: 1000\r\n\r\n<Document")
+            reponse = lent.makefile("rb").readline()
+        assert int(reponse.split()[1]) == 408
+    finally:
+        serveur.shutdown()
+        serveur.server_close()
+
+
+def test_processus_tue():
+    exemple_dpath = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000"
+    serveur = ServeurConversion(("127.0.0.1", 0), PLANS_DE_COMPTE_PATH, workers=1)
+    thread = threading.Thread(target=serveur.serve_forever, daemon=True)
+    thread.start()
+    try:
+        assert _post(serveur, exemple_dpath / "totem.xml")[0] == 200
+        for pid in list(serveur._ServeurConversion__executor._processes):  # type: ignore[attr-defined]
+            os.kill(pid, signal.SIGKILL)
+
+        assert _post(serveur, exemple_dpath / "totem.xml")[0] == 500
+        # Le pool est recréé pour les requêtes suivantes
+        status, corps = _post(serveur, exemple_dpath / "totem.xml")
+        assert status == 200
+        assert corps == (exemple_dpath / "expected.csv").read_bytes()
+    finally:
+        serveur.shutdown()
+        serveur.server_close()
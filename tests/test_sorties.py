@@ -0,0 +1,186 @@
+import csv
+import gzip
+import io
+import shutil
+import sys
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+from lxml import etree
+
+from yatotem2scdl import (
+    ConversionErreur,
+    ConvertisseurTotemBudget,
+    FormatSortie,
+    MoteurConversion,
+    Options,
+    convertir_lot,
+)
+from yatotem2scdl.conversion import _BUDGET_XSLT, _xml_to_csv
+from yatotem2scdl.scdl import COLONNES_SCDL_BUDGET
+from yatotem2scdl.sorties import SortieLignes, ecrire_lignes
+
+from data import EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+_EXEMPLE = EXEMPLES_PATH / "DOCBUDG-21560046100010-056025-CA-2021-01032022000000"
+_TOTEM = _EXEMPLE / "totem.xml"
+_ATTENDU = (_EXEMPLE / "expected.csv").read_bytes()
+
+
+def _convertir(format_sortie: FormatSortie, moteur: MoteurConversion = MoteurConversion.XSLT) -> bytes:
+    output = io.BytesIO()
+    ConvertisseurTotemBudget(moteur=moteur).totem_budget_vers_scdl(
+        _TOTEM, PLANS_DE_COMPTE_PATH, output, Options(format_sortie=format_sortie)
+    )
+    assert not output.closed
+    return output.getvalue()
+
+
+@pytest.mark.parametrize("moteur", [MoteurConversion.XSLT, MoteurConversion.NATIF])
+def test_csv_gzip(moteur: MoteurConversion):
+    assert gzip.decompress(_convertir(FormatSortie.CSV_GZIP, moteur)) == _ATTENDU
+
+
+def test_csv_zstd():
+    zstandard = pytest.importorskip("zstandard")
+
+    compresse = _convertir(FormatSortie.CSV_ZSTD)
+
+    assert zstandard.ZstdDecompressor().decompressobj().decompress(compresse) == _ATTENDU
+
+
+def _lignes_attendues() -> list[dict]:
+    lignes = list(csv.DictReader(io.StringIO(_ATTENDU.decode("utf-8"), newline="")))
+    montants = [c for c in COLONNES_SCDL_BUDGET if c.startswith(("BGT_MT", "BGT_CREDOUV"))]
+    for ligne in lignes:
+        for colonne, valeur in ligne.items():
+            if valeur == "":
+                ligne[colonne] = None
+            elif colonne in montants:
+                ligne[colonne] = Decimal(valeur)
+            elif colonne == "BGT_ANNEE":
+                ligne[colonne] = int(valeur)
+    return lignes
+
+
+@pytest.mark.parametrize("moteur", [MoteurConversion.XSLT, MoteurConversion.NATIF])
+def test_parquet(moteur: MoteurConversion):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(io.BytesIO(_convertir(FormatSortie.PARQUET, moteur)))
+
+    assert table.column_names == COLONNES_SCDL_BUDGET
+    assert str(table.schema.field("BGT_MTREAL").type) == "decimal128(18, 2)"
+    assert table.to_pylist() == _lignes_attendues()
+
+
+def test_arrow():
+    pa = pytest.importorskip("pyarrow")
+
+    table = pa.ipc.open_stream(_convertir(FormatSortie.ARROW)).read_all()
+
+    assert table.to_pylist() == _lignes_attendues()
+
+
+def test_dependance_absente(monkeypatch):
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+
+    with pytest.raises(ConversionErreur) as err:
+        _convertir(FormatSortie.PARQUET)
+    assert "pyarrow" in str(err.value)
+
+
+def test_colonnes_declarees_identiques_xslt(tmp_path: Path):
+    # Une copie de la XSLT par défaut force la lecture de l'entête depuis la XSLT
+    xslt_fpath = tmp_path / "totem2xmlcsv.xsl"
+    shutil.copy(_BUDGET_XSLT, xslt_fpath)
+
+    entetes = ConvertisseurTotemBudget(xslt_budget=xslt_fpath).budget_scdl_entetes()
+
+    assert entetes == ",".join(COLONNES_SCDL_BUDGET)
+    assert ConvertisseurTotemBudget().budget_scdl_entetes() == entetes
+
+
+def test_lot_csv_gzip(tmp_path: Path):
+    resultats = convertir_lot(
+        [_TOTEM],
+        PLANS_DE_COMPTE_PATH,
+        tmp_path,
+        workers=1,
+        options=Options(format_sortie=FormatSortie.CSV_GZIP),
+    )
+
+    assert resultats[0].csv_fpath == tmp_path / "totem.csv.gz"
+    assert gzip.decompress(resultats[0].csv_fpath.read_bytes()) == _ATTENDU
+
+
+def test_csv_par_paquets(monkeypatch):
+    monkeypatch.setattr("yatotem2scdl.sorties._TAILLE_PAQUET_CSV", 7)
+    lignes = [[str(i), f"v,{i}"] for i in range(30)]
+    output = io.StringIO(newline="")
+
+    ecrire_lignes(["a", "b"], lignes, output, Options())
+
+    attendu = io.StringIO(newline="")
+    writer = csv.writer(attendu)
+    writer.writerow(["a", "b"])
+    writer.writerows(lignes)
+    assert output.getvalue() == attendu.getvalue()
+
+
+def test_csv_sans_ligne():
+    output = io.StringIO(newline="")
+
+    ecrire_lignes(["a", "b"], [], output, Options(inclure_header_csv=False))
+
+    assert output.getvalue() == ""
+
+
+def _xml_intermediaire(data: str):
+    return etree.ElementTree(
+        etree.fromstring(f'<csv><header><column name="a"/><column name="b"/></header><data>{data}</data></csv>')
+    )
+
+
+def test_xml_intermediaire_lignes_irregulieres():
+    tree = _xml_intermediaire(
+        '<row><cell value="1"/><cell value="2"/><cell value="3"/></row><row><cell value="4"/></row>'
+    )
+    output = io.StringIO(newline="")
+
+    _xml_to_csv(tree, output, Options(lineterminator="\n"))
+
+    assert output.getvalue() == "a,b\n1,2,3\n4\n"
+
+
+def test_xml_intermediaire_cellule_sans_valeur():
+    tree = _xml_intermediaire('<row lineno="12"><cell value="1"/><cell/></row>')
+
+    with pytest.raises(ConversionErreur) as err:
+        _xml_to_csv(tree, io.StringIO(), Options())
+    assert "12" in str(err.value)
+
+
+def test_sortie_lignes_abstraite():
+    class _SortieIncomplete(SortieLignes):
+        pass
+
+    with pytest.raises(TypeError):
+        SortieLignes()  # type: ignore[abstract]
+    with pytest.raises(TypeError):
+        _SortieIncomplete()  # type: ignore[abstract]
+
+
+@pytest.mark.parametrize("format_sortie", [FormatSortie.PARQUET, FormatSortie.ARROW])
+def test_montant_a_plus_de_deux_decimales(format_sortie: FormatSortie):
+    pytest.importorskip("pyarrow")
+    options = Options(format_sortie=format_sortie)
+
+    # Les zéros au-delà de deux décimales ne changent pas le montant
+    ecrire_lignes(["BGT_MTREAL"], [["12.300"]], io.BytesIO(), options)
+    # Un montant n'est jamais arrondi
+    with pytest.raises(ConversionErreur) as err:
+        ecrire_lignes(["BGT_MTREAL"], [["12.345"]], io.BytesIO(), options)
+    assert "'12.345'" in str(err.value)
@@ -0,0 +1,102 @@
+import gzip
+import io
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from yatotem2scdl import (
+    ConversionErreur,
+    ConvertisseurTotemBudget,
+    MoteurConversion,
+    Options,
+    lire_totem_budget_metadata,
+)
+
+from data import EXEMPLES_PATH, PLANS_DE_COMPTE_PATH
+
+_EXEMPLE = EXEMPLES_PATH / "DOCBUDG-21560046100085-056025-BP-2022-07042022000000"
+_TOTEM = _EXEMPLE / "totem.xml"
+_ATTENDU = (_EXEMPLE / "expected.csv").read_bytes().decode("utf-8")
+
+
+class _Flux:
+    """Flux réseau: ni seek ni peek"""
+
+    def __init__(self, contenu: bytes):
+        self.__contenu = io.BytesIO(contenu)
+
+    def read(self, taille: int = -1) -> bytes:
+        return self.__contenu.read(taille)
+
+
+def _zip(contenu: bytes, *noms: str) -> bytes:
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w") as z:
+        for nom in noms:
+            z.writestr(nom, contenu)
+    return archive.getvalue()
+
+
+def _sources(tmp_path: Path) -> dict:
+    contenu = _TOTEM.read_bytes()
+    gz_fpath = tmp_path / "totem.xml.gz"
+    gz_fpath.write_bytes(gzip.compress(contenu))
+    zip_fpath = tmp_path / "totem.zip"
+    zip_fpath.write_bytes(_zip(contenu, "totem.xml"))
+    return {
+        "chemin": _TOTEM,
+        "str": str(_TOTEM),
+        "bytes": contenu,
+        "BytesIO": io.BytesIO(contenu),
+        "flux": _Flux(contenu),
+        "gzip": gz_fpath,
+        "gzip flux": _Flux(gzip.compress(contenu)),
+        "zip": zip_fpath,
+        "zip flux": _Flux(_zip(contenu, "totem.xml")),
+    }
+
+
+_NOMS_SOURCES = ["chemin", "str", "bytes", "BytesIO", "flux", "gzip", "gzip flux", "zip", "zip flux"]
+
+
+@pytest.mark.parametrize("nom", _NOMS_SOURCES)
+@pytest.mark.parametrize(
+    "moteur, streaming",
+    [(MoteurConversion.XSLT, False), (MoteurConversion.NATIF, False), (MoteurConversion.XSLT, True)],
+)
+def test_conversion_sources(tmp_path: Path, nom: str, moteur: MoteurConversion, streaming: bool):
+    source = _sources(tmp_path)[nom]
+    output = io.StringIO(newline="")
+
+    ConvertisseurTotemBudget(moteur=moteur).totem_budget_vers_scdl(
+        source, PLANS_DE_COMPTE_PATH, output, Options(streaming=streaming)
+    )
+
+    assert output.getvalue() == _ATTENDU
+
+
+@pytest.mark.parametrize("nom", _NOMS_SOURCES)
+def test_metadata_sources(tmp_path: Path, nom: str):
+    attendu = ConvertisseurTotemBudget().totem_budget_metadata(_TOTEM, PLANS_DE_COMPTE_PATH)
+
+    assert ConvertisseurTotemBudget().totem_budget_metadata(
+        _sources(tmp_path)[nom], PLANS_DE_COMPTE_PATH
+    ) == attendu
+    assert lire_totem_budget_metadata(_sources(tmp_path)[nom], PLANS_DE_COMPTE_PATH) == attendu
+
+
+def test_zip_plusieurs_xml():
+    with pytest.raises(ConversionErreur):
+        ConvertisseurTotemBudget().totem_budget_vers_scdl(
+            _zip(_TOTEM.read_bytes(), "a.xml", "b.xml"), PLANS_DE_COMPTE_PATH, io.StringIO()
+        )
+
+
+def test_flux_texte_refuse():
+    with open(_TOTEM, "r", encoding="utf-8") as totem:
+        with pytest.raises(ConversionErreur) as err:
+            ConvertisseurTotemBudget().totem_budget_vers_scdl(
+                totem, PLANS_DE_COMPTE_PATH, io.StringIO()
+            )
+    assert isinstance(err.value.__cause__, TypeError)
@@ -0,0 +1,90 @@
+import csv
+import importlib.util
+import io
+from pathlib import Path
+
+import pytest
+from lxml import etree
+
+from yatotem2scdl import ConvertisseurTotemBudget, EtapeBudgetaire, MoteurConversion, Options
+from yatotem2scdl import moteur_natif
+from yatotem2scdl.plan_de_compte import CachePlansDeComptes
+
+from data import PLANS_DE_COMPTE_PATH
+
+_GENERATEUR = Path(__file__).parent.parent / "benchmarks" / "generer_totem.py"
+_spec = importlib.util.spec_from_file_location("generer_totem", _GENERATEUR)
+generer_totem = importlib.util.module_from_spec(_spec)  # type: ignore[arg-type]
+_spec.loader.exec_module(generer_totem)  # type: ignore[union-attr]
+
+
+def _scdl(totem_fpath: Path, moteur: MoteurConversion = MoteurConversion.XSLT) -> list[dict]:
+    output = io.StringIO(newline="")
+    ConvertisseurTotemBudget(moteur=moteur).totem_budget_vers_scdl(totem_fpath, PLANS_DE_COMPTE_PATH, output)
+    return list(csv.DictReader(io.StringIO(output.getvalue(), newline="")))
+
+
+@pytest.mark.parametrize("moteur", [MoteurConversion.XSLT, MoteurConversion.NATIF])
+def test_lignes_calculees_ignorees(tmp_path: Path, moteur: MoteurConversion):
+    totem_fpath = tmp_path / "totem.xml"
+    generer_totem.ecrire_totem(totem_fpath, 200, proportion_calculees=0.5)
+
+    assert 'calculated="true"' in totem_fpath.read_text(encoding="utf-8")
+    lignes = _scdl(totem_fpath, moteur)
+    assert len(lignes) == 200
+    # Les codes du plan de compte sont retrouvés par la conversion
+    assert all(ligne["BGT_NATURE_LABEL"] and ligne["BGT_CONTNAT_LABEL"] for ligne in lignes)
+    assert {ligne["BGT_SECTION"] for ligne in lignes} == {"fonctionnement", "investissement"}
+
+
+def test_etapes(tmp_path: Path):
+    primitif_fpath = tmp_path / "primitif.xml"
+    ca_fpath = tmp_path / "ca.xml"
+    generer_totem.ecrire_totem(primitif_fpath, 50, EtapeBudgetaire.PRIMITIF)
+    generer_totem.ecrire_totem(ca_fpath, 50, EtapeBudgetaire.COMPTE_ADMIN)
+
+    metadata = ConvertisseurTotemBudget().totem_budget_metadata(ca_fpath, PLANS_DE_COMPTE_PATH)
+    assert metadata.etape_budgetaire is EtapeBudgetaire.COMPTE_ADMIN
+    assert metadata.annee_exercice == 2022
+
+    primitif, ca = _scdl(primitif_fpath), _scdl(ca_fpath)
+    assert [ligne["BGT_NATURE"] for ligne in primitif] == [ligne["BGT_NATURE"] for ligne in ca]
+    assert all(ligne["BGT_MTREAL"] == "" for ligne in primitif)
+    assert all(ligne["BGT_MTREAL"] != "" for ligne in ca)
+
+
+def test_streaming_libere_les_elements(tmp_path: Path, monkeypatch):
+    totem_fpath = tmp_path / "totem.xml"
+    generer_totem.ecrire_totem(totem_fpath, 2000)
+    racines = []
+    liberer = moteur_natif._liberer
+
+    def _liberer(element):
+        racines.append(element.getroottree().getroot())
+        liberer(element)
+
+    monkeypatch.setattr(moteur_natif, "_liberer", _liberer)
+    cache_pdc = CachePlansDeComptes()
+    index = cache_pdc.index(PLANS_DE_COMPTE_PATH / "2022" / "M14" / "M14_COM_500_3500" / "planDeCompte.xml")
+
+    # Nombre d'éléments de l'arbre en cours de construction après chaque ligne produite
+    elements = []
+    for _ in moteur_natif.lignes_scdl_flux(str(totem_fpath), lambda nomenclature, annee: index):
+        if racines:
+            elements.append(sum(1 for _ in racines[-1].iter()))
+
+    assert len(elements) == 1999
+    # Seuls les éléments lus en avance par le parseur sont dans l'arbre, pas les LigneBudget déjà produites
+    total = sum(1 for _ in etree.parse(str(totem_fpath)).iter())
+    assert max(elements) < total / 10
+
+
+def test_streaming_sans_xml_intermediaire(tmp_path: Path, caplog):
+    totem_fpath = tmp_path / "totem.xml"
+    generer_totem.ecrire_totem(totem_fpath, 10)
+    options = Options(streaming=True, xml_intermediaire_path=str(tmp_path / "intermediaire.xml"))
+
+    ConvertisseurTotemBudget().totem_budget_vers_scdl(totem_fpath, PLANS_DE_COMPTE_PATH, io.StringIO(), options)
+
+    assert "xml_intermediaire_path est ignorée" in caplog.text
+    assert not (tmp_path / "intermediaire.xml").exists()